@@ -1,6 +1,7 @@
-from .runner import Runner
+from .runner import Runner, run_many
 from .parameter_generator import ParameterGenerator
 from .script_maker import ScriptMaker
+from .walltime_predictor import WalltimePredictor
 from .utils import (
     parse_paths,
     verbose_print,
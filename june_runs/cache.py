@@ -0,0 +1,325 @@
+import os
+import sys
+import json
+import fcntl
+import pickle
+import shutil
+import hashlib
+from pathlib import Path
+from contextlib import contextmanager
+from collections import defaultdict
+
+import numpy as np
+
+statistics_filename = "statistics.jsonl"
+
+
+def get_cache_key(key: dict):
+    """
+    Content hash of a dictionary describing what a cache entry depends on.
+    """
+    key_string = json.dumps(key, sort_keys=True, default=str)
+    return hashlib.sha256(key_string.encode()).hexdigest()[:32]
+
+
+def get_directory_checksum(directory_path):
+    """
+    Checksum of the names and contents of all the files in a directory, used
+    to invalidate entries derived from input data when the data changes.
+    """
+    checksum = hashlib.sha256()
+    directory_path = Path(directory_path)
+    if not directory_path.exists():
+        return None
+    for path in sorted(directory_path.rglob("*")):
+        if path.is_file():
+            checksum.update(str(path.relative_to(directory_path)).encode())
+            with open(path, "rb") as f:
+                checksum.update(f.read())
+    return checksum.hexdigest()
+
+
+def get_files_checksum(file_paths):
+    """
+    Checksum of the contents of a list of files, missing files are skipped.
+    """
+    checksum = hashlib.sha256()
+    for path in file_paths:
+        path = Path(path)
+        if path.is_file():
+            checksum.update(path.name.encode())
+            with open(path, "rb") as f:
+                checksum.update(f.read())
+    return checksum.hexdigest()
+
+
+class _CachePickler(pickle.Pickler):
+    """
+    Optionally stores numpy arrays as separate .npy files next to the pickle,
+    so that they can be memory-mapped when the entry is read, and replaces
+    objects known to ``references`` by a reference to them.
+    """
+
+    def __init__(self, file, arrays_path=None, references=None):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.arrays_path = arrays_path
+        self.references = references
+        self.n_arrays = 0
+
+    def persistent_id(self, obj):
+        if self.references is not None:
+            reference = self.references.persistent_id(obj)
+            if reference is not None:
+                return reference
+        if (
+            self.arrays_path is None
+            or not isinstance(obj, np.ndarray)
+            or obj.dtype.hasobject
+        ):
+            return None
+        array_name = f"{self.n_arrays}.npy"
+        np.save(self.arrays_path / array_name, obj)
+        self.n_arrays += 1
+        return array_name
+
+
+class _CacheUnpickler(pickle.Unpickler):
+    def __init__(self, file, arrays_path, references=None):
+        super().__init__(file)
+        self.arrays_path = arrays_path
+        self.references = references
+
+    def persistent_load(self, persistent_id):
+        if isinstance(persistent_id, str):
+            return np.load(self.arrays_path / persistent_id, mmap_mode="r")
+        return self.references.persistent_load(persistent_id)
+
+
+class ObjectReferences:
+    """
+    Lets cached objects point to the attributes of a container (eg. a domain)
+    and to the elements of its iterable attributes (people, areas, venues...)
+    without copying them. They are stored as (attribute name, position) and
+    resolved against the container the entry is read with, which must be
+    built in the same way.
+    """
+
+    primitive_types = (str, bytes, int, float, bool, np.ndarray, np.generic)
+
+    def __init__(self, container):
+        self.container = container
+        self._members = {}
+        self._ids = None
+
+    def _build_ids(self):
+        ids = {}
+        for name, value in vars(self.container).items():
+            if value is None or isinstance(value, self.primitive_types + (dict,)):
+                continue
+            ids[id(value)] = ("attribute", name)
+            try:
+                members = list(value)
+            except TypeError:
+                continue
+            # keep the members alive, so that their ids are not reused
+            self._members[name] = members
+            for position, member in enumerate(members):
+                if member is None or isinstance(member, self.primitive_types):
+                    continue
+                ids.setdefault(id(member), ("member", name, position))
+        return ids
+
+    def persistent_id(self, obj):
+        if self._ids is None:
+            self._ids = self._build_ids()
+        return self._ids.get(id(obj))
+
+    def persistent_load(self, persistent_id):
+        if persistent_id[0] == "attribute":
+            return getattr(self.container, persistent_id[1])
+        _, name, position = persistent_id
+        if name not in self._members:
+            self._members[name] = list(getattr(self.container, name))
+        return self._members[name][position]
+
+
+class DiskCache:
+    """
+    Content-keyed cache on disk, shared by all the runs of a run set.
+    Every entry is a directory holding the key it was stored with and the
+    value. When the cache grows over ``max_size`` (GB) or ``max_entries``,
+    the least recently used entries are removed.
+    """
+
+    def __init__(self, cache_path, max_size=10, max_entries=None):
+        self.cache_path = Path(cache_path)
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self.cache_path.mkdir(exist_ok=True, parents=True)
+
+    @classmethod
+    def from_configuration(cls, cache_path, cache_configuration: dict = None):
+        cache_configuration = cache_configuration or {}
+        return cls(
+            cache_path=cache_configuration.get("cache_path", cache_path),
+            max_size=cache_configuration.get("max_size", 10),
+            max_entries=cache_configuration.get("max_entries", None),
+        )
+
+    def _entry_path(self, name, key: dict):
+        return self.cache_path / f"{name}_{get_cache_key(key)}"
+
+    @contextmanager
+    def _lock(self):
+        with open(self.cache_path / ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def get(
+        self, name, key: dict, default=None, record_statistics=True, references=None
+    ):
+        """
+        Returns the cached value, or ``default`` if there is none. Arrays of
+        entries stored with ``memory_map=True`` are read-only memory maps, and
+        objects stored as references are looked up in ``references``.
+        """
+        entry_path = self._entry_path(name, key)
+        try:
+            with open(entry_path / "value.pkl", "rb") as f:
+                value = _CacheUnpickler(
+                    f, entry_path / "arrays", references=references
+                ).load()
+            # the modification time of the entry marks its last use
+            os.utime(entry_path)
+        except FileNotFoundError:
+            value = default
+        if record_statistics:
+            self._record(name, hit=value is not default)
+        return value
+
+    def put(self, name, key: dict, value, memory_map=False, references=None):
+        entry_path = self._entry_path(name, key)
+        temporary_path = entry_path.with_name(f"{entry_path.name}.{os.getpid()}.tmp")
+        temporary_path.mkdir(parents=True, exist_ok=True)
+        with open(temporary_path / "key.json", "w") as f:
+            json.dump(key, f, indent=4, default=str)
+        arrays_path = None
+        if memory_map:
+            arrays_path = temporary_path / "arrays"
+            arrays_path.mkdir()
+        try:
+            with open(temporary_path / "value.pkl", "wb") as f:
+                _CachePickler(
+                    f, arrays_path=arrays_path, references=references
+                ).dump(value)
+        except Exception:
+            shutil.rmtree(temporary_path, ignore_errors=True)
+            raise
+        self._insert(temporary_path, entry_path)
+
+    def _record(self, name, hit):
+        with open(self.cache_path / statistics_filename, "a") as f:
+            f.write(json.dumps({"name": name, "hit": hit}) + "\n")
+
+    def statistics(self):
+        """
+        Hits, misses and hit rate of every kind of entry since the cache was created.
+        """
+        statistics = defaultdict(lambda: {"hits": 0, "misses": 0})
+        statistics_path = self.cache_path / statistics_filename
+        if statistics_path.exists():
+            with open(statistics_path, "r") as f:
+                for line in f:
+                    record = json.loads(line)
+                    statistics[record["name"]]["hits" if record["hit"] else "misses"] += 1
+        for name_statistics in statistics.values():
+            total = name_statistics["hits"] + name_statistics["misses"]
+            name_statistics["hit_rate"] = name_statistics["hits"] / total
+        return dict(statistics)
+
+    def _insert(self, temporary_path, entry_path):
+        with self._lock():
+            if entry_path.exists():
+                # someone else stored it in the meantime
+                shutil.rmtree(temporary_path)
+            else:
+                os.rename(temporary_path, entry_path)
+            self._evict(keep=entry_path)
+
+    def get_or_compute(
+        self, name, key: dict, function, *args, memory_map=False, **kwargs
+    ):
+        """
+        Returns the cached value for ``key``, or calls ``function`` and caches
+        what it returns.
+        """
+        value = self.get(name, key)
+        if value is None:
+            value = function(*args, **kwargs)
+            self.put(name, key, value, memory_map=memory_map)
+        return value
+
+    def get_or_compute_shared(
+        self, name, key: dict, function, *args, comm, memory_map=False, **kwargs
+    ):
+        """
+        Same as ``get_or_compute`` for all the ranks of ``comm``. Rank 0 fills
+        the cache, then the other ranks read the entry, so memory-mapped arrays
+        are shared by the ranks of a node. If another job evicted the entry in
+        the meantime, rank 0 broadcasts its value instead.
+        """
+        if comm.Get_rank() == 0:
+            value = self.get_or_compute(
+                name, key, function, *args, memory_map=memory_map, **kwargs
+            )
+        comm.Barrier()
+        if comm.Get_rank() > 0:
+            value = self.get(name, key, record_statistics=False)
+        if comm.allreduce(0 if value is None else 1) < comm.Get_size():
+            value = comm.bcast(value if comm.Get_rank() == 0 else None, root=0)
+        return value
+
+    def entries(self):
+        """
+        Entries sorted from least to most recently used.
+        """
+        entries = [
+            path
+            for path in self.cache_path.iterdir()
+            if path.is_dir() and not path.name.endswith(".tmp")
+        ]
+        return sorted(entries, key=lambda path: path.stat().st_mtime)
+
+    @staticmethod
+    def _entry_size(entry_path):
+        return sum(path.stat().st_size for path in entry_path.rglob("*")) / 1024 ** 3
+
+    def size(self):
+        return sum(self._entry_size(entry) for entry in self.entries())
+
+    def _evict(self, keep=None):
+        entries = self.entries()
+        sizes = [self._entry_size(entry) for entry in entries]
+        total_size = sum(sizes)
+        for entry, entry_size in zip(entries, sizes):
+            too_big = self.max_size is not None and total_size > self.max_size
+            too_many = self.max_entries is not None and len(entries) > self.max_entries
+            if not (too_big or too_many):
+                break
+            if entry == keep:
+                continue
+            shutil.rmtree(entry, ignore_errors=True)
+            total_size -= entry_size
+            entries = [e for e in entries if e != entry]
+
+
+if __name__ == "__main__":
+    # hit rates of a run set: python3 -m june_runs.cache run_name/cache
+    for name, name_statistics in DiskCache(sys.argv[1]).statistics().items():
+        print(
+            f"{name}: {name_statistics['hits']} hits, {name_statistics['misses']} misses, "
+            f"hit rate {100 * name_statistics['hit_rate']:.1f}%"
+        )
@@ -0,0 +1,160 @@
+import sys
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+subsystems = ("seeding", "activity", "interaction", "infection", "health")
+
+
+def get_run_seed(run_set_seed, run_number):
+    """
+    Seed of run ``run_number`` of a run set. It only depends on the run number,
+    so the policy variants of a parameter set share it.
+    """
+    return int(np.random.SeedSequence([run_set_seed, run_number]).generate_state(1)[0])
+
+
+def get_stream_seed(random_seed, rank, subsystem, step, replicate=0):
+    """
+    Seed of the random stream of ``subsystem`` on ``rank`` at ``step``
+    (minutes since the start of the simulation).
+    """
+    return int(
+        np.random.SeedSequence(
+            [random_seed, replicate, rank, subsystems.index(subsystem), step]
+        ).generate_state(1)[0]
+    )
+
+
+class RandomStreams:
+    """
+    Common random numbers for runs that only differ in their policies.
+    JUNE draws everything from the global numpy / random / numba generators,
+    so instead of keeping a generator per subsystem, the global generators are
+    reseeded from (seed, replicate, rank, subsystem, time step) whenever a
+    subsystem starts its work. A policy that changes the number of draws of a
+    subsystem only shifts its own draws, and only until the next reseed.
+    """
+
+    def __init__(self, random_seed, rank, set_seed, replicate=0):
+        self.random_seed = random_seed
+        self.rank = rank
+        self.set_seed = set_seed
+        self.replicate = replicate
+        self.timer = None
+
+    @property
+    def step(self):
+        if self.timer is None:
+            return 0
+        return int(round(self.timer.now * 24 * 60))
+
+    def seed(self, subsystem):
+        self.set_seed(
+            get_stream_seed(
+                self.random_seed,
+                rank=self.rank,
+                subsystem=subsystem,
+                step=self.step,
+                replicate=self.replicate,
+            )
+        )
+
+    def wrap(self, obj, method_name, subsystem, next_subsystem=None):
+        """
+        Makes ``obj.method_name`` reseed the stream of ``subsystem`` before it
+        runs, and that of ``next_subsystem`` after it, if given.
+        """
+        method = getattr(obj, method_name, None)
+        if method is None:
+            return
+
+        def wrapped(*args, **kwargs):
+            self.seed(subsystem)
+            result = method(*args, **kwargs)
+            if next_subsystem is not None:
+                self.seed(next_subsystem)
+            return result
+
+        setattr(obj, method_name, wrapped)
+
+    def install(self, simulator):
+        self.timer = simulator.timer
+        if simulator.infection_seed is not None:
+            self.wrap(simulator.infection_seed, "unleash_virus_per_day", "seeding")
+        # the interaction loop runs right after people are distributed
+        self.wrap(
+            simulator.activity_manager,
+            "do_timestep",
+            "activity",
+            next_subsystem="interaction",
+        )
+        self.wrap(simulator, "infect_people", "infection")
+        self.wrap(simulator, "update_health_status", "health")
+        return simulator
+
+
+def read_policy_summaries(results_path):
+    """
+    Summaries of all the runs of a run set with several policy files, with the
+    policy and run number of every row.
+    """
+    summaries = []
+    for summary_path in sorted(Path(results_path).glob("*/run_*/summary.csv")):
+        summary = pd.read_csv(summary_path)
+        summary.insert(0, "run", int(summary_path.parent.name.split("_")[-1]))
+        summary.insert(0, "policy", summary_path.parent.parent.name)
+        summaries.append(summary)
+    if not summaries:
+        raise ValueError(f"No policy summaries found in {results_path}.")
+    return pd.concat(summaries, ignore_index=True)
+
+
+def get_paired_differences(results_path, baseline, columns=None, by_region=False):
+    """
+    Differences between every policy and the ``baseline`` policy, paired by run
+    (and replicate), so that runs with the same parameters and random streams
+    are compared. Returns one row per policy, run and time stamp.
+    """
+    summaries = read_policy_summaries(results_path)
+    keys = ["run", "time_stamp"]
+    if "replicate" in summaries.columns:
+        keys.append("replicate")
+    if by_region:
+        keys.append("region")
+    if columns is None:
+        columns = [
+            column
+            for column in summaries.select_dtypes("number").columns
+            if column not in keys
+        ]
+    summaries = summaries.groupby(["policy"] + keys)[columns].sum()
+    policies = summaries.index.get_level_values("policy").unique()
+    if baseline not in policies:
+        raise ValueError(f"Baseline policy {baseline} not found in {results_path}.")
+    baseline_summaries = summaries.loc[baseline]
+    differences = []
+    for policy in policies:
+        if policy == baseline:
+            continue
+        difference = summaries.loc[policy] - baseline_summaries
+        difference.insert(0, "policy", policy)
+        differences.append(difference.dropna().reset_index())
+    return pd.concat(differences, ignore_index=True)
+
+
+def summarise_paired_differences(differences, column):
+    """
+    Mean and standard error of the paired differences of ``column`` summed
+    over time, for every policy.
+    """
+    keys = [key for key in ["policy", "run", "replicate"] if key in differences]
+    totals = differences.groupby(keys)[column].sum()
+    return totals.groupby("policy").agg(["mean", "sem", "count"])
+
+
+if __name__ == "__main__":
+    # python3 -m june_runs.common_random_numbers results_path baseline [column]
+    column = sys.argv[3] if len(sys.argv) > 3 else "daily_infected"
+    differences = get_paired_differences(sys.argv[1], baseline=sys.argv[2])
+    print(summarise_paired_differences(differences, column))
@@ -0,0 +1,48 @@
+import sys
+from mpi4py import MPI
+
+import june.mpi_setup
+
+mpi_attributes = ("mpi_comm", "mpi_rank", "mpi_size")
+
+
+def split_communicator(ranks_per_run, comm=MPI.COMM_WORLD):
+    """
+    Splits ``comm`` into groups of ``ranks_per_run`` consecutive ranks.
+    Returns the communicator of this rank's group, the group number and the
+    number of groups.
+    """
+    size = comm.Get_size()
+    if size % ranks_per_run != 0:
+        raise ValueError(
+            f"Can't split {size} ranks into groups of {ranks_per_run} ranks."
+        )
+    group = comm.Get_rank() // ranks_per_run
+    group_comm = comm.Split(color=group, key=comm.Get_rank())
+    return group_comm, group, size // ranks_per_run
+
+
+def use_communicator(comm):
+    """
+    Makes JUNE run on ``comm`` instead of MPI.COMM_WORLD. JUNE modules import
+    mpi_comm, mpi_rank and mpi_size from june.mpi_setup when they are loaded,
+    so they are replaced there and in every JUNE module already loaded.
+    """
+    values = {
+        "mpi_comm": comm,
+        "mpi_rank": comm.Get_rank(),
+        "mpi_size": comm.Get_size(),
+    }
+    previous_comm = june.mpi_setup.mpi_comm
+    for module_name, module in list(sys.modules.items()):
+        if module is None or not (
+            module_name == "june" or module_name.startswith("june.")
+        ):
+            continue
+        module_attributes = vars(module)
+        if module_attributes.get("mpi_comm", previous_comm) is not previous_comm:
+            # a communicator of its own, not the one from june.mpi_setup
+            continue
+        for name in mpi_attributes:
+            if name in module_attributes:
+                setattr(module, name, values[name])
@@ -0,0 +1,500 @@
+import sys
+import json
+import h5py
+import numpy as np
+from pathlib import Path
+
+try:
+    import pymetis
+except ImportError:
+    pymetis = None
+
+# JUNE's missing value for integer datasets
+nan_integer = -999
+
+
+def _aggregate_links(keys, weights):
+    keys, inverse = np.unique(keys, return_inverse=True)
+    return keys, np.bincount(inverse, weights=weights, minlength=len(keys))
+
+
+class SuperAreaGraph:
+    """
+    Graph of the super areas of a world. Every super area is weighted by the
+    people living in it, and the link between two super areas by the people
+    that go from one to the other: to their groups (companies, schools, care
+    homes, ...), to the stations they commute from, and, weighted by
+    ``leisure_weight``, to the social venues and households they can visit.
+    The links cut by a domain split are the people exchanged between domains
+    every time step. ``edges`` are pairs of vertex indices.
+    """
+
+    def __init__(self, super_area_ids, vertex_weights, edges, edge_weights):
+        self.super_area_ids = np.asarray(super_area_ids, dtype=np.int64)
+        self.vertex_weights = np.asarray(vertex_weights, dtype=np.float64)
+        n_vertices = len(self.super_area_ids)
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        edge_weights = np.asarray(edge_weights, dtype=np.float64)
+        # the adjacency is symmetric, without self loops
+        crossing = edges[:, 0] != edges[:, 1]
+        edges, edge_weights = edges[crossing], edge_weights[crossing]
+        sources = np.concatenate([edges[:, 0], edges[:, 1]])
+        targets = np.concatenate([edges[:, 1], edges[:, 0]])
+        keys, self.adjacency_weights = _aggregate_links(
+            sources * n_vertices + targets, np.concatenate([edge_weights] * 2)
+        )
+        self.adjacency = keys % n_vertices
+        self.offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(keys // n_vertices, minlength=n_vertices))]
+        )
+
+    @classmethod
+    def from_hdf5(cls, world_path, leisure_weight=1.0, chunk_size=1000000):
+        with h5py.File(world_path, "r") as f:
+            geography = f["geography"]
+            super_area_ids = geography["super_area_id"][:]
+            n_super_areas = len(super_area_ids)
+            super_area_sorter = np.argsort(super_area_ids)
+
+            def index(ids):
+                return super_area_sorter[
+                    np.searchsorted(super_area_ids, ids, sorter=super_area_sorter)
+                ]
+
+            area_ids = geography["area_id"][:]
+            area_sorter = np.argsort(area_ids)
+            area_super_areas = index(geography["area_super_area"][:])
+            station_commuters, station_super_areas = cls._read_station_commuters(
+                f, index
+            )
+            vertex_weights = np.zeros(n_super_areas)
+            people_per_area = np.zeros(len(area_ids))
+            keys, weights = [], []
+
+            def add_links(sources, targets, link_weights):
+                chunk_keys, chunk_weights = _aggregate_links(
+                    sources * n_super_areas + targets, link_weights
+                )
+                keys.append(chunk_keys)
+                weights.append(chunk_weights)
+
+            population = f["population"]
+            n_people = population["id"].shape[0]
+            for idx1 in range(0, n_people, chunk_size):
+                idx2 = min(idx1 + chunk_size, n_people)
+                homes = index(population["super_area"][idx1:idx2])
+                vertex_weights += np.bincount(homes, minlength=n_super_areas)
+                areas = area_sorter[
+                    np.searchsorted(
+                        area_ids, population["area"][idx1:idx2], sorter=area_sorter
+                    )
+                ]
+                people_per_area += np.bincount(areas, minlength=len(area_ids))
+                group_super_areas = population["group_super_areas"][idx1:idx2]
+                people, activities = np.nonzero(group_super_areas != nan_integer)
+                add_links(
+                    homes[people],
+                    index(group_super_areas[people, activities]),
+                    np.ones(len(people)),
+                )
+                if len(station_commuters):
+                    ids = population["id"][idx1:idx2]
+                    positions = np.searchsorted(station_commuters, ids)
+                    positions = np.minimum(positions, len(station_commuters) - 1)
+                    commuting = station_commuters[positions] == ids
+                    add_links(
+                        homes[commuting],
+                        station_super_areas[positions[commuting]],
+                        np.ones(commuting.sum()),
+                    )
+            if leisure_weight and "social_venues_super_areas" in geography:
+                venue_super_areas = geography["social_venues_super_areas"][:]
+                n_venues = np.array([len(venues) for venues in venue_super_areas])
+                if n_venues.sum() > 0:
+                    # people go to one of the social venues of their area
+                    add_links(
+                        np.repeat(area_super_areas, n_venues),
+                        index(np.concatenate(list(venue_super_areas))),
+                        np.repeat(
+                            leisure_weight * people_per_area / np.maximum(n_venues, 1),
+                            n_venues,
+                        ),
+                    )
+            if (
+                leisure_weight
+                and "households" in f
+                and "households_to_visit" in f["households"]
+            ):
+                cls._add_household_visits(
+                    f["households"], index, add_links, leisure_weight, chunk_size
+                )
+        if keys:
+            keys, weights = _aggregate_links(
+                np.concatenate(keys), np.concatenate(weights)
+            )
+        else:
+            keys, weights = np.empty(0, dtype=np.int64), np.empty(0)
+        edges = np.stack([keys // n_super_areas, keys % n_super_areas], axis=1)
+        return cls(super_area_ids, vertex_weights, edges, weights)
+
+    @staticmethod
+    def _read_station_commuters(hdf5_file, index):
+        """
+        Ids of the people commuting from every station, sorted, and the
+        (index of the) super area of their station.
+        """
+        if "stations" not in hdf5_file:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        stations = hdf5_file["stations"]
+        if len(stations["commuters"].shape) != 1:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        commuters = stations["commuters"][:]
+        n_commuters = np.array([len(station) for station in commuters])
+        if n_commuters.sum() == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        commuter_ids = np.concatenate(list(commuters)).astype(np.int64)
+        super_areas = np.repeat(index(stations["super_area"][:]), n_commuters)
+        sorter = np.argsort(commuter_ids)
+        return commuter_ids[sorter], super_areas[sorter]
+
+    @staticmethod
+    def _add_household_visits(
+        households, index, add_links, leisure_weight, chunk_size
+    ):
+        """
+        Every household visits one of the households it can visit.
+        """
+        household_ids = households["id"][:]
+        household_sorter = np.argsort(household_ids)
+        household_super_areas = index(households["super_area"][:])
+        n_households = len(household_ids)
+        for idx1 in range(0, n_households, chunk_size):
+            idx2 = min(idx1 + chunk_size, n_households)
+            to_visit = households["households_to_visit"][idx1:idx2]
+            n_to_visit = np.array([len(visits) for visits in to_visit])
+            if n_to_visit.sum() == 0:
+                continue
+            visited = np.concatenate(list(to_visit))
+            sources = np.repeat(household_super_areas[idx1:idx2], n_to_visit)
+            weights = np.repeat(leisure_weight / np.maximum(n_to_visit, 1), n_to_visit)
+            located = visited != nan_integer
+            visited = household_sorter[
+                np.searchsorted(
+                    household_ids, visited[located], sorter=household_sorter
+                )
+            ]
+            add_links(
+                sources[located], household_super_areas[visited], weights[located]
+            )
+
+    @property
+    def n_vertices(self):
+        return len(self.vertex_weights)
+
+    def neighbours(self, vertex):
+        start, stop = self.offsets[vertex], self.offsets[vertex + 1]
+        return self.adjacency[start:stop], self.adjacency_weights[start:stop]
+
+    def contract(self, labels):
+        """
+        Graph of the groups of vertices given by ``labels`` (0 to the number
+        of groups - 1), linked by the sum of the links between their vertices.
+        """
+        labels = np.asarray(labels, dtype=np.int64)
+        n_groups = labels.max() + 1
+        sources = np.repeat(np.arange(self.n_vertices), np.diff(self.offsets))
+        return SuperAreaGraph(
+            np.arange(n_groups),
+            np.bincount(labels, weights=self.vertex_weights, minlength=n_groups),
+            np.stack([labels[sources], labels[self.adjacency]], axis=1),
+            # every link is stored in both directions
+            self.adjacency_weights / 2,
+        )
+
+    def edge_cut(self, membership):
+        """
+        Total weight of the links between vertices of different parts.
+        """
+        membership = np.asarray(membership)
+        sources = np.repeat(np.arange(self.n_vertices), np.diff(self.offsets))
+        cut = membership[sources] != membership[self.adjacency]
+        return self.adjacency_weights[cut].sum() / 2
+
+
+def _match_heavy_edges(graph, max_vertex_weight, rng):
+    """
+    Pairs every vertex with the unmatched neighbour it has the heaviest link
+    with, as long as the pair is not heavier than ``max_vertex_weight``.
+    Returns the label of the pair of every vertex.
+    """
+    labels = np.full(graph.n_vertices, -1, dtype=np.int64)
+    n_labels = 0
+    for vertex in rng.permutation(graph.n_vertices):
+        if labels[vertex] >= 0:
+            continue
+        labels[vertex] = n_labels
+        neighbours, weights = graph.neighbours(vertex)
+        candidates = (labels[neighbours] < 0) & (
+            graph.vertex_weights[neighbours] + graph.vertex_weights[vertex]
+            <= max_vertex_weight
+        )
+        if candidates.any():
+            labels[neighbours[candidates][np.argmax(weights[candidates])]] = n_labels
+        n_labels += 1
+    return labels
+
+
+def _grow_parts(graph, number_of_parts, rng):
+    """
+    Initial partition, growing one part at a time from a random vertex by
+    adding the vertex most linked to it, until it has its share of the weight.
+    """
+    membership = np.full(graph.n_vertices, -1, dtype=np.int64)
+    target_weight = graph.vertex_weights.sum() / number_of_parts
+    for part in range(number_of_parts - 1):
+        unassigned = membership < 0
+        # leave at least one vertex for every part still to grow
+        max_vertices = unassigned.sum() - (number_of_parts - part - 1)
+        connection = np.zeros(graph.n_vertices)
+        part_weight = 0.0
+        n_vertices = 0
+        while n_vertices < max_vertices:
+            candidates = unassigned & (connection > 0)
+            if candidates.any():
+                vertex = np.argmax(np.where(candidates, connection, -1))
+            else:
+                vertex = rng.choice(np.where(unassigned)[0])
+            if (
+                n_vertices > 0
+                and part_weight + graph.vertex_weights[vertex] / 2 > target_weight
+            ):
+                break
+            membership[vertex] = part
+            unassigned[vertex] = False
+            part_weight += graph.vertex_weights[vertex]
+            n_vertices += 1
+            neighbours, weights = graph.neighbours(vertex)
+            connection[neighbours] += weights
+    membership[membership < 0] = number_of_parts - 1
+    return membership
+
+
+def _refine(graph, membership, number_of_parts, max_part_weight, passes=4):
+    """
+    Moves vertices to the neighbouring part they are most linked to when that
+    reduces the edge cut, or takes them out of parts over ``max_part_weight``,
+    without emptying parts or making them too heavy.
+    """
+    part_weights = np.bincount(
+        membership, weights=graph.vertex_weights, minlength=number_of_parts
+    )
+    part_sizes = np.bincount(membership, minlength=number_of_parts)
+    for _ in range(passes):
+        n_moves = 0
+        for vertex in range(graph.n_vertices):
+            own = membership[vertex]
+            if part_sizes[own] == 1:
+                continue
+            weight = graph.vertex_weights[vertex]
+            neighbours, weights = graph.neighbours(vertex)
+            parts, inverse = np.unique(membership[neighbours], return_inverse=True)
+            connection = np.bincount(inverse, weights=weights, minlength=len(parts))
+            own_connection = connection[parts == own].sum()
+            fits = part_weights[parts] + weight <= max_part_weight
+            fits &= parts != own
+            overweight = part_weights[own] > max_part_weight
+            if overweight:
+                if fits.any():
+                    candidates = np.where(fits)[0]
+                    target = parts[candidates[np.argmax(connection[candidates])]]
+                else:
+                    target = np.argmin(part_weights)
+                    if target == own:
+                        continue
+            else:
+                gains = connection - own_connection
+                # moves that don't change the cut are taken if they balance
+                better = (gains > 0) | (
+                    (gains == 0) & (part_weights[parts] + weight < part_weights[own])
+                )
+                candidates = np.where(fits & better)[0]
+                if len(candidates) == 0:
+                    continue
+                target = parts[candidates[np.argmax(gains[candidates])]]
+            membership[vertex] = target
+            part_weights[own] -= weight
+            part_weights[target] += weight
+            part_sizes[own] -= 1
+            part_sizes[target] += 1
+            n_moves += 1
+        if n_moves == 0:
+            break
+    return membership
+
+
+def _multilevel_partition(graph, number_of_parts, imbalance, rng):
+    """
+    Coarsens the graph by merging heavily linked vertices, partitions the
+    coarsest graph and refines the partition back on every finer graph.
+    """
+    max_part_weight = (1 + imbalance) * graph.vertex_weights.sum() / number_of_parts
+    coarsest_size = max(20 * number_of_parts, 200)
+    max_vertex_weight = 1.5 * graph.vertex_weights.sum() / coarsest_size
+    graphs = [graph]
+    labels_per_level = []
+    while graphs[-1].n_vertices > coarsest_size:
+        labels = _match_heavy_edges(graphs[-1], max_vertex_weight, rng)
+        if labels.max() + 1 > 0.95 * graphs[-1].n_vertices:
+            break
+        labels_per_level.append(labels)
+        graphs.append(graphs[-1].contract(labels))
+    membership = _grow_parts(graphs[-1], number_of_parts, rng)
+    membership = _refine(graphs[-1], membership, number_of_parts, max_part_weight)
+    for level_graph, labels in zip(graphs[-2::-1], labels_per_level[::-1]):
+        membership = membership[labels]
+        membership = _refine(level_graph, membership, number_of_parts, max_part_weight)
+    return membership
+
+
+def _to_integer_weights(weights, minimum):
+    return np.maximum(np.rint(weights), minimum).astype(np.int64)
+
+
+def partition_graph(graph, number_of_parts, imbalance=0.03, seed=0):
+    """
+    Splits the vertices of ``graph`` in ``number_of_parts`` parts whose weights
+    are at most ``imbalance`` over the average, cutting links as light as
+    possible. Uses METIS if pymetis is installed, and a multilevel partitioner
+    of the same kind otherwise. Returns the part of every vertex.
+    """
+    if number_of_parts > graph.n_vertices:
+        raise ValueError(
+            f"Can't split {graph.n_vertices} super areas in {number_of_parts} parts."
+        )
+    if number_of_parts == 1:
+        return np.zeros(graph.n_vertices, dtype=np.int64)
+    if pymetis is not None:
+        _, membership = pymetis.part_graph(
+            number_of_parts,
+            xadj=graph.offsets,
+            adjncy=graph.adjacency,
+            vweights=_to_integer_weights(graph.vertex_weights, 0),
+            eweights=_to_integer_weights(graph.adjacency_weights, 1),
+            # METIS takes the load imbalance in thousandths
+            options=pymetis.Options(ufactor=int(imbalance * 1000), seed=seed),
+        )
+        return np.asarray(membership, dtype=np.int64)
+    return _multilevel_partition(
+        graph, number_of_parts, imbalance, np.random.default_rng(seed)
+    )
+
+
+def coarsen_partition(graph, membership, number_of_parts, imbalance=0.03, seed=0):
+    """
+    Partition in ``number_of_parts`` parts made of whole parts of the finer
+    partition ``membership``, found by partitioning the graph of its parts.
+    """
+    parts, membership = np.unique(membership, return_inverse=True)
+    if number_of_parts > len(parts):
+        raise ValueError(
+            f"Can't derive {number_of_parts} parts from a partition in {len(parts)}."
+        )
+    parts_membership = partition_graph(
+        graph.contract(membership), number_of_parts, imbalance=imbalance, seed=seed
+    )
+    return parts_membership[membership]
+
+
+def partition_hierarchy(graph, numbers_of_parts, imbalance=0.03, seed=0):
+    """
+    Partitions for every number of parts in ``numbers_of_parts``. The largest
+    one is computed on the graph, and every other one is derived from the
+    next larger one, so that a domain of a smaller run is made of whole
+    domains of the larger ones.
+    """
+    numbers_of_parts = sorted(set(numbers_of_parts), reverse=True)
+    partitions = {
+        numbers_of_parts[0]: partition_graph(
+            graph, numbers_of_parts[0], imbalance=imbalance, seed=seed
+        )
+    }
+    for larger, number_of_parts in zip(numbers_of_parts, numbers_of_parts[1:]):
+        partitions[number_of_parts] = coarsen_partition(
+            graph, partitions[larger], number_of_parts, imbalance=imbalance, seed=seed
+        )
+    return partitions
+
+
+def load_super_area_graph(world_path, leisure_weight=1.0, cache=None):
+    """
+    Builds the super area graph of the world, or reads it from ``cache``
+    (a ``june_runs.cache.DiskCache``) if it was built for the same world file.
+    """
+    if cache is None:
+        return SuperAreaGraph.from_hdf5(world_path, leisure_weight=leisure_weight)
+    world_stat = Path(world_path).stat()
+    key = {
+        "world": [str(world_path), world_stat.st_size, world_stat.st_mtime],
+        "leisure_weight": leisure_weight,
+    }
+    return cache.get_or_compute(
+        "super_area_graph",
+        key,
+        SuperAreaGraph.from_hdf5,
+        world_path,
+        leisure_weight=leisure_weight,
+    )
+
+
+def get_graph_partition(
+    world_path,
+    number_of_domains,
+    leisure_weight=1.0,
+    parent_partition: dict = None,
+    imbalance=0.03,
+    cache=None,
+):
+    """
+    Super area id -> domain dictionary of a split of the world minimising the
+    people moving between domains. With ``parent_partition``, a partition in
+    more domains, every domain is made of whole domains of it.
+    """
+    graph = load_super_area_graph(
+        world_path, leisure_weight=leisure_weight, cache=cache
+    )
+    if parent_partition is None:
+        membership = partition_graph(graph, number_of_domains, imbalance=imbalance)
+    else:
+        parent_membership = [
+            parent_partition[int(super_area_id)]
+            for super_area_id in graph.super_area_ids
+        ]
+        membership = coarsen_partition(
+            graph, parent_membership, number_of_domains, imbalance=imbalance
+        )
+    return {
+        int(super_area_id): int(domain)
+        for super_area_id, domain in zip(graph.super_area_ids, membership)
+    }
+
+
+if __name__ == "__main__":
+    # python -m june_runs.domain_partitioner world.hdf5 output_directory 64 32 16
+    world_path, output_path = sys.argv[1], Path(sys.argv[2])
+    output_path.mkdir(exist_ok=True, parents=True)
+    graph = load_super_area_graph(world_path)
+    partitions = partition_hierarchy(graph, [int(number) for number in sys.argv[3:]])
+    for number_of_domains, membership in partitions.items():
+        super_area_ids_to_domain = {
+            int(super_area_id): int(domain)
+            for super_area_id, domain in zip(graph.super_area_ids, membership)
+        }
+        partition_path = (
+            output_path / f"super_area_ids_to_domain_{number_of_domains}.json"
+        )
+        with open(partition_path, "w") as f:
+            json.dump(super_area_ids_to_domain, f)
+        print(
+            f"{number_of_domains} domains: {graph.edge_cut(membership):.0f} people "
+            f"moving between domains, written to {partition_path}"
+        )
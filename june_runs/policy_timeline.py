@@ -0,0 +1,95 @@
+from bisect import bisect_right
+from collections import defaultdict
+
+from june.policy import Policies
+
+policy_collection_names = (
+    "individual_policies",
+    "interaction_policies",
+    "medical_care_policies",
+    "leisure_policies",
+    "regional_compliance",
+    "tiered_lockdown",
+)
+
+
+class PolicyTimeline:
+    """
+    Policies only change on their start and end dates, so the active policies
+    and the combined beta factors are computed once for every interval between
+    change points. Looking them up at a given date is a binary search.
+    """
+
+    def __init__(self, change_points, active_policies, beta_factors):
+        self.change_points = change_points
+        self.active_policies = active_policies
+        self.beta_factors = beta_factors
+
+    @classmethod
+    def from_policies(cls, policies: Policies):
+        policies = list(policies)
+        change_points = sorted(
+            {policy.start_time for policy in policies}
+            | {policy.end_time for policy in policies}
+        )
+        # interval i starts at change_points[i], the one before the first is empty
+        active_policies = [[]]
+        beta_factors = [{}]
+        for change_point in change_points:
+            active = [policy for policy in policies if policy.is_active(change_point)]
+            active_policies.append(active)
+            beta_factors.append(cls._combine_beta_factors(active))
+        return cls(
+            change_points=change_points,
+            active_policies=active_policies,
+            beta_factors=beta_factors,
+        )
+
+    @staticmethod
+    def _combine_beta_factors(active_policies):
+        beta_factors = defaultdict(lambda: 1.0)
+        for policy in active_policies:
+            if getattr(policy, "policy_type", None) != "interaction":
+                continue
+            for group, beta_factor in policy.apply().items():
+                beta_factors[group] *= beta_factor
+        return dict(beta_factors)
+
+    def _get_interval(self, date):
+        return bisect_right(self.change_points, date)
+
+    def get_active(self, date):
+        return self.active_policies[self._get_interval(date)]
+
+    def get_beta_factors(self, date):
+        return self.beta_factors[self._get_interval(date)]
+
+    def install(self, policies: Policies):
+        """
+        Makes the policy collections of ``policies`` look up their active policies
+        in the timeline instead of checking every policy at every time step.
+        """
+        for collection_name in policy_collection_names:
+            collection = getattr(policies, collection_name, None)
+            if collection is None:
+                continue
+            collection_policies = {id(policy) for policy in collection.policies}
+            active_per_interval = [
+                [policy for policy in active if id(policy) in collection_policies]
+                for active in self.active_policies
+            ]
+            collection.get_active = self._make_get_active(active_per_interval)
+        if getattr(policies, "interaction_policies", None) is not None:
+            policies.interaction_policies.apply = self._apply_beta_factors
+        return policies
+
+    def _make_get_active(self, active_per_interval):
+        def get_active(date):
+            return active_per_interval[self._get_interval(date)]
+
+        return get_active
+
+    def _apply_beta_factors(self, date, interaction):
+        beta_reductions = defaultdict(lambda: 1.0)
+        beta_reductions.update(self.get_beta_factors(date))
+        interaction.beta_reductions = beta_reductions
@@ -0,0 +1,576 @@
+import os
+import copy
+import h5py
+import json
+import queue
+import shutil
+import tables
+import threading
+from time import perf_counter
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+from june.records import Record
+from june.records.records_writer import combine_hdf5s, combine_summaries
+from june.records.records_writer import combine_records as combine_june_records
+
+static_reference_filename = "static_record.json"
+static_table_names = ("people", "locations", "areas", "super_areas", "regions")
+recording_levels = ("events", "daily_aggregates", "final_only")
+# events counted by age, and the column with the ids of the people involved
+events_by_age = {
+    "infections": "infected_ids",
+    "hospital_admissions": "patient_ids",
+    "icu_admissions": "patient_ids",
+    "deaths": "dead_person_ids",
+}
+# counter tables written by every rank, and the columns that identify a row
+aggregate_table_keys = {
+    "daily_events": ["timestamp"],
+    "daily_events_by_age": ["timestamp", "event", "age_bin"],
+}
+
+
+def write_static_record(static_record_path, world, mpi_rank):
+    """
+    Writes the static tables (people, locations, areas, ...) of this rank's
+    domain to ``static_record_path``.
+    """
+    record = Record(
+        record_path=static_record_path, record_static_data=True, mpi_rank=mpi_rank
+    )
+    record.static_data(world=world)
+
+
+def combine_static_record(static_record_path):
+    """
+    Merges the static tables of all ranks into ``static_record_path/june_record.h5``.
+    """
+    static_record_path = Path(static_record_path)
+    combine_hdf5s(static_record_path, remove_left_overs=True, save_dir=static_record_path)
+    for left_over in list(static_record_path.glob("summary.*.csv")) + [
+        static_record_path / "config.yaml"
+    ]:
+        if left_over.exists():
+            left_over.unlink()
+    return static_record_path / "june_record.h5"
+
+
+def write_static_reference(record_path, static_record_file, key):
+    with open(Path(record_path) / static_reference_filename, "w") as f:
+        json.dump({"key": key, "path": str(static_record_file)}, f, indent=4)
+
+
+def read_static_reference(record_path):
+    """
+    Path to the static record a run points to, or None if the run has its
+    static tables in its own record.
+    """
+    reference_path = Path(record_path) / static_reference_filename
+    if not reference_path.exists():
+        return None
+    with open(reference_path, "r") as f:
+        return Path(json.load(f)["path"])
+
+
+def combine_records(record_path, remove_left_overs=False, save_dir=None):
+    """
+    Same as JUNE's combine_records. If the run points to a shared static
+    record, the reference is kept with the results and the static tables are
+    added to the combined record as external links, so they can be read
+    from it as if they had been written by the run.
+    """
+    combine_june_records(
+        record_path, remove_left_overs=remove_left_overs, save_dir=save_dir
+    )
+    sum_aggregate_tables(Path(save_dir or record_path) / "june_record.h5")
+    static_record_file = read_static_reference(record_path)
+    if static_record_file is None:
+        return
+    save_dir = Path(save_dir or record_path)
+    if save_dir != Path(record_path):
+        shutil.copy(Path(record_path) / static_reference_filename, save_dir)
+    link_static_record(save_dir / "june_record.h5", static_record_file)
+
+
+def sum_aggregate_tables(record_file):
+    """
+    Every rank writes the counters of its own domain (see ``AggregateRecord``),
+    and combining the records appends them. Sums them, so that there is one
+    row per day (and event and age bin).
+    """
+    with tables.open_file(record_file, mode="a") as f:
+        for table_name, keys in aggregate_table_keys.items():
+            if table_name not in f.root:
+                continue
+            table = getattr(f.root, table_name)
+            data = table.read()
+            summed = pd.DataFrame(data).groupby(keys, as_index=False).sum()
+            f.remove_node(f.root, table_name)
+            table = f.create_table(f.root, table_name, description=data.dtype)
+            if len(summed) > 0:
+                table.append(
+                    np.rec.fromarrays(
+                        [summed[name].values for name in data.dtype.names],
+                        dtype=data.dtype,
+                    )
+                )
+                table.flush()
+
+
+def get_replicate_path(path, replicate):
+    return Path(path) / f"replicate_{replicate:03d}"
+
+
+def combine_replicate_summaries(results_path, n_replicates):
+    """
+    Stacks the summaries of the replicates of a run into ``summary.csv`` in
+    ``results_path``, with the replicate number in the first column.
+    """
+    summaries = []
+    for replicate in range(n_replicates):
+        summary = pd.read_csv(
+            get_replicate_path(results_path, replicate) / "summary.csv"
+        )
+        summary.insert(0, "replicate", replicate)
+        summaries.append(summary)
+    pd.concat(summaries, ignore_index=True).to_csv(
+        Path(results_path) / "summary.csv", index=False
+    )
+
+
+def complete_shared_record(record_path, save_dir):
+    """
+    For runs that wrote their events to a single shared file in ``save_dir``:
+    combines the summaries and adds the static tables to the shared file.
+    """
+    save_dir = Path(save_dir)
+    combine_summaries(record_path, save_dir=save_dir)
+    static_record_file = read_static_reference(record_path)
+    if static_record_file is None:
+        append_static_tables(record_path, save_dir / "june_record.h5")
+    else:
+        shutil.copy(Path(record_path) / static_reference_filename, save_dir)
+        link_static_record(save_dir / "june_record.h5", static_record_file)
+
+
+def downcast_integers(data):
+    """
+    Stores every integer column of a structured array with the smallest integer
+    type that holds all its values.
+    """
+    descriptions = []
+    for name in data.dtype.names:
+        column = data[name]
+        dtype = column.dtype
+        if np.issubdtype(dtype, np.integer) and len(column) > 0:
+            dtype = np.result_type(
+                np.min_scalar_type(column.min()), np.min_scalar_type(column.max())
+            )
+        descriptions.append((name, dtype))
+    return data.astype(descriptions)
+
+
+def get_filters(storage_profile: dict):
+    compression = storage_profile.get("compression", "gzip")
+    if compression is None:
+        return None
+    complib = {"gzip": "zlib", "blosc": "blosc", "lzo": "lzo", "bzip2": "bzip2"}.get(
+        compression
+    )
+    if compression == "lzf":
+        # lzf is an h5py filter, PyTables can only read it
+        raise ValueError("PyTables can't write lzf, use blosc or lzo for speed.")
+    if complib is None:
+        raise ValueError(f"Compression {compression} not supported by PyTables.")
+    if complib == "blosc" and tables.which_lib_version("blosc") is None:
+        complib = "zlib"
+    return tables.Filters(
+        complevel=storage_profile.get("compression_level", 4),
+        complib=complib,
+        shuffle=storage_profile.get("shuffle", True),
+    )
+
+
+def _get_chunk_rows(data, days_per_chunk, chunk_bytes=2 ** 20):
+    """
+    Rows are written time step by time step, so a chunk of contiguous rows
+    holds about ``days_per_chunk`` days, which suits reading time ranges.
+    Chunks are capped at ``chunk_bytes``, so a table without timestamps or
+    with busy days is not read and compressed as one block.
+    """
+    chunk_rows = max(chunk_bytes // data.dtype.itemsize, 1)
+    if "timestamp" in data.dtype.names and len(data) > 0:
+        n_days = len(np.unique(data["timestamp"]))
+        chunk_rows = min(chunk_rows, int(len(data) / n_days * days_per_chunk))
+    return max(min(chunk_rows, len(data)), 1)
+
+
+def compress_record(record_file, storage_profile: dict):
+    """
+    Rewrites a combined record with the chunking, compression and integer
+    down-casting of ``storage_profile``. Returns the sizes before and after.
+    """
+    record_file = Path(record_file)
+    size_before = record_file.stat().st_size
+    temporary_file = record_file.with_name(record_file.name + ".tmp")
+    filters = get_filters(storage_profile)
+    with tables.open_file(record_file, "r") as source, tables.open_file(
+        temporary_file, "w"
+    ) as destination:
+        for node in source.root._f_list_nodes():
+            if isinstance(node, tables.link.ExternalLink):
+                destination.create_external_link("/", node.name, node.target)
+                continue
+            data = node.read()
+            if storage_profile.get("downcast", True):
+                data = downcast_integers(data)
+            destination.create_table(
+                destination.root,
+                node.name,
+                obj=data,
+                filters=filters,
+                chunkshape=(
+                    _get_chunk_rows(
+                        data,
+                        days_per_chunk=storage_profile.get("days_per_chunk", 7),
+                        chunk_bytes=storage_profile.get("chunk_bytes", 2 ** 20),
+                    ),
+                ),
+            )
+    os.replace(temporary_file, record_file)
+    size_after = record_file.stat().st_size
+    return {
+        "size_before": size_before,
+        "size_after": size_after,
+        "bytes_saved": size_before - size_after,
+    }
+
+
+def link_static_record(record_file, static_record_file):
+    """
+    Adds the tables of the shared static record to ``record_file`` as external links.
+    """
+    with tables.open_file(record_file, "a") as record:
+        for table_name in static_table_names:
+            if table_name not in record.root:
+                record.create_external_link(
+                    "/", table_name, f"{static_record_file}:/{table_name}"
+                )
+
+
+def append_static_tables(record_path, record_file):
+    """
+    Copies the static tables of the per-rank records in ``record_path`` into
+    ``record_file``.
+    """
+    with tables.open_file(record_file, "a") as merged_record:
+        for rank_file in sorted(Path(record_path).glob("june_record.*.h5")):
+            with tables.open_file(rank_file, "r") as record:
+                for table_name in static_table_names:
+                    if table_name not in record.root:
+                        continue
+                    table = record.get_node("/", table_name)
+                    if table_name not in merged_record.root:
+                        merged_record.create_table(
+                            merged_record.root, table_name, description=table.description
+                        )
+                    merged_record.get_node("/", table_name).append(table.read())
+
+
+def read_record_table(record_path, table_name):
+    """
+    Reads a table of the combined record in ``record_path`` as a DataFrame,
+    following the reference to the shared static record if needed.
+    """
+    record_path = Path(record_path)
+    with tables.open_file(record_path / "june_record.h5", "r") as record:
+        if table_name in record.root:
+            node = record.get_node("/", table_name)
+            if not isinstance(node, tables.link.ExternalLink):
+                return pd.DataFrame.from_records(node.read())
+    static_record_file = read_static_reference(record_path)
+    if static_record_file is None:
+        raise ValueError(f"Table {table_name} not found in {record_path}.")
+    with tables.open_file(static_record_file, "r") as record:
+        return pd.DataFrame.from_records(record.get_node("/", table_name).read())
+
+
+class AggregateRecord(Record):
+    """
+    Record that does not log individual events. The events of every time step
+    are only counted, per day and per age band, in fixed-size arrays that are
+    written once at the end of the run by ``finalise``. With ``final_only`` only
+    the totals of the whole run are written. The regional daily summaries are
+    written as usual.
+    """
+
+    def __init__(
+        self,
+        record_path,
+        recording_level="daily_aggregates",
+        n_days=1,
+        age_bins=(0, 20, 40, 60, 80, 100),
+        record_static_data=False,
+        mpi_rank=None,
+    ):
+        if recording_level not in ("daily_aggregates", "final_only"):
+            raise ValueError(f"Recording level {recording_level} not supported.")
+        super().__init__(
+            record_path=record_path,
+            record_static_data=record_static_data,
+            mpi_rank=mpi_rank,
+        )
+        self.recording_level = recording_level
+        self.age_bins = np.array(age_bins)
+        self.event_names = list(self.events.keys())
+        # one extra day for the time steps after the last full day
+        self.daily_events = np.zeros((n_days + 1, len(self.event_names)), dtype=np.int64)
+        self.daily_events_by_age = np.zeros(
+            (n_days + 1, len(events_by_age), len(self.age_bins)), dtype=np.int64
+        )
+        self.initial_date = None
+        self.ages_by_id = None
+
+    def _get_day(self, timestamp):
+        if self.initial_date is None:
+            self.initial_date = timestamp.date()
+        day = (timestamp.date() - self.initial_date).days
+        return min(day, len(self.daily_events) - 1)
+
+    def summarise_time_step(self, timestamp, world):
+        super().summarise_time_step(timestamp=timestamp, world=world)
+        if self.ages_by_id is None:
+            self.ages_by_id = {person.id: person.age for person in world.people}
+        day = self._get_day(timestamp)
+        for i, (event_name, ids_name) in enumerate(events_by_age.items()):
+            ages = [
+                self.ages_by_id[person_id]
+                for person_id in getattr(self.events[event_name], ids_name)
+                if person_id in self.ages_by_id
+            ]
+            if not ages:
+                continue
+            age_bins = np.searchsorted(self.age_bins, ages, side="right") - 1
+            np.add.at(self.daily_events_by_age[day, i], age_bins, 1)
+
+    def time_step(self, timestamp):
+        day = self._get_day(timestamp)
+        for i, event_name in enumerate(self.event_names):
+            event = self.events[event_name]
+            self.daily_events[day, i] += event.number_of_events
+            for attribute in event.attributes:
+                setattr(event, attribute, [])
+
+    def _get_aggregates(self):
+        if self.initial_date is None:
+            return [], self.daily_events[:0], self.daily_events_by_age[:0]
+        dates = pd.date_range(self.initial_date, periods=len(self.daily_events))
+        dates = dates.strftime("%Y-%m-%d").tolist()
+        if self.recording_level == "final_only":
+            return (
+                [dates[-1]],
+                self.daily_events.sum(axis=0, keepdims=True),
+                self.daily_events_by_age.sum(axis=0, keepdims=True),
+            )
+        return dates, self.daily_events, self.daily_events_by_age
+
+    def finalise(self):
+        """
+        Writes the counters to the record file.
+        """
+        dates, daily_events, daily_events_by_age = self._get_aggregates()
+        events = np.rec.fromarrays(
+            [np.array(dates, dtype="S10")]
+            + [daily_events[:, i] for i in range(len(self.event_names))],
+            names=["timestamp"] + self.event_names,
+        )
+        days, event_indices, age_indices = np.indices(daily_events_by_age.shape)
+        events_by_age_table = np.rec.fromarrays(
+            [
+                np.array(dates, dtype="S10")[days.ravel()],
+                np.array(list(events_by_age), dtype="S20")[event_indices.ravel()],
+                self.age_bins[age_indices.ravel()].astype(np.int32),
+                daily_events_by_age.ravel(),
+            ],
+            names=["timestamp", "event", "age_bin", "count"],
+        )
+        with tables.open_file(self.record_path / self.filename, mode="a") as f:
+            f.create_table(f.root, "daily_events", obj=events)
+            f.create_table(f.root, "daily_events_by_age", obj=events_by_age_table)
+
+
+class AsyncRecordWriter:
+    """
+    Wraps a record so that the events of every time step are written to disk
+    by a background thread while the simulation goes on. At each time step the
+    filled event buffers are swapped for empty ones and handed to the thread
+    through a queue of at most ``max_queued_steps`` time steps. If the queue is
+    full, the simulation waits. Everything else is passed to the record.
+    """
+
+    def __init__(self, record: Record, max_queued_steps=2):
+        self.record = record
+        self.queue = queue.Queue(maxsize=max_queued_steps)
+        self.write_time = 0.0
+        self.wait_time = 0.0
+        self.error = None
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+
+    def __getattr__(self, name):
+        return getattr(self.record, name)
+
+    def _swap_buffers(self):
+        filled_events = {}
+        for event_name, event in self.record.events.items():
+            filled_event = copy.copy(event)
+            for attribute in event.attributes:
+                setattr(event, attribute, [])
+            filled_events[event_name] = filled_event
+        return filled_events
+
+    def _write_loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            timestamp, filled_events = item
+            t0 = perf_counter()
+            try:
+                with tables.open_file(
+                    self.record.record_path / self.record.filename, mode="a"
+                ) as f:
+                    for event in filled_events.values():
+                        event.record(hdf5_file=f, timestamp=timestamp)
+            except Exception as error:
+                self.error = error
+            self.write_time += perf_counter() - t0
+            self.queue.task_done()
+
+    def _raise_if_failed(self):
+        if self.error is not None:
+            raise self.error
+
+    def time_step(self, timestamp):
+        self._raise_if_failed()
+        t0 = perf_counter()
+        self.queue.put((timestamp, self._swap_buffers()))
+        self.wait_time += perf_counter() - t0
+
+    def static_data(self, world):
+        # the file must not be written from two threads at once
+        self.flush()
+        self.record.static_data(world=world)
+
+    def flush(self):
+        t0 = perf_counter()
+        self.queue.join()
+        self.wait_time += perf_counter() - t0
+        self._raise_if_failed()
+
+    def finalise(self):
+        """
+        Writes everything left and stops the thread.
+        """
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+        if hasattr(self.record, "finalise"):
+            self.record.finalise()
+        print(
+            f"Record writer spent {self.write_time:.2f} s writing, "
+            f"{self.hidden_time:.2f} s of it hidden behind the simulation."
+        )
+
+    @property
+    def hidden_time(self):
+        return max(self.write_time - self.wait_time, 0.0)
+
+
+class SharedFileRecord(Record):
+    """
+    Record where all the ranks write their events to a single HDF5 file, with
+    parallel HDF5 if there is more than one rank. At each time step the ranks
+    exchange how many events they have, every rank gets its offset by a prefix
+    sum, and writes its rows to its own slice of the shared, chunked datasets.
+    The datasets grow geometrically, so they are rarely resized, and are trimmed
+    by ``finalise``. The static data and summaries are written per rank as usual.
+    """
+
+    def __init__(
+        self,
+        record_path,
+        shared_file_path,
+        comm,
+        record_static_data=False,
+        mpi_rank=None,
+        chunk_size=10_000,
+    ):
+        super().__init__(
+            record_path=record_path,
+            record_static_data=record_static_data,
+            mpi_rank=mpi_rank,
+        )
+        self.comm = comm
+        self.shared_file_path = Path(shared_file_path)
+        if comm.Get_size() > 1:
+            if not h5py.get_config().mpi:
+                raise ValueError("Shared file records need h5py built with MPI.")
+            self.shared_file = h5py.File(
+                self.shared_file_path, "w", driver="mpio", comm=comm
+            )
+        else:
+            self.shared_file = h5py.File(self.shared_file_path, "w")
+        self.sizes = {}
+        for event_name, event in self.events.items():
+            # datasets have to be created by all ranks, in the same order
+            self.shared_file.create_dataset(
+                event_name,
+                shape=(chunk_size,),
+                maxshape=(None,),
+                chunks=(chunk_size,),
+                dtype=self._get_dtype(event),
+            )
+            self.sizes[event_name] = 0
+
+    @staticmethod
+    def _get_dtype(event):
+        return np.dtype(
+            [("timestamp", "S10")]
+            + [(name, np.int32) for name in event.int_names]
+            + [(name, np.float32) for name in event.float_names]
+            + [(name, "S20") for name in event.str_names]
+        )
+
+    def _get_rows(self, event, timestamp):
+        rows = np.empty(event.number_of_events, dtype=self._get_dtype(event))
+        rows["timestamp"] = timestamp.strftime("%Y-%m-%d")
+        for name in event.attributes:
+            rows[name] = getattr(event, name)
+        return rows
+
+    def time_step(self, timestamp):
+        for event_name, event in self.events.items():
+            rows = self._get_rows(event, timestamp)
+            n_rows = len(rows)
+            offset = self.comm.exscan(n_rows) or 0
+            total = self.comm.allreduce(n_rows)
+            dataset = self.shared_file[event_name]
+            needed = self.sizes[event_name] + total
+            if needed > dataset.shape[0]:
+                # resizing is collective, the new size is the same on every rank
+                dataset.resize((max(needed, 2 * dataset.shape[0]),))
+            if n_rows > 0:
+                start = self.sizes[event_name] + offset
+                dataset[start : start + n_rows] = rows
+            self.sizes[event_name] = needed
+            for attribute in event.attributes:
+                setattr(event, attribute, [])
+
+    def finalise(self):
+        for event_name, size in self.sizes.items():
+            self.shared_file[event_name].resize((size,))
+        self.shared_file.close()
@@ -1,18 +1,24 @@
+import os
+import sys
 import json
 import h5py
+import shutil
+import pickle
+import tempfile
 import numba as nb
 import random
 import numpy as np
 import datetime
 from pathlib import Path
 from time import time
+from mpi4py import MPI
 
+import june
+import june.mpi_setup
 from june.domain import Domain, DomainSplitter
-from june.mpi_setup import mpi_rank, mpi_size, mpi_comm
 from june.groups.leisure import generate_leisure_for_config
 from june.groups.travel import Travel
 from june.records import Record
-from june.records.records_writer import combine_records
 from june.simulator import Simulator
 
 from june_runs.setters import (
@@ -22,96 +28,423 @@ from june_runs.setters import (
     InfectionSelectorSetter,
     HealthIndexSetter,
 )
+from june_runs.setters.health_index_setter import (
+    health_index_data_path,
+    health_index_paths,
+)
+from june_runs.setters.infection_seed_setter import observed_to_cases_paths
+from june_runs.utils import peak_memory
+from june_runs.cache import (
+    DiskCache,
+    ObjectReferences,
+    get_cache_key,
+    get_directory_checksum,
+    get_files_checksum,
+)
+from june_runs.staging import stage_file, file_checksum
+from june_runs.policy_timeline import PolicyTimeline
+from june_runs.common_random_numbers import RandomStreams
+from june_runs.communicators import split_communicator, use_communicator
+from june_runs.domain_partitioner import get_graph_partition
+from june_runs.records import (
+    AggregateRecord,
+    AsyncRecordWriter,
+    SharedFileRecord,
+    complete_shared_record,
+    compress_record,
+    combine_records,
+    combine_replicate_summaries,
+    combine_static_record,
+    get_replicate_path,
+    write_static_record,
+    write_static_reference,
+)
+from june_runs.world_subsetter import (
+    get_rows_per_domain,
+    write_world_subset,
+    get_domain_file_path,
+    read_domain_partition,
+)
+from june_runs.walltime_predictor import get_run_features, run_statistics_filename
 
 
 def keys_to_int(x):
     return {int(k): v for k, v in x.items()}
 
 
+@nb.njit()
+def set_seed_numba(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+
+
 def set_random_seed(seed=999):
     """
     Sets global seeds for testing in numpy, random, and numbaized numpy.
     """
-
-    @nb.njit()
-    def set_seed_numba(seed):
-        random.seed(seed)
-        np.random.seed(seed)
-
     np.random.seed(seed)
     set_seed_numba(seed)
     random.seed(seed)
     return
 
 
+def get_replicate_seeds(random_seed, n_replicates, n_ranks):
+    """
+    Seeds of every replicate (first index) and rank (second index), spawned
+    from the run seed so that all the streams are independent.
+    """
+    replicate_sequences = np.random.SeedSequence(random_seed).spawn(n_replicates)
+    return [
+        [
+            int(rank_sequence.generate_state(1)[0])
+            for rank_sequence in replicate_sequence.spawn(n_ranks)
+        ]
+        for replicate_sequence in replicate_sequences
+    ]
+
+
+def set_number_of_threads(number_of_threads=1):
+    """
+    Sets the number of numba threads of this rank. Numba cannot use more threads
+    than NUMBA_NUM_THREADS, which is set by the running script.
+    """
+    nb.set_num_threads(min(number_of_threads, nb.config.NUMBA_NUM_THREADS))
+    return
+
+
+def get_health_index_checksum():
+    """
+    Checksum of the files the health index is read from.
+    """
+    if health_index_paths:
+        return get_files_checksum(health_index_paths)
+    return get_directory_checksum(health_index_data_path)
+
+
+def broadcast_int_dict(int_dict, root=0, comm=MPI.COMM_WORLD):
+    """
+    Broadcasts a dictionary of integers to integers from ``root`` to all ranks
+    of ``comm`` as a single (n, 2) integer array. Other ranks can pass None.
+    """
+    rank = comm.Get_rank()
+    if rank == root:
+        items = np.array(list(int_dict.items()), dtype=np.int64).reshape(-1, 2)
+        n_items = np.array([len(items)], dtype=np.int64)
+    else:
+        n_items = np.empty(1, dtype=np.int64)
+    comm.Bcast(n_items, root=root)
+    if rank != root:
+        items = np.empty((n_items[0], 2), dtype=np.int64)
+    comm.Bcast(items, root=root)
+    return dict(zip(items[:, 0].tolist(), items[:, 1].tolist()))
+
+
+def get_domain_partition(
+    world_path,
+    number_of_domains,
+    partitioner="spatial",
+    leisure_weight=1.0,
+    parent_partition: dict = None,
+    cache=None,
+):
+    """
+    Splits the super areas of the world in ``number_of_domains`` domains, by
+    spatial clustering (``spatial``) or by cutting as few commute and leisure
+    links between super areas as possible (``graph``, optionally made of whole
+    domains of ``parent_partition``, see ``june_runs.domain_partitioner``).
+    Returns the super area id -> domain and super area name -> domain dictionaries.
+    """
+    with h5py.File(world_path, "r") as f:
+        super_area_names = [name.decode() for name in f["geography"]["super_area_name"]]
+        super_area_ids = [int(sa_id) for sa_id in f["geography"]["super_area_id"]]
+    super_area_name_to_id = {
+        key: value for key, value in zip(super_area_names, super_area_ids)
+    }
+    if partitioner == "graph":
+        super_area_ids_to_domain_dict = get_graph_partition(
+            world_path,
+            number_of_domains,
+            leisure_weight=leisure_weight,
+            parent_partition=parent_partition,
+            cache=cache,
+        )
+        super_area_names_to_domain_dict = {
+            name: super_area_ids_to_domain_dict[super_area_name_to_id[name]]
+            for name in super_area_names
+        }
+        return super_area_ids_to_domain_dict, super_area_names_to_domain_dict
+    if partitioner != "spatial":
+        raise ValueError(f"Domain partitioner {partitioner} not supported.")
+    if parent_partition is not None:
+        raise ValueError("A parent partition needs the graph domain partitioner.")
+    domain_splitter = DomainSplitter(
+        number_of_domains=number_of_domains, world_path=world_path
+    )
+    super_areas_per_domain = domain_splitter.generate_domain_split(niter=20)
+    super_area_names_to_domain_dict = {}
+    super_area_ids_to_domain_dict = {}
+    for domain, super_areas in super_areas_per_domain.items():
+        for super_area in super_areas:
+            super_area_names_to_domain_dict[super_area] = domain
+            super_area_ids_to_domain_dict[int(super_area_name_to_id[super_area])] = domain
+    return super_area_ids_to_domain_dict, super_area_names_to_domain_dict
+
+
 class Runner:
-    def __init__(self, run_config):
+    def __init__(self, run_config, comm=None):
+        """
+        Runs on ``comm``, or on the communicator JUNE uses (MPI.COMM_WORLD unless
+        changed with ``june_runs.communicators.use_communicator``).
+        """
         with open(run_config, "r") as f:
             run_config = json.load(f)
+        if comm is None:
+            comm = june.mpi_setup.mpi_comm
+        elif comm is not june.mpi_setup.mpi_comm:
+            use_communicator(comm)
+        self.mpi_comm = comm
+        self.mpi_rank = comm.Get_rank()
+        self.mpi_size = comm.Get_size()
         self.random_seed = run_config["random_seed"]
         set_random_seed(self.random_seed)
+        self.threads_per_rank = run_config.get("threads_per_rank", 1)
+        set_number_of_threads(self.threads_per_rank)
+        self.runner_configuration = run_config.get("runner_configuration", None) or {}
         self.paths = run_config["paths"]
+        # paths["world_path"] points to the staged copy once the world is staged,
+        # the cache and the static records are keyed on the world as given,
+        # which is the same on every node
+        self.source_world_path = self.paths["world_path"]
+        self.super_area_ids_to_domain_dict = None
+        self.shared_file_output = False
+        self.replicate = 0
         self.parameters = run_config["parameters"]
         self.purpose_of_the_run = run_config["purpose_of_the_run"]
         self.run_number = run_config["run_number"]
         self.n_days = run_config["n_days"]
+        self.cache = self.init_cache()
+
+    def init_cache(self):
+        """
+        Cache of inputs shared by the runs of the run set, configured with
+        ``cache`` in the runner configuration (False to disable it).
+        """
+        cache_configuration = self.runner_configuration.get("cache", {})
+        if cache_configuration is False:
+            return None
+        if cache_configuration is True:
+            cache_configuration = {}
+        cache_path = cache_configuration.get("cache_path", self.paths.get("cache_path"))
+        if cache_path is None:
+            return None
+        return DiskCache.from_configuration(cache_path, cache_configuration)
+
+    def get_world_key(self):
+        world_stat = Path(self.source_world_path).stat()
+        return [str(self.source_world_path), world_stat.st_size, world_stat.st_mtime]
+
+    def stage_world(self):
+        """
+        Copies the world file to node-local storage, once per node, and points
+        ``world_path`` to the local copy. Only done if ``world_staging_path`` is set.
+        """
+        staging_path = self.paths.get("world_staging_path", None)
+        if staging_path is None:
+            return
+        if self.paths["world_path"] != self.source_world_path:
+            # already staged, the domain is being reloaded for another replicate
+            return
+        node_comm = self.mpi_comm.Split_type(MPI.COMM_TYPE_SHARED)
+        if node_comm.Get_rank() == 0:
+            staged_world_path = str(stage_file(self.paths["world_path"], staging_path))
+        else:
+            staged_world_path = None
+        self.paths["world_path"] = node_comm.bcast(staged_world_path, root=0)
+        node_comm.Free()
 
     def generate_domain(self):
         """
         Given the current mpi rank, generates a split of the world (domain) from an hdf5 world.
         If mpi_size is 1 this will return the entire world.
         """
+        domain_loading = self.runner_configuration.get("domain_loading", "independent")
+        if domain_loading == "presplit":
+            return self.load_presplit_domain()
+        self.stage_world()
         save_path = Path(self.paths["save_path"])
-        if mpi_rank == 0:
-            with h5py.File(self.paths["world_path"], "r") as f:
-                super_area_names = [
-                    name.decode() for name in f["geography"]["super_area_name"]
-                ]
-                super_area_ids = [
-                    int(sa_id) for sa_id in f["geography"]["super_area_id"]
-                ]
-            super_area_name_to_id = {
-                key: value for key, value in zip(super_area_names, super_area_ids)
-            }
-            # make dictionary super_area_id -> domain
-            domain_splitter = DomainSplitter(
-                number_of_domains=mpi_size, world_path=self.paths["world_path"]
-            )
-            super_areas_per_domain = domain_splitter.generate_domain_split(niter=20)
-            super_area_names_to_domain_dict = {}
-            super_area_ids_to_domain_dict = {}
-            for domain, super_areas in super_areas_per_domain.items():
-                for super_area in super_areas:
-                    super_area_names_to_domain_dict[super_area] = domain
-                    super_area_ids_to_domain_dict[
-                        int(super_area_name_to_id[super_area])
-                    ] = domain
-
-            with open(save_path / "super_area_ids_to_domain.json", "w") as f:
-                json.dump(super_area_ids_to_domain_dict, f)
-            with open(save_path / "super_area_names_to_domain.json", "w") as f:
-                json.dump(super_area_names_to_domain_dict, f)
-        mpi_comm.Barrier() # wait until rank 0 writes domain partition
-        if mpi_rank > 0:
-            with open(save_path / "super_area_ids_to_domain.json", "r") as f:
-                super_area_ids_to_domain_dict= json.load(f, object_hook=keys_to_int)
+        if self.mpi_rank == 0:
+            (
+                super_area_ids_to_domain_dict,
+                super_area_names_to_domain_dict,
+            ) = get_domain_partition(
+                self.paths["world_path"],
+                number_of_domains=self.mpi_size,
+                partitioner=self.runner_configuration.get(
+                    "domain_partitioner", "spatial"
+                ),
+                leisure_weight=self.runner_configuration.get(
+                    "partition_leisure_weight", 1.0
+                ),
+                parent_partition=self.read_parent_partition(),
+                cache=self.cache,
+            )
+            if self.runner_configuration.get("save_domain_partition", True):
+                # provenance only, the other ranks get the partition by broadcast
+                with open(save_path / "super_area_ids_to_domain.json", "w") as f:
+                    json.dump(super_area_ids_to_domain_dict, f)
+                with open(save_path / "super_area_names_to_domain.json", "w") as f:
+                    json.dump(super_area_names_to_domain_dict, f)
+        else:
+            super_area_ids_to_domain_dict = None
+        super_area_ids_to_domain_dict = broadcast_int_dict(
+            super_area_ids_to_domain_dict, comm=self.mpi_comm
+        )
+        self.super_area_ids_to_domain_dict = super_area_ids_to_domain_dict
+        if domain_loading == "collective":
+            domain_world_path = self.read_domain_collectively(
+                super_area_ids_to_domain_dict
+            )
+        elif domain_loading == "independent":
+            domain_world_path = self.paths["world_path"]
+        else:
+            raise ValueError(f"Domain loading {domain_loading} not supported.")
         domain = Domain.from_hdf5(
-            domain_id=mpi_rank,
+            domain_id=self.mpi_rank,
             super_areas_to_domain_dict=super_area_ids_to_domain_dict,
-            hdf5_file_path=self.paths["world_path"],
+            hdf5_file_path=domain_world_path,
         )
+        if domain_world_path != self.paths["world_path"]:
+            Path(domain_world_path).unlink()
         return domain
 
+    def read_parent_partition(self):
+        """
+        Partition in more domains (``parent_partition_path``) that the graph
+        partition is derived from, if any.
+        """
+        parent_partition_path = self.runner_configuration.get(
+            "parent_partition_path", None
+        )
+        if parent_partition_path is None:
+            return None
+        with open(parent_partition_path, "r") as f:
+            return json.load(f, object_hook=keys_to_int)
+
+    def load_presplit_domain(self):
+        """
+        Loads the domain of this rank from the per-domain world files written by
+        scripts/split_world.py to ``split_world_path``. The partition is read from
+        the domain file itself.
+        """
+        domain_world_path = get_domain_file_path(
+            self.runner_configuration["split_world_path"], self.mpi_rank
+        )
+        domain_id, number_of_domains, super_area_ids_to_domain_dict = read_domain_partition(
+            domain_world_path
+        )
+        if number_of_domains != self.mpi_size:
+            raise ValueError(
+                f"World was split in {number_of_domains} domains but running on {self.mpi_size} ranks."
+            )
+        self.super_area_ids_to_domain_dict = super_area_ids_to_domain_dict
+        return Domain.from_hdf5(
+            domain_id=domain_id,
+            super_areas_to_domain_dict=super_area_ids_to_domain_dict,
+            hdf5_file_path=domain_world_path,
+        )
+
+    def read_domain_collectively(self, super_area_ids_to_domain_dict):
+        """
+        Rank 0 works out which rows of the world file belong to each domain and
+        scatters the row ranges. Every rank then reads only its own hyperslabs,
+        with collective MPI-IO if h5py was built with MPI, into a compact world
+        file in ``domain_scratch_path`` (/dev/shm by default).
+        Returns the path to that file.
+        """
+        if self.mpi_rank == 0:
+            rows_per_domain = get_rows_per_domain(
+                self.paths["world_path"],
+                super_area_ids_to_domain_dict,
+                number_of_domains=self.mpi_size,
+            )
+            rows = [rows_per_domain[rank] for rank in range(self.mpi_size)]
+        else:
+            rows = None
+        rows = self.mpi_comm.scatter(rows, root=0)
+        scratch_path = Path(
+            self.runner_configuration.get("domain_scratch_path", "/dev/shm")
+        )
+        scratch_path.mkdir(exist_ok=True, parents=True)
+        # unique per job, runs of other sets or policies can share the node
+        file_descriptor, domain_world_path = tempfile.mkstemp(
+            prefix=f"june_domain_{self.run_number:03d}_{self.mpi_rank}_",
+            suffix=".hdf5",
+            dir=scratch_path,
+        )
+        os.close(file_descriptor)
+        domain_world_path = Path(domain_world_path)
+        collective = h5py.get_config().mpi
+        if collective:
+            world_file = h5py.File(
+                self.paths["world_path"], "r", driver="mpio", comm=self.mpi_comm
+            )
+        else:
+            world_file = h5py.File(self.paths["world_path"], "r")
+        with world_file:
+            write_world_subset(
+                world_file, domain_world_path, rows=rows, collective=collective
+            )
+        return domain_world_path
+
+    def compute_once(self, function, *args, **kwargs):
+        """
+        Inputs that are the same for every rank are computed by rank 0 and
+        broadcast to the other ranks, unless ``broadcast_inputs`` is False in
+        the runner configuration.
+        """
+        if not self.runner_configuration.get("broadcast_inputs", True):
+            return function(*args, **kwargs)
+        if self.mpi_rank == 0:
+            result = function(*args, **kwargs)
+        else:
+            result = None
+        return self.mpi_comm.bcast(result, root=0)
+
     def generate_health_index_generator(self):
         health_index_setter = HealthIndexSetter.from_parameters(self.parameters)
-        return health_index_setter.make_health_index()
+        if self.cache is None:
+            return self.compute_once(health_index_setter.make_health_index)
+        # only rank 0 reads the health index data to make the key
+        if self.mpi_rank == 0:
+            key = {
+                "asymptomatic_ratio": health_index_setter.asymptomatic_ratio,
+                "data_checksum": get_health_index_checksum(),
+                "june_version": getattr(june, "__version__", None),
+            }
+        else:
+            key = None
+        key = self.mpi_comm.bcast(key, root=0)
+        # rank 0 fills the cache, then every rank memory-maps the same tables
+        return self.cache.get_or_compute_shared(
+            "health_index_generator",
+            key,
+            health_index_setter.make_health_index,
+            comm=self.mpi_comm,
+            memory_map=True,
+        )
 
     def generate_infection_selector(self, health_index_generator):
         infection_selector_setter = InfectionSelectorSetter.from_parameters(
             self.parameters
         )
-        return infection_selector_setter.make_infection_selector(
-            health_index_generator=health_index_generator
+        if self.cache is not None:
+            # keep the memory-mapped health index tables, instead of broadcast copies
+            return infection_selector_setter.make_infection_selector(
+                health_index_generator=health_index_generator
+            )
+        return self.compute_once(
+            infection_selector_setter.make_infection_selector,
+            health_index_generator=health_index_generator,
         )
 
     def generate_interaction(self, baseline_interaction_path, population):
@@ -120,39 +453,221 @@ class Runner:
         )
         return interaction_setter.make_interaction()
 
+    def compute_for_domain(self, name, domain: Domain, function, *args, **kwargs):
+        """
+        Structures derived from the domain and the simulation config are cached
+        per world, partition and domain, with references to the people, areas and
+        venues of the domain instead of copies. Runs of the same run set reload
+        them instead of rebuilding them.
+        """
+        if self.cache is None or self.super_area_ids_to_domain_dict is None:
+            return function(*args, **kwargs)
+        key = {
+            "world": self.get_world_key(),
+            "partition": get_cache_key(self.super_area_ids_to_domain_dict),
+            "domain_id": self.mpi_rank,
+            "config_checksum": file_checksum(self.paths["simulation_config_path"]),
+            "june_version": getattr(june, "__version__", None),
+        }
+        references = ObjectReferences(domain)
+        value = self.cache.get(name, key, references=references)
+        if value is None:
+            value = function(*args, **kwargs)
+            try:
+                self.cache.put(name, key, value, references=references)
+            except (pickle.PicklingError, AttributeError, TypeError):
+                print(f"{name} can't be cached, it will be rebuilt by every run.")
+        return value
+
     def generate_leisure(self, domain: Domain):
-        leisure = generate_leisure_for_config(
-            domain, self.paths["simulation_config_path"]
+        leisure = self.compute_for_domain(
+            "leisure",
+            domain,
+            generate_leisure_for_config,
+            domain,
+            self.paths["simulation_config_path"],
         )
         return leisure
 
-    def generate_travel(self):
-        travel = Travel()
+    def generate_travel(self, domain: Domain = None):
+        if domain is None:
+            return Travel()
+        travel = self.compute_for_domain("travel", domain, Travel)
         return travel
 
     def generate_policies(self):
-        policy_setter = PolicySetter.from_parameters(
-            baseline_policy_path=self.paths["baseline_policy_path"],
-            policies_to_modify=self.parameters.get("policies", None),
+        def make_policies():
+            baseline_policy_path = self.paths["baseline_policy_path"]
+            if self.cache is None:
+                policies_baseline = None
+            else:
+                policies_baseline = self.cache.get_or_compute(
+                    "policy_baseline",
+                    {"checksum": file_checksum(baseline_policy_path)},
+                    PolicySetter.read_baseline,
+                    baseline_policy_path,
+                )
+            policy_setter = PolicySetter.from_parameters(
+                baseline_policy_path=baseline_policy_path,
+                policies_to_modify=self.parameters.get("policies", None),
+                policies_baseline=policies_baseline,
+            )
+            return policy_setter.make_policies()
+
+        policies = self.compute_once(make_policies)
+        if self.runner_configuration.get("policy_timeline", True):
+            PolicyTimeline.from_policies(policies).install(policies)
+        return policies
+
+    def get_static_record_path(self):
+        """
+        Directory of the static record shared by the runs of the run set on this
+        world, or None if every run writes its own static tables.
+        """
+        static_records_path = self.paths.get("static_records_path", None)
+        if static_records_path is None or not self.runner_configuration.get(
+            "shared_static_records", True
+        ):
+            return None
+        self.static_record_key = get_cache_key(
+            {
+                "world": self.get_world_key(),
+                "june_version": getattr(june, "__version__", None),
+            }
         )
-        return policy_setter.make_policies()
+        return Path(static_records_path) / self.static_record_key
 
     def generate_record(self):
-        record = Record(
-            record_path=self.paths["save_path"],
-            record_static_data=True,
-            mpi_rank=mpi_rank,
-        )
+        """
+        The ``recording_level`` of the runner configuration is ``events`` to log
+        every event, or ``daily_aggregates`` / ``final_only`` to only keep counters.
+        """
+        self.static_record_path = self.get_static_record_path()
+        recording_level = self.runner_configuration.get("recording_level", "events")
+        output_mode = self.runner_configuration.get("output_mode", "per_rank")
+        if output_mode == "shared_file" and recording_level == "events":
+            if self.runner_configuration.get("async_record_writer", False):
+                raise ValueError("Shared file records can't be written asynchronously.")
+            self.shared_file_output = True
+            return SharedFileRecord(
+                record_path=self.paths["save_path"],
+                shared_file_path=Path(self.paths["results_path"]) / "june_record.h5",
+                comm=self.mpi_comm,
+                record_static_data=self.static_record_path is None,
+                mpi_rank=self.mpi_rank,
+            )
+        if recording_level == "events":
+            record = Record(
+                record_path=self.paths["save_path"],
+                record_static_data=self.static_record_path is None,
+                mpi_rank=self.mpi_rank,
+            )
+        else:
+            record = AggregateRecord(
+                record_path=self.paths["save_path"],
+                recording_level=recording_level,
+                n_days=self.n_days,
+                age_bins=self.runner_configuration.get(
+                    "age_bins", (0, 20, 40, 60, 80, 100)
+                ),
+                record_static_data=self.static_record_path is None,
+                mpi_rank=self.mpi_rank,
+            )
+        if recording_level == "events" and self.runner_configuration.get(
+            "async_record_writer", False
+        ):
+            record = AsyncRecordWriter(
+                record,
+                max_queued_steps=self.runner_configuration.get("max_queued_steps", 2),
+            )
         return record
 
+    def record_static_data(self, record, domain):
+        """
+        Static tables only depend on the world, so they are written by the first
+        run of the run set and referenced by the others.
+        """
+        if self.static_record_path is None:
+            record.static_data(world=domain)
+            return
+        static_record_file = self.static_record_path / "june_record.h5"
+        if self.mpi_rank == 0 and not static_record_file.exists():
+            # other jobs of the run set could be writing it at the same time,
+            # runs of other policies or screening runs share the run number
+            self.static_record_path.parent.mkdir(exist_ok=True, parents=True)
+            temporary_path = Path(
+                tempfile.mkdtemp(
+                    prefix=f"{self.static_record_path.name}.",
+                    suffix=".tmp",
+                    dir=self.static_record_path.parent,
+                )
+            )
+        else:
+            temporary_path = None
+        temporary_path = self.mpi_comm.bcast(temporary_path, root=0)
+        if temporary_path is not None:
+            write_static_record(temporary_path, world=domain, mpi_rank=self.mpi_rank)
+            self.mpi_comm.Barrier()
+            if self.mpi_rank == 0:
+                combine_static_record(temporary_path)
+                try:
+                    os.rename(temporary_path, self.static_record_path)
+                except OSError:
+                    # another job moved its copy into place first
+                    if not static_record_file.exists():
+                        raise
+                    shutil.rmtree(temporary_path, ignore_errors=True)
+        if self.mpi_rank == 0:
+            write_static_reference(
+                self.paths["save_path"], static_record_file, key=self.static_record_key
+            )
+
+    def make_daily_cases_per_super_area(
+        self, infection_seed_setter, health_index_generator
+    ):
+        """
+        The seeding cases only depend on the health index, the seeding window and
+        the observed deaths and demography data, so runs that only differ in betas
+        or policies reuse the cached table.
+        """
+        if self.cache is None:
+            return infection_seed_setter.make_daily_cases_per_super_area(
+                health_index_generator
+            )
+        key = {
+            "asymptomatic_ratio": self.parameters.get("infection", {}).get(
+                "asymptomatic_ratio", None
+            ),
+            "smoothing": True,
+            "seeding_start": infection_seed_setter.seeding_start,
+            "seeding_end": infection_seed_setter.seeding_end,
+            "health_index_checksum": get_health_index_checksum(),
+            "data_checksum": get_files_checksum(observed_to_cases_paths),
+            "june_version": getattr(june, "__version__", None),
+        }
+        return self.cache.get_or_compute(
+            "daily_cases_per_super_area",
+            key,
+            infection_seed_setter.make_daily_cases_per_super_area,
+            health_index_generator,
+        )
+
     def generate_infection_seed(self, infection_selector, world):
         infection_seed_setter = InfectionSeedSetter.from_parameters(self.parameters)
+        daily_cases_per_super_area = self.compute_once(
+            self.make_daily_cases_per_super_area,
+            infection_seed_setter=infection_seed_setter,
+            health_index_generator=infection_selector.health_index_generator,
+        )
         return infection_seed_setter.make_infection_seed(
-            world=world, infection_selector=infection_selector
+            world=world,
+            infection_selector=infection_selector,
+            daily_cases_per_super_area=daily_cases_per_super_area,
         )
 
-    def generate_simulator(self):
-        domain = self.generate_domain()
+    def generate_simulator(self, domain: Domain = None):
+        if domain is None:
+            domain = self.generate_domain()
         health_index_generator = self.generate_health_index_generator()
         infection_selector = self.generate_infection_selector(
             health_index_generator=health_index_generator
@@ -162,17 +677,17 @@ class Runner:
             population=domain.people,
         )
         leisure = self.generate_leisure(domain=domain)
-        travel = self.generate_travel()
+        travel = self.generate_travel(domain=domain)
         policies = self.generate_policies()
         record = self.generate_record()
-        record.static_data(world=domain)
+        self.record_static_data(record, domain)
         infection_seed = self.generate_infection_seed(
             world=domain, infection_selector=infection_selector,
         )
         record.meta_information(
             comment=self.purpose_of_the_run,
             random_state=self.random_seed,
-            number_of_cores=mpi_size,
+            number_of_cores=self.mpi_size,
         )
         simulator = Simulator.from_file(
             world=domain,
@@ -190,18 +705,180 @@ class Runner:
         simulator.timer.final_date = simulator.timer.initial_date + datetime.timedelta(
             days=self.n_days
         )
+        if self.runner_configuration.get("common_random_numbers", False):
+            RandomStreams(
+                random_seed=self.random_seed,
+                rank=self.mpi_rank,
+                set_seed=set_random_seed,
+                replicate=self.replicate,
+            ).install(simulator)
         return simulator
 
     def run(self):
+        n_replicates = self.runner_configuration.get("replicates", 1)
+        if n_replicates > 1:
+            return self.run_replicates(n_replicates)
+        time0 = time()
         simulator = self.generate_simulator()
         time1 = time()
         simulator.run()
+        if hasattr(simulator.record, "finalise"):
+            simulator.record.finalise()
         time2 = time()
-        if mpi_rank == 0:
+        memory_per_rank = self.mpi_comm.gather(peak_memory(), root=0)
+        if self.mpi_rank == 0:
             print(f"Finished! Simulation took {time2-time1} seconds!")
             self.save_results()
             print(f"Results saved!")
+            self.save_run_statistics(
+                setup_time=time1 - time0,
+                simulation_time=time2 - time1,
+                saving_time=time() - time2,
+                max_memory_per_rank=max(memory_per_rank),
+            )
+
+    def snapshot_domain(self, domain: Domain):
+        """
+        In-memory copy of the freshly loaded domain, restored before every
+        replicate instead of reading the world again. Returns None on every
+        rank if the domain can't be pickled on some rank.
+        """
+        sys.setrecursionlimit(max(sys.getrecursionlimit(), 10_000))
+        try:
+            domain_snapshot = pickle.dumps(domain, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, RecursionError, TypeError, AttributeError) as e:
+            print(f"Rank {self.mpi_rank} can't copy its domain ({e}).")
+            domain_snapshot = None
+        if not self.mpi_comm.allreduce(domain_snapshot is not None, op=MPI.LAND):
+            if self.mpi_rank == 0:
+                print("The domain will be reloaded for every replicate.")
+            return None
+        return domain_snapshot
+
+    def restore_domain(self, domain_snapshot):
+        if domain_snapshot is None:
+            return self.generate_domain()
+        return pickle.loads(domain_snapshot)
+
+    def run_replicates(self, n_replicates):
+        """
+        Runs ``replicates`` independent realisations of the same parameters in
+        this job, sharing the loaded domain. Every replicate and rank gets its
+        own random stream spawned from the run seed, and the records of
+        replicate i are saved in ``replicate_00i`` of the run and results
+        directories. The summaries are also stacked in ``summary.csv`` with a
+        ``replicate`` column.
+        """
+        time0 = time()
+        run_paths = dict(self.paths)
+        replicate_seeds = get_replicate_seeds(
+            self.random_seed, n_replicates, self.mpi_size
+        )
+        domain = self.generate_domain()
+        domain_snapshot = self.snapshot_domain(domain)
+        setup_time = time() - time0
+        simulation_time = 0
+        saving_time = 0
+        for replicate in range(n_replicates):
+            time1 = time()
+            self.replicate = replicate
+            for path_name in ["save_path", "results_path"]:
+                self.paths[path_name] = get_replicate_path(
+                    run_paths[path_name], replicate
+                )
+                self.paths[path_name].mkdir(exist_ok=True, parents=True)
+            if replicate > 0:
+                domain = self.restore_domain(domain_snapshot)
+            set_random_seed(replicate_seeds[replicate][self.mpi_rank])
+            simulator = self.generate_simulator(domain=domain)
+            time2 = time()
+            simulator.run()
+            if hasattr(simulator.record, "finalise"):
+                simulator.record.finalise()
+            time3 = time()
+            # every rank has written its record before rank 0 combines them
+            self.mpi_comm.Barrier()
+            if self.mpi_rank == 0:
+                print(
+                    f"Replicate {replicate} finished! Simulation took {time3-time2} seconds!"
+                )
+                self.save_results()
+            setup_time += time2 - time1
+            simulation_time += time3 - time2
+            saving_time += time() - time3
+        self.paths = run_paths
+        memory_per_rank = self.mpi_comm.gather(peak_memory(), root=0)
+        if self.mpi_rank == 0:
+            time4 = time()
+            combine_replicate_summaries(self.paths["results_path"], n_replicates)
+            with open(Path(self.paths["results_path"]) / "replicate_seeds.json", "w") as f:
+                json.dump(
+                    {"random_seed": self.random_seed, "replicate_seeds": replicate_seeds},
+                    f,
+                    indent=4,
+                )
+            print(f"Results saved!")
+            self.save_run_statistics(
+                setup_time=setup_time,
+                simulation_time=simulation_time,
+                saving_time=saving_time + time() - time4,
+                max_memory_per_rank=max(memory_per_rank),
+                n_replicates=n_replicates,
+            )
+
+    def save_run_statistics(
+        self,
+        setup_time,
+        simulation_time,
+        saving_time,
+        max_memory_per_rank,
+        n_replicates=1,
+    ):
+        """
+        Stores the timings of the run, used to predict the walltime of future runs.
+        Replicates count as extra simulated days.
+        """
+        run_statistics = get_run_features(
+            parameters=self.parameters,
+            n_days=self.n_days * n_replicates,
+            world_path=self.paths["world_path"],
+            n_ranks=self.mpi_size,
+        )
+        run_statistics["setup_time"] = setup_time
+        run_statistics["simulation_time"] = simulation_time
+        run_statistics["saving_time"] = saving_time
+        run_statistics["wall_time"] = setup_time + simulation_time + saving_time
+        run_statistics["time_per_day"] = simulation_time / (self.n_days * n_replicates)
+        run_statistics["replicates"] = n_replicates
+        run_statistics["max_memory_per_rank"] = max_memory_per_rank
+        results_path = Path(self.paths["results_path"])
+        with open(results_path / run_statistics_filename, "w") as f:
+            json.dump(run_statistics, f, indent=4)
 
     def save_results(self):
         results_path = self.paths["results_path"]
-        combine_records(Path(self.paths["save_path"]), remove_left_overs=False, save_dir=Path(results_path))
+        if self.shared_file_output:
+            complete_shared_record(Path(self.paths["save_path"]), save_dir=Path(results_path))
+        else:
+            combine_records(Path(self.paths["save_path"]), remove_left_overs=False, save_dir=Path(results_path))
+        storage_profile = self.runner_configuration.get("storage_profile", None)
+        if storage_profile is not None:
+            storage_report = compress_record(
+                Path(results_path) / "june_record.h5", storage_profile
+            )
+            print(
+                f"Record compressed from {storage_report['size_before'] / 1024 ** 2:.1f} MB "
+                f"to {storage_report['size_after'] / 1024 ** 2:.1f} MB."
+            )
+
+
+def run_many(run_configs, ranks_per_run):
+    """
+    Runs several runs in a single mpirun. The ranks are split into groups of
+    ``ranks_per_run``, and every group runs its share of ``run_configs`` one
+    after the other on its own communicator, with its own domain split.
+    """
+    comm, group, number_of_groups = split_communicator(ranks_per_run)
+    use_communicator(comm)
+    for run_config in run_configs[group::number_of_groups]:
+        Runner(run_config, comm=comm).run()
@@ -0,0 +1,193 @@
+import os
+import json
+import yaml
+import subprocess
+import numpy as np
+from pathlib import Path
+
+from june_runs.paths import configuration_path
+from june_runs.script_maker import ScriptMaker, load_system_configuration
+from june_runs.walltime_predictor import run_statistics_filename
+
+default_baseline_configs = configuration_path / "default_baseline_configs"
+default_benchmark_parameters = {"interaction": {}, "infection": {"seed_strength": 1.0}}
+
+
+class ScalingBenchmark:
+    """
+    Runs a short simulation of a world with a fixed seed at several rank counts.
+    Each run stores its run statistics (time per simulated day, memory per rank)
+    in its own results folder, which the ``ScalingAdvisor`` then reads.
+    The runs use the threads, launch flags and python of the production jobs
+    on ``system``.
+    """
+
+    def __init__(
+        self,
+        world_path: str,
+        save_path: str,
+        system: str,
+        rank_counts=(1, 2, 4, 8, 16, 32),
+        n_days=3,
+        random_seed=999,
+        parameters=None,
+        mpirun_command="mpirun",
+    ):
+        self.world_path = Path(world_path)
+        self.save_path = Path(save_path)
+        self.system = system
+        self.rank_counts = sorted(rank_counts)
+        self.n_days = n_days
+        self.random_seed = random_seed
+        self.parameters = parameters or default_benchmark_parameters
+        self.mpirun_command = mpirun_command
+
+    def _get_run_paths(self, n_ranks):
+        run_path = self.save_path / f"ranks_{n_ranks:03d}"
+        return {
+            "world_path": self.world_path,
+            "baseline_interaction_path": default_baseline_configs / "interaction.yaml",
+            "baseline_policy_path": default_baseline_configs / "policy.yaml",
+            "simulation_config_path": default_baseline_configs
+            / "simulation_config.yaml",
+            "save_path": run_path / "run",
+            "results_path": run_path / "results",
+        }
+
+    def _get_script_maker(self, n_ranks):
+        return ScriptMaker(
+            system=self.system,
+            run_directory=self.save_path,
+            job_name="scaling_benchmark",
+            cpus_per_job=n_ranks,
+            number_of_jobs=1,
+        )
+
+    def write_run(self, n_ranks):
+        paths = self._get_run_paths(n_ranks)
+        paths["save_path"].mkdir(exist_ok=True, parents=True)
+        paths["results_path"].mkdir(exist_ok=True, parents=True)
+        run_config = {
+            "run_number": n_ranks,
+            "purpose_of_the_run": f"scaling benchmark with {n_ranks} ranks",
+            "random_seed": self.random_seed,
+            "parameters": self.parameters,
+            "n_days": self.n_days,
+            "paths": paths,
+        }
+        parameters_path = paths["save_path"] / "parameters.json"
+        with open(parameters_path, "w") as f:
+            json.dump(run_config, f, indent=4, default=str)
+        running_script = self._get_script_maker(n_ranks).make_running_script(
+            paths["save_path"]
+        )
+        script_path = paths["save_path"] / "run.py"
+        with open(script_path, "w") as f:
+            for line in running_script:
+                f.write(line + "\n")
+        return script_path
+
+    def run(self):
+        for n_ranks in self.rank_counts:
+            script_path = self.write_run(n_ranks)
+            print(f"running scaling benchmark with {n_ranks} ranks")
+            script_maker = self._get_script_maker(n_ranks)
+            subprocess.run(
+                [self.mpirun_command, "-np", str(n_ranks)]
+                + script_maker.make_launch_flags().split()
+                + [script_maker.python_executable, "-u", script_path],
+                check=True,
+            )
+        return ScalingAdvisor.from_directory(self.save_path)
+
+
+class ScalingAdvisor:
+    """
+    Recommends the number of ranks per run that maximises the number of runs
+    we can do per core hour. A job that needs more memory per core than the
+    node has is charged for the cores it leaves unusable.
+    """
+
+    def __init__(self, run_statistics: list):
+        if not run_statistics:
+            raise ValueError("No benchmark runs found.")
+        self.run_statistics = sorted(run_statistics, key=lambda x: x["n_ranks"])
+
+    @classmethod
+    def from_directory(cls, directory):
+        run_statistics = []
+        for statistics_path in Path(directory).glob(f"**/{run_statistics_filename}"):
+            with open(statistics_path, "r") as f:
+                run_statistics.append(json.load(f))
+        return cls(run_statistics=run_statistics)
+
+    def get_scaling_table(self, n_days, cores_per_node, memory_per_node):
+        memory_per_core = memory_per_node / cores_per_node
+        reference = self.run_statistics[0]
+        reference_cost = reference["n_ranks"] * reference["time_per_day"]
+        table = []
+        for stats in self.run_statistics:
+            n_ranks = stats["n_ranks"]
+            memory_per_job = n_ranks * stats["max_memory_per_rank"]
+            charged_cores = max(n_ranks, memory_per_job / memory_per_core)
+            run_time = stats["setup_time"] + n_days * stats["time_per_day"]
+            table.append(
+                {
+                    "n_ranks": n_ranks,
+                    "time_per_day": stats["time_per_day"],
+                    "max_memory_per_rank": stats["max_memory_per_rank"],
+                    "parallel_efficiency": reference_cost
+                    / (n_ranks * stats["time_per_day"]),
+                    "runs_per_core_hour": 3600 / (charged_cores * run_time),
+                    "memory_per_job": memory_per_job,
+                }
+            )
+        return table
+
+    def recommend(self, n_days, cores_per_node, memory_per_node, memory_margin=1.2):
+        """
+        Returns the recommended ``cpus_per_job`` and ``memory_per_job`` (GB)
+        for a run of ``n_days``.
+        """
+        table = self.get_scaling_table(
+            n_days=n_days,
+            cores_per_node=cores_per_node,
+            memory_per_node=memory_per_node,
+        )
+        # the ranks of a job sharing a node have to fit in its memory
+        table = [
+            row
+            for row in table
+            if min(row["n_ranks"], cores_per_node) * row["max_memory_per_rank"]
+            <= memory_per_node
+        ]
+        if not table:
+            raise ValueError("None of the benchmarked rank counts fit in a node.")
+        best = max(table, key=lambda row: row["runs_per_core_hour"])
+        return {
+            "cpus_per_job": int(best["n_ranks"]),
+            "memory_per_job": int(np.ceil(memory_margin * best["memory_per_job"])),
+        }
+
+    def save_recommendation(self, system, world_name, n_days, memory_margin=1.2):
+        """
+        Stores the recommendation for this world in system/layouts/{system}.yaml,
+        where it is picked up when a run set uses ``cpus_per_job: auto``.
+        """
+        system_configuration = load_system_configuration(system)
+        recommendation = self.recommend(
+            n_days=n_days,
+            cores_per_node=system_configuration["cores_per_node"],
+            memory_per_node=system_configuration["memory_per_node"],
+            memory_margin=memory_margin,
+        )
+        layouts_path = configuration_path / f"system/layouts/{system}.yaml"
+        layouts_path.parent.mkdir(exist_ok=True, parents=True)
+        layouts = {}
+        if os.path.exists(layouts_path):
+            with open(layouts_path, "r") as f:
+                layouts = yaml.load(f, Loader=yaml.FullLoader) or {}
+        layouts[world_name] = recommendation
+        with open(layouts_path, "w") as f:
+            yaml.dump(layouts, f)
+        return recommendation
@@ -0,0 +1,114 @@
+import sys
+import json
+import h5py
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+screening_filename = "screening.json"
+scores_filename = "screening_scores.json"
+promoted_script_filename = "submit_promoted.sh"
+
+
+def get_world_population(world_path):
+    with h5py.File(world_path, "r") as f:
+        return int(f["population"].attrs["n_people"])
+
+
+def get_scale_factor(world_path, screening_world_path):
+    """
+    Factor to rescale counts of the reduced world to the full world, the ratio
+    of their populations.
+    """
+    return get_world_population(world_path) / get_world_population(
+        screening_world_path
+    )
+
+
+def read_daily_totals(results_path, column):
+    """
+    Daily totals of ``column`` over all regions from the summary of a run.
+    """
+    summary = pd.read_csv(Path(results_path) / "summary.csv")
+    dates = pd.to_datetime(summary["time_stamp"]).dt.normalize()
+    return summary.groupby(dates)[column].sum()
+
+
+def read_observed_data(data_path, column, date_column="date"):
+    data = pd.read_csv(data_path)
+    dates = pd.to_datetime(data[date_column]).dt.normalize()
+    return pd.Series(data[column].values, index=dates).groupby(level=0).sum()
+
+
+def score_run(simulated, observed, scale=1.0):
+    """
+    Root mean square difference of log(1 + x) between the rescaled simulated
+    and the observed daily values, on the days both have. Lower is better.
+    """
+    simulated, observed = (scale * simulated).align(observed, join="inner")
+    if len(simulated) == 0:
+        return np.inf
+    return float(
+        np.sqrt(np.mean((np.log1p(simulated.values) - np.log1p(observed.values)) ** 2))
+    )
+
+
+def select_runs(scores: dict, threshold=None, keep_best=None):
+    """
+    Runs with a score under ``threshold``, keeping at most the ``keep_best``
+    best ones. Returns them from best to worst.
+    """
+    selected = sorted(scores, key=lambda run: scores[run])
+    if threshold is not None:
+        selected = [run for run in selected if scores[run] <= threshold]
+    if keep_best is not None:
+        selected = selected[:keep_best]
+    return selected
+
+
+def promote(save_path):
+    """
+    Scores the screening runs of the run set in ``save_path`` against the
+    observed data and writes ``submit_promoted.sh``, which submits the full
+    fidelity runs of those that pass.
+    """
+    save_path = Path(save_path)
+    with open(save_path / screening_filename, "r") as f:
+        screening = json.load(f)
+    score_configuration = screening["score"]
+    observed = read_observed_data(
+        score_configuration["data_path"],
+        column=score_configuration.get("data_column", score_configuration["column"]),
+        date_column=score_configuration.get("date_column", "date"),
+    )
+    scores = {}
+    script_paths = {}
+    for run in screening["runs"]:
+        results_path = Path(run["screening_results_path"])
+        if not (results_path / "summary.csv").exists():
+            print(f"no results for {results_path}, skipping it.")
+            continue
+        simulated = read_daily_totals(results_path, score_configuration["column"])
+        scores[str(results_path)] = score_run(
+            simulated, observed, scale=screening["scale"]
+        )
+        script_paths[str(results_path)] = run["script_path"]
+    promoted = select_runs(
+        scores,
+        threshold=screening.get("threshold", None),
+        keep_best=screening.get("keep_best", None),
+    )
+    with open(save_path / scores_filename, "w") as f:
+        json.dump({"scores": scores, "promoted": promoted}, f, indent=4)
+    with open(save_path / promoted_script_filename, "w") as f:
+        f.write("#!/bin/bash -l \n\n")
+        for run in promoted:
+            f.write(f"{screening['submission_command']} {script_paths[run]}\n")
+    return promoted
+
+
+if __name__ == "__main__":
+    # once the screening runs are done: python3 -m june_runs.screening run_name
+    promoted = promote(sys.argv[1])
+    print(f"{len(promoted)} runs promoted to full fidelity, submit them with:")
+    print(f"    \033[035mbash {Path(sys.argv[1]) / promoted_script_filename}\033[0m")
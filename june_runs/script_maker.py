@@ -13,6 +13,28 @@ supported_systems = [
 import getpass, os
 
 from june_runs.paths import configuration_path
+from june_runs.staging import file_checksum
+from june_runs.walltime_predictor import format_walltime, parse_walltime
+
+
+def load_system_configuration(system):
+    """
+    Loads the system configuration file. Job layouts recommended by the
+    scaling advisor are stored in system/layouts/{system}.yaml and
+    are added under ``recommended_layouts``.
+    """
+    system_configuration_path = configuration_path / f"system/{system}.yaml"
+    if not os.path.exists(system_configuration_path):
+        raise ValueError(f"System {system} not supported yet.")
+    with open(system_configuration_path, "r") as f:
+        system_configuration = yaml.load(f, Loader=yaml.FullLoader)
+    layouts_path = configuration_path / f"system/layouts/{system}.yaml"
+    if os.path.exists(layouts_path):
+        with open(layouts_path, "r") as f:
+            system_configuration["recommended_layouts"] = yaml.load(
+                f, Loader=yaml.FullLoader
+            )
+    return system_configuration
 
 
 class ScriptMaker:
@@ -32,16 +54,58 @@ class ScriptMaker:
         extra_header_lines=None,
         extra_module_lines=None,
         extra_command_lines=None,
+        walltimes=None,
+        expected_durations=None,
+        threads_per_rank=None,
+        ranks_per_node=None,
+        world_path=None,
+        stage_world=False,
+        environment_archive=None,
+        environment_format="tar",
+        runs_per_job=1,
     ):
+        """
+        ``walltimes`` and ``expected_durations`` are optional lists (in seconds)
+        indexed by job number. If given, each job requests its own walltime
+        (capped at the system ``max_time``), and jobs are submitted longest first.
+
+        ``cpus_per_job`` is the number of MPI ranks, each running
+        ``threads_per_rank`` threads with ``ranks_per_node`` ranks on each node.
+        If not given, these are taken from the system file.
+
+        If ``stage_world`` is True, the world at ``world_path`` is copied to the
+        node-local ``local_scratch_path`` of the system before the run starts.
+        Similarly, an ``environment_archive`` made with
+        ``june_runs.staging.pack_environment`` is unpacked or mounted there,
+        and the run uses its python.
+
+        With ``runs_per_job`` > 1, consecutive runs are grouped into a single
+        job of ``runs_per_job * cpus_per_job`` ranks, which ``run_many`` splits
+        into one communicator of ``cpus_per_job`` ranks per run.
+        """
         self.system_configuration = self._load_system_configuration(system)
         self.run_directory = Path(run_directory)
         self.stdout_directory = self.run_directory / "stdout"
         self.stdout_directory.mkdir(exist_ok=True, parents=True)
         self.job_name = job_name
 
+        self.threads_per_rank = threads_per_rank or self.system_configuration.get(
+            "threads_per_rank", 1
+        )
+        ranks_per_node = ranks_per_node or self.system_configuration.get(
+            "ranks_per_node", None
+        )
+        # only request an explicit layout if asked for one
+        self.hybrid_layout = self.threads_per_rank > 1 or ranks_per_node is not None
+        if ranks_per_node is None:
+            ranks_per_node = min(
+                cpus_per_job,
+                self.system_configuration["cores_per_node"] // self.threads_per_rank,
+            )
+        self.ranks_per_node = ranks_per_node
         self.nodes_required = self.calculate_number_of_nodes(
             memory_per_job=memory_per_job,
-            cpus_per_job=cpus_per_job,
+            cpus_per_job=cpus_per_job * self.threads_per_rank,
             number_of_jobs=number_of_jobs,
         )
         self.cpus_per_job = cpus_per_job
@@ -49,18 +113,44 @@ class ScriptMaker:
         self.extra_header_lines = extra_header_lines
         self.extra_module_lines = extra_module_lines
         self.extra_command_lines = extra_command_lines
+        self.walltimes = walltimes
+        self.expected_durations = expected_durations
+        self.world_path = world_path
+        local_scratch_path = Path(
+            self.system_configuration.get("local_scratch_path", "/tmp")
+        )
+        if stage_world:
+            self.world_staging_path = local_scratch_path / "june_worlds"
+        else:
+            self.world_staging_path = None
+        self.environment_archive = environment_archive
+        self.environment_format = environment_format
+        self.runs_per_job = runs_per_job
+        if environment_archive is not None:
+            # one local copy per archive content
+            archive_key = file_checksum(environment_archive)[:12]
+            self.local_environment_path = local_scratch_path / f"june_env_{archive_key}"
+            self.python_executable = f"{self.local_environment_path}/venv/bin/python3"
+        else:
+            self.local_environment_path = None
+            self.python_executable = "python3"
 
     def _load_system_configuration(self, system):
-        system_configuration_path = configuration_path / f"system/{system}.yaml"
-        if not os.path.exists(system_configuration_path):
-            raise ValueError(f"System {system} not supported yet.")
-        with open(system_configuration_path, "r") as f:
-            system_configuration = yaml.load(f, Loader=yaml.FullLoader)
-        return system_configuration
+        return load_system_configuration(system)
 
     def _get_script_dir(self, script_number):
         return self.run_directory / f"run_{script_number:03d}"
 
+    def get_output_dir(self, script_number, directory=None):
+        """
+        Directory of the parameters and scripts of run ``script_number``, in
+        ``directory`` for runs of one of several policy files.
+        """
+        save_dir = self._get_script_dir(script_number)
+        if directory is None:
+            return save_dir
+        return save_dir / f"{directory}/run_{script_number:03d}"
+
     def calculate_number_of_nodes(self, memory_per_job, cpus_per_job, number_of_jobs):
         cores_per_node = self.system_configuration["cores_per_node"]
         memory_per_node = self.system_configuration["memory_per_node"]
@@ -70,32 +160,68 @@ class ScriptMaker:
         memory_nodes = total_memory / memory_per_node
         return max(cpu_nodes, memory_nodes)
 
-    def make_submission_script(self, script_number, output_dir, stdout_name):
+    def make_submission_script(
+        self, script_number, output_dir, stdout_name, number_of_runs=1
+    ):
         header = self.make_script_header(
-            script_number=script_number, stdout_name=stdout_name
+            script_number=script_number,
+            stdout_name=stdout_name,
+            number_of_runs=number_of_runs,
         )
         modules_to_load = self.make_script_modules()
-        command = self.make_python_command(script_number, output_dir)
+        command = self.make_python_command(
+            script_number, output_dir, number_of_runs=number_of_runs
+        )
         return header + ["\n"] + modules_to_load + ["\n"] + command
 
-    def make_running_script(self, output_dir):
-        parameters_path = output_dir / "parameters.json"
+    def make_running_script(self, output_dir, output_dirs=None):
+        """
+        Script running the run in ``output_dir``, or all the runs in
+        ``output_dirs`` if given.
+        """
+        threads = self.threads_per_rank
         python_script = [
             "import os",
-            "os.environ['OPENBLAS_NUM_THREADS'] = '1'",
-            "from june_runs import Runner\n",
-            f'runner = Runner("{parameters_path}")',
-            "runner.run()",
+            f"os.environ['OPENBLAS_NUM_THREADS'] = '{threads}'",
+            f"os.environ['OMP_NUM_THREADS'] = '{threads}'",
+            f"os.environ['NUMBA_NUM_THREADS'] = '{threads}'",
         ]
+        if output_dirs is None:
+            parameters_path = output_dir / "parameters.json"
+            python_script += [
+                "from june_runs import Runner\n",
+                f'runner = Runner("{parameters_path}")',
+                "runner.run()",
+            ]
+        else:
+            parameters_paths = ",\n".join(
+                f'    "{directory / "parameters.json"}"' for directory in output_dirs
+            )
+            python_script += [
+                "from june_runs import run_many\n",
+                f"run_configs = [\n{parameters_paths},\n]",
+                f"run_many(run_configs, ranks_per_run={self.cpus_per_job})",
+            ]
         return python_script
 
-    def make_script_header(self, script_number, stdout_name):
+    def _get_walltime(self, script_number, number_of_runs=1):
+        if self.walltimes is None:
+            return self.system_configuration["max_time"]
+        # never ask for more than the queue allows
+        max_time = parse_walltime(self.system_configuration["max_time"])
+        walltime = max(self.walltimes[script_number : script_number + number_of_runs])
+        return format_walltime(
+            min(walltime, max_time), scheduler=self.system_configuration["scheduler"],
+        )
+
+    def make_script_header(self, script_number, stdout_name, number_of_runs=1):
         queue = self.system_configuration["queue"]
         if "account" in self.system_configuration:
             account = self.system_configuration["account"]
         else:
             account = None
-        max_time = self.system_configuration["max_time"]
+        max_time = self._get_walltime(script_number, number_of_runs=number_of_runs)
+        ranks = self.cpus_per_job * number_of_runs
         scheduler = self.system_configuration["scheduler"]
         stdout_path = self.stdout_directory / stdout_name
         stdout_path.mkdir(exist_ok=True, parents=True)
@@ -103,13 +229,18 @@ class ScriptMaker:
             header = [
                 "#!/bin/bash -l",
                 "",
-                f"#SBATCH --ntasks {self.cpus_per_job}",
+                f"#SBATCH --ntasks {ranks}",
                 f"#SBATCH -J {self.job_name[0:4]}_{script_number:03d}",
                 f"#SBATCH -p {queue}",
                 f"#SBATCH -o {stdout_path}.out",
                 f"#SBATCH -e {stdout_path}.err",
                 f"#SBATCH -t {max_time}",
             ]
+            if self.hybrid_layout:
+                header += [
+                    f"#SBATCH --ntasks-per-node {self.ranks_per_node}",
+                    f"#SBATCH --cpus-per-task {self.threads_per_rank}",
+                ]
             if account:
                 header.append(f"#SBATCH -A {account}")
         elif scheduler == "pbs":
@@ -117,7 +248,7 @@ class ScriptMaker:
                 "#!/bin/bash -l",
                 "",
                 f"#PBS -N {self.job_name[0:4]}_{script_number:03d}",
-                f"#PBS -l procs={self.cpus_per_job}",
+                f"#PBS -l procs={ranks * self.threads_per_rank}",
                 f"#PBS -l walltime={max_time}",
                 f"#PBS -q {queue}",
                 f"#PBS -A {account}",
@@ -125,12 +256,13 @@ class ScriptMaker:
                 f"#PBS -e {stdout_path}.err",
             ]
         elif scheduler == "lsf":
+            ptile = self.ranks_per_node if self.hybrid_layout else ranks
             header = [
                 "#!/bin/bash -l",
                 "",
-                f'#BSUB -R "span[ptile={self.cpus_per_job}]"',
+                f'#BSUB -R "span[ptile={ptile}]"',
                 # f'#BSUB -R "rusage[mem={self.memory_per_job}000]"',
-                f"#BSUB -n {self.cpus_per_job}",
+                f"#BSUB -n {ranks}",
                 f"#BSUB -J {self.job_name[0:4]}_{script_number:03d}",
                 f"#BSUB -q {queue}",
                 f"#BSUB -P {account}",
@@ -139,6 +271,8 @@ class ScriptMaker:
                 f"#BSUB -x",
                 f"#BSUB -W {max_time}",
             ]
+            if self.threads_per_rank > 1:
+                header.append(f'#BSUB -R "affinity[core({self.threads_per_rank})]"')
         else:
             raise ValueError(f"Scheduler {scheduler} not yet supported.")
         if self.extra_header_lines:
@@ -157,37 +291,113 @@ class ScriptMaker:
             modules += self.extra_module_lines
         return modules
 
-    def make_python_command(self, script_number, output_dir):
+    def make_launch_flags(self):
+        """
+        Process placement and binding flags for mpirun, set with ``launch_flags``
+        in the system file. They can use the {ranks_per_node} and
+        {threads_per_rank} placeholders.
+        """
+        launch_flags = self.system_configuration.get("launch_flags", None)
+        if not launch_flags or not self.hybrid_layout:
+            return ""
+        launch_flags = launch_flags.format(
+            ranks_per_node=self.ranks_per_node, threads_per_rank=self.threads_per_rank
+        )
+        return f" {launch_flags}"
+
+    def _once_per_node(self, command):
+        if self.system_configuration["scheduler"] == "slurm":
+            return f"srun --ntasks=$SLURM_JOB_NUM_NODES --ntasks-per-node=1 {command}"
+        return f"mpirun --map-by ppr:1:node {command}"
+
+    def make_environment_staging_command(self):
+        """
+        Unpacks (tar) or mounts (squashfs) the packed environment on local disk,
+        once per node, and makes the job use the local copy. Later jobs on the
+        same node reuse it.
+        """
+        if self.environment_archive is None:
+            return []
+        local_path = self.local_environment_path
+        if self.environment_format == "squashfs":
+            stage = (
+                f"mkdir -p {local_path} && "
+                f"(mountpoint -q {local_path} || squashfuse {self.environment_archive} {local_path})"
+            )
+        else:
+            stage = (
+                f"[ -f {local_path}/.complete ] || "
+                f"(mkdir -p {local_path} && tar -xf {self.environment_archive} -C {local_path} "
+                f"&& touch {local_path}/.complete)"
+            )
+        return [
+            self._once_per_node(f"flock {local_path}.lock bash -c '{stage}'"),
+            f"export PYTHONPATH={local_path}/packages:$PYTHONPATH",
+        ]
+
+    def make_staging_command(self):
+        """
+        Copies the world to local storage with one process per node. Runner checks
+        the staged copy again, so this only moves the copy out of the run itself.
+        """
+        if self.world_staging_path is None:
+            return []
+        # run the module as a script, without importing JUNE and MPI on every node
+        if self.local_environment_path is not None:
+            staging_script_path = (
+                self.local_environment_path / "packages/june_runs/staging.py"
+            )
+        else:
+            staging_script_path = Path(__file__).resolve().parent / "staging.py"
+        staging_command = f"{self.python_executable} {staging_script_path} {self.world_path} {self.world_staging_path}"
+        return [self._once_per_node(staging_command)]
+
+    def make_python_command(self, script_number, output_dir, number_of_runs=1):
         script_path = self._get_script_dir(script_number)
         python_script_path = output_dir / "run.py"
-        python_command = [
-            f"mpirun -np {self.cpus_per_job} python3 -u {python_script_path}"
-        ]
+        launch_flags = self.make_launch_flags()
+        python_command = (
+            self.make_environment_staging_command()
+            + self.make_staging_command()
+            + [
+                f"mpirun -np {self.cpus_per_job * number_of_runs}{launch_flags} {self.python_executable} -u {python_script_path}"
+            ]
+        )
         if self.extra_command_lines:
             python_command += self.extra_command_lines
         return python_command
 
-    def write_scripts(self, directories_to_run):
+    def write_scripts(self, directories_to_run, write_submit_all=True):
         if not directories_to_run:
             directories_to_run = [None]
         script_paths = []
+        script_durations = []
         for directory in directories_to_run:
-            for i in range(self.number_of_jobs):
-                save_dir = self._get_script_dir(i)
+            for first_run in range(0, self.number_of_jobs, self.runs_per_job):
+                runs = range(
+                    first_run, min(first_run + self.runs_per_job, self.number_of_jobs)
+                )
+                output_dirs = [self.get_output_dir(i, directory) for i in runs]
+                i = first_run
+                output_dir = output_dirs[0]
                 if directory is None:
-                    output_dir = save_dir
                     stdout_name = f"run_{i:03d}"
                 else:
-                    output_dir = save_dir / f"{directory}/run_{i:03d}"
                     directory_name = str(directory).split("/")[-1]
                     stdout_name = f"{directory_name}/run_{i:03d}"
                 submission_script = self.make_submission_script(
-                    i, output_dir, stdout_name=stdout_name
+                    i, output_dir, stdout_name=stdout_name, number_of_runs=len(runs)
+                )
+                running_script = self.make_running_script(
+                    output_dir, output_dirs=output_dirs if len(runs) > 1 else None
                 )
-                running_script = self.make_running_script(output_dir)
                 script_path = output_dir / "submit.sh"
                 assert output_dir.is_dir()
                 script_paths.append(script_path)
+                if self.expected_durations is not None:
+                    script_durations.append(
+                        max(self.expected_durations[run] for run in runs)
+                    )
                 with open(script_path, "w") as f:
                     for line in submission_script:
                         f.write(line + "\n")
@@ -200,6 +410,14 @@ class ScriptMaker:
                     except:
                         print_path = script_path
                     print(f"running scripts written to eg.\n    {print_path}")
+        if self.expected_durations is not None:
+            # submit longest jobs first so the short ones fill in the gaps
+            order = sorted(
+                range(len(script_paths)), key=lambda idx: -script_durations[idx]
+            )
+            script_paths = [script_paths[idx] for idx in order]
+        if not write_submit_all:
+            return script_paths
         # make script to submit all jobs
         submit_all_script = self.make_submit_all_script(script_paths)
         all_scripts_path = self.run_directory / "submit_all.sh"
@@ -212,9 +430,16 @@ class ScriptMaker:
         except:
             print_path = all_scripts_path
         print(f"submit all scripts with:\n    \033[035mbash {print_path}\033[0m")
+        return script_paths
 
     def make_submit_all_script(self, script_paths):
         script = ["#!/bin/bash -l \n"]
+        submission_command = self.get_submission_command()
+        for path in script_paths:
+            script += [f"{submission_command} {path}"]
+        return script
+
+    def get_submission_command(self):
         scheduler = self.system_configuration["scheduler"]
         if scheduler == "slurm":
             submission_command = "sbatch"
@@ -229,6 +454,4 @@ class ScriptMaker:
 
         else:
             raise ValueError(f"Scheduler {scheduler} not yet supported.")
-        for path in script_paths:
-            script += [f"{submission_command} {path}"]
-        return script
+        return submission_command
@@ -1,5 +1,19 @@
+import inspect
+from pathlib import Path
+
+from june import paths
 from june.infection import HealthIndexGenerator
 
+health_index_data_path = paths.data_path / "input/health_index"
+# the files HealthIndexGenerator.from_file reads by default
+health_index_paths = [
+    parameter.default
+    for parameter in inspect.signature(
+        HealthIndexGenerator.from_file
+    ).parameters.values()
+    if isinstance(parameter.default, (str, Path))
+]
+
 
 class HealthIndexSetter:
     def __init__(self, asymptomatic_ratio=0.2):
@@ -1,4 +1,20 @@
 from june.infection_seed import InfectionSeed, Observed2Cases
+from june.infection_seed.observed_to_cases import (
+    default_trajectories_path,
+    default_area_super_region_path,
+    default_observed_deaths_path,
+    default_age_per_area_path,
+    default_female_fraction_per_area_path,
+)
+
+# the files read by Observed2Cases.from_file
+observed_to_cases_paths = [
+    default_trajectories_path,
+    default_area_super_region_path,
+    default_observed_deaths_path,
+    default_age_per_area_path,
+    default_female_fraction_per_area_path,
+]
 
 
 class InfectionSeedSetter:
@@ -28,16 +44,26 @@ class InfectionSeedSetter:
             seeding_end=seeding_end
         )
 
-    def make_infection_seed(self, infection_selector, world):
+    def make_daily_cases_per_super_area(self, health_index_generator):
+        """
+        Daily seeding cases per super area. This does not depend on the domain,
+        so it can be computed once and shared between ranks.
+        """
         oc = Observed2Cases.from_file(
-            health_index_generator=infection_selector.health_index_generator,
-            smoothing=True,
+            health_index_generator=health_index_generator, smoothing=True,
         )
         daily_cases_per_region = oc.get_regional_latent_cases()
-        daily_cases_per_super_area = oc.convert_regional_cases_to_super_area(
+        return oc.convert_regional_cases_to_super_area(
             daily_cases_per_region, dates=[self.seeding_start, self.seeding_end]
         )
 
+    def make_infection_seed(
+        self, infection_selector, world, daily_cases_per_super_area=None
+    ):
+        if daily_cases_per_super_area is None:
+            daily_cases_per_super_area = self.make_daily_cases_per_super_area(
+                infection_selector.health_index_generator
+            )
         infection_seed = InfectionSeed(
             world=world,
             infection_selector=infection_selector,
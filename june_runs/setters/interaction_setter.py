@@ -1,9 +1,45 @@
+import numpy as np
+
 from june.interaction import Interaction
 from june.paths import configs_path
 
 default_interaction_config = configs_path / "defaults/interaction/interaction.yaml"
 
 
+def get_susceptibilities_by_age(ages, susceptibilities_by_age: dict, max_age=99):
+    """
+    Susceptibility of every age in ``ages`` given age bands such as
+    {"0-13": 0.5, "13-150": 1.0}. Bands include their lower limit only, ages
+    outside every band get 0 and ages above ``max_age`` are taken as ``max_age``,
+    as in JUNE.
+    """
+    bands = sorted(
+        (int(lower), int(upper), value)
+        for (lower, upper), value in (
+            (key.split("-"), value) for key, value in susceptibilities_by_age.items()
+        )
+    )
+    lower_limits = np.array([band[0] for band in bands])
+    upper_limits = np.array([band[1] for band in bands])
+    values = np.array([band[2] for band in bands], dtype=float)
+    ages = np.minimum(np.asarray(ages), max_age)
+    band_index = np.searchsorted(lower_limits, ages, side="right") - 1
+    in_band = (band_index >= 0) & (ages < upper_limits[np.maximum(band_index, 0)])
+    return np.where(in_band, values[np.maximum(band_index, 0)], 0.0)
+
+
+def set_population_susceptibilities(population, susceptibilities_by_age: dict):
+    """
+    Sets the susceptibility of every person with a single lookup of all ages,
+    instead of parsing the age bands person by person.
+    """
+    people = list(population)
+    ages = np.fromiter((person.age for person in people), dtype=np.int64, count=len(people))
+    susceptibilities = get_susceptibilities_by_age(ages, susceptibilities_by_age)
+    for person, susceptibility in zip(people, susceptibilities.tolist()):
+        person.susceptibility = susceptibility
+
+
 class InteractionSetter:
     def __init__(
         self,
@@ -54,7 +90,7 @@ class InteractionSetter:
         # susceptibility
         if self.susceptibilities_by_age is not None:
             interaction.susceptibilities_by_age = self.susceptibilities_by_age
-            interaction.set_population_susceptibilities(
+            set_population_susceptibilities(
                 population=self.population,
                 susceptibilities_by_age=self.susceptibilities_by_age,
             )
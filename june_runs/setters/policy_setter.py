@@ -4,6 +4,7 @@ from datetime import datetime
 from copy import deepcopy
 
 from june.policy import Policies
+from june_runs.policy_timeline import PolicyTimeline
 
 
 def str_to_class(classname):
@@ -15,10 +16,20 @@ class PolicySetter:
         self.policies_baseline = policies_baseline
         self.policies_to_modify = policies_to_modify or {}
 
-    @classmethod
-    def from_parameters(cls, policies_to_modify: dict, baseline_policy_path: str):
+    @staticmethod
+    def read_baseline(baseline_policy_path: str):
         with open(baseline_policy_path, "r") as f:
-            policies_baseline = yaml.load(f, Loader=yaml.FullLoader)
+            return yaml.load(f, Loader=yaml.FullLoader)
+
+    @classmethod
+    def from_parameters(
+        cls,
+        policies_to_modify: dict,
+        baseline_policy_path: str,
+        policies_baseline: dict = None,
+    ):
+        if policies_baseline is None:
+            policies_baseline = cls.read_baseline(baseline_policy_path)
         return cls(
             policies_baseline=policies_baseline, policies_to_modify=policies_to_modify
         )
@@ -72,3 +83,12 @@ class PolicySetter:
                     policy_data_modified = policy_data
                 policies.append(str_to_class(camel_case_key)(**policy_data_modified))
         return Policies(policies=policies)
+
+    def make_policy_timeline(self, policies: Policies = None):
+        """
+        Precomputed timeline of the active policies and beta factors, see
+        ``PolicyTimeline.install`` to make the simulator use it.
+        """
+        if policies is None:
+            policies = self.make_policies()
+        return PolicyTimeline.from_policies(policies)
@@ -0,0 +1,157 @@
+import os
+import sys
+import json
+import fcntl
+import shutil
+import hashlib
+import tarfile
+import tempfile
+import subprocess
+from pathlib import Path
+
+chunk_size = 64 * 1024 ** 2
+
+
+def file_checksum(file_path):
+    checksum = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def _get_staged_path(source_path, cache_directory):
+    """
+    Different files with the same name get different cache entries.
+    """
+    source_key = hashlib.sha1(str(source_path).encode()).hexdigest()[:12]
+    return cache_directory / f"{source_path.stem}_{source_key}{source_path.suffix}"
+
+
+def _is_cached(source_path, staged_path, manifest_path, verify):
+    if not staged_path.exists() or not manifest_path.exists():
+        return False
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f)
+    source_stat = source_path.stat()
+    staged_stat = staged_path.stat()
+    if (
+        manifest["source_size"] != source_stat.st_size
+        or manifest["source_mtime"] != source_stat.st_mtime
+        or manifest.get("staged_size") != staged_stat.st_size
+        or manifest.get("staged_mtime") != staged_stat.st_mtime
+    ):
+        return False
+    if verify and file_checksum(staged_path) != manifest["checksum"]:
+        return False
+    return True
+
+
+def _copy_with_checksum(source_path, destination_path):
+    checksum = hashlib.sha256()
+    with open(source_path, "rb") as fin, open(destination_path, "wb") as fout:
+        for chunk in iter(lambda: fin.read(chunk_size), b""):
+            checksum.update(chunk)
+            fout.write(chunk)
+    return checksum.hexdigest()
+
+
+def stage_file(source_path, cache_directory, verify=False):
+    """
+    Copies ``source_path`` into ``cache_directory`` (typically node-local disk)
+    and returns the path to the local copy. The copy is checksummed, and kept
+    with a manifest so that later jobs on the same node reuse it as long as the
+    sizes and modification times of the source and the copy have not changed.
+    With ``verify``, the copy is checksummed again before being reused.
+    Concurrent callers on the same node wait on a file lock, so the file is
+    only copied once.
+    """
+    source_path = Path(source_path).resolve()
+    cache_directory = Path(cache_directory)
+    cache_directory.mkdir(exist_ok=True, parents=True)
+    staged_path = _get_staged_path(source_path, cache_directory)
+    manifest_path = staged_path.with_name(staged_path.name + ".json")
+    lock_path = staged_path.with_name(staged_path.name + ".lock")
+    with open(lock_path, "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if _is_cached(source_path, staged_path, manifest_path, verify=verify):
+                return staged_path
+            source_stat = source_path.stat()
+            temporary_path = staged_path.with_name(staged_path.name + ".tmp")
+            checksum = _copy_with_checksum(source_path, temporary_path)
+            if file_checksum(temporary_path) != checksum:
+                temporary_path.unlink()
+                raise IOError(f"Checksum mismatch while staging {source_path}.")
+            os.replace(temporary_path, staged_path)
+            staged_stat = staged_path.stat()
+            manifest = {
+                "source_path": str(source_path),
+                "source_size": source_stat.st_size,
+                "source_mtime": source_stat.st_mtime,
+                "staged_size": staged_stat.st_size,
+                "staged_mtime": staged_stat.st_mtime,
+                "checksum": checksum,
+            }
+            with open(manifest_path, "w") as f:
+                json.dump(manifest, f, indent=4)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return staged_path
+
+
+def _build_environment_tree(tree_path, virtual_env_path, package_paths, symlinks):
+    shutil.copytree(virtual_env_path, tree_path / "venv", symlinks=True)
+    (tree_path / "packages").mkdir(parents=True, exist_ok=True)
+    for package_path in package_paths:
+        package_path = Path(package_path)
+        shutil.copytree(
+            package_path,
+            tree_path / "packages" / package_path.name,
+            symlinks=True,
+            ignore=shutil.ignore_patterns("__pycache__"),
+        )
+    for name, target in symlinks.items():
+        os.symlink(target, tree_path / "packages" / name)
+
+
+def pack_environment(
+    archive_path, virtual_env_path, package_paths, symlinks=None, archive_format="tar"
+):
+    """
+    Packs a virtual environment and a list of package directories into a single
+    file, so that a job can unpack (tar) or mount (squashfs) it on local disk
+    once per node instead of importing thousands of small files from the
+    parallel filesystem. The archive layout is
+
+        venv/                 the virtual environment
+        packages/<name>/      the packages, to be put in the PYTHONPATH
+        packages/<link>       symbolic links, eg. to data too large to pack
+
+    Note that the base interpreter the virtual environment points to is not packed.
+    """
+    archive_path = Path(archive_path)
+    symlinks = symlinks or {}
+    archive_path.parent.mkdir(exist_ok=True, parents=True)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tree_path = Path(tmpdir) / "environment"
+        _build_environment_tree(tree_path, virtual_env_path, package_paths, symlinks)
+        if archive_format == "tar":
+            with tarfile.open(archive_path, "w") as archive:
+                for child in tree_path.iterdir():
+                    archive.add(child, arcname=child.name)
+        elif archive_format == "squashfs":
+            subprocess.run(
+                ["mksquashfs", tree_path, archive_path, "-noappend", "-quiet"],
+                check=True,
+            )
+        else:
+            raise ValueError(f"Archive format {archive_format} not supported.")
+    return archive_path
+
+
+if __name__ == "__main__":
+    # used in the job prologue: python3 june_runs/staging.py source cache_directory
+    # run as a script, as importing june_runs imports JUNE and MPI
+    staged_path = stage_file(sys.argv[1], sys.argv[2])
+    print(f"staged {sys.argv[1]} to {staged_path}")
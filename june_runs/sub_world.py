@@ -0,0 +1,376 @@
+import os
+import fcntl
+import h5py
+import numpy as np
+from pathlib import Path
+
+from june_runs.cache import get_cache_key
+from june_runs.world_subsetter import (
+    indices_to_ranges,
+    read_rows,
+    get_rows_per_domain,
+    write_world_subset,
+)
+
+# JUNE's missing value for integer datasets
+nan_integer = -999
+
+# the geography datasets have one row per area, super area or region
+geography_rows = {
+    "area_": "areas",
+    "social_venues_": "areas",
+    "super_area_": "super_areas",
+    "closest_hospitals_": "super_areas",
+    "region_": "regions",
+}
+
+
+def _decode(values):
+    return np.array([value.decode() for value in values])
+
+
+def get_super_areas_to_keep(world_path, regions=None, super_areas=None):
+    """
+    Ids of the super areas of the world in any of ``regions`` (names) or in
+    ``super_areas`` (names or ids).
+    """
+    if not regions and not super_areas:
+        raise ValueError("A sub-world needs a list of regions or of super areas.")
+    with h5py.File(world_path, "r") as f:
+        geography = f["geography"]
+        super_area_ids = geography["super_area_id"][:]
+        keep = np.zeros(len(super_area_ids), dtype=bool)
+        if regions:
+            region_names = _decode(geography["region_name"][:])
+            unknown = set(regions) - set(region_names)
+            if unknown:
+                raise ValueError(f"Regions {sorted(unknown)} are not in the world.")
+            region_ids = geography["region_id"][:][np.isin(region_names, regions)]
+            keep |= np.isin(geography["super_area_region"][:], region_ids)
+        if super_areas:
+            super_areas = [str(super_area) for super_area in super_areas]
+            names = [name for name in super_areas if not name.isdigit()]
+            ids = [int(name) for name in super_areas if name.isdigit()]
+            keep |= np.isin(_decode(geography["super_area_name"][:]), names)
+            keep |= np.isin(super_area_ids, ids)
+    if not keep.any():
+        raise ValueError("No super area of the world passes the filters.")
+    return np.sort(super_area_ids[keep])
+
+
+def _split(values, lengths):
+    return np.split(values, np.cumsum(lengths)[:-1]) if len(lengths) else []
+
+
+def _keep_masks(lists, keep_values):
+    """
+    For every list, which of its entries are in ``keep_values``.
+    """
+    lengths = [len(values) for values in lists]
+    if sum(lengths) == 0:
+        return [np.zeros(length, dtype=bool) for length in lengths]
+    flat = np.concatenate([np.asarray(values) for values in lists])
+    return _split(np.isin(flat, keep_values), lengths)
+
+
+def _write_lists(group, name, lists, variable_length=False):
+    """
+    Replaces ``group[name]`` by one list per row, as a 2D array if they all
+    have the same length and as a variable length dataset otherwise, like
+    JUNE does.
+    """
+    dtype = h5py.check_vlen_dtype(group[name].dtype) or group[name].dtype
+    del group[name]
+    lengths = set(len(values) for values in lists)
+    if not variable_length and len(lengths) == 1 and lengths != {0}:
+        group.create_dataset(name, data=np.array(list(lists), dtype=dtype))
+        return
+    data = np.empty(len(lists), dtype=object)
+    data[:] = [np.asarray(values, dtype=dtype) for values in lists]
+    group.create_dataset(name, data=data, dtype=h5py.vlen_dtype(np.dtype(dtype)))
+
+
+def _get_whole_group_rows(world_file, super_area_ids):
+    """
+    Rows of the hospitals, cities and stations to keep, those in the kept
+    super areas. Stations are also dropped with their city.
+    """
+    rows = {}
+    if "hospitals" in world_file:
+        rows["hospitals"] = np.isin(
+            world_file["hospitals"]["super_area"][:], super_area_ids
+        )
+    if "cities" in world_file:
+        rows["cities"] = np.isin(
+            world_file["cities"]["city_super_area"][:], super_area_ids
+        )
+    if "stations" in world_file:
+        stations = world_file["stations"]
+        rows["stations"] = np.isin(stations["super_area"][:], super_area_ids)
+        if "cities" in world_file:
+            city_names = world_file["cities"]["name"][:][rows["cities"]]
+            rows["stations"] &= np.isin(stations["station_cities"][:], city_names)
+    return {
+        group_path: indices_to_ranges(np.where(keep)[0])
+        for group_path, keep in rows.items()
+    }
+
+
+def _subset_geography(source, sub_world, super_area_ids):
+    """
+    Replaces the geography copied in full by the kept areas, super areas and
+    regions.
+    """
+    keep = {
+        "areas": np.isin(source["area_super_area"][:], super_area_ids),
+        "super_areas": np.isin(source["super_area_id"][:], super_area_ids),
+    }
+    kept_regions = source["super_area_region"][:][keep["super_areas"]]
+    keep["regions"] = np.isin(source["region_id"][:], kept_regions)
+    del sub_world["geography"]
+    geography = sub_world.create_group("geography")
+    for key, value in source.attrs.items():
+        geography.attrs[key] = value
+    for rows_name in ["areas", "super_areas", "regions"]:
+        geography.attrs[f"n_{rows_name}"] = int(keep[rows_name].sum())
+    for name, dataset in source.items():
+        rows_name = next(
+            (
+                rows
+                for prefix, rows in geography_rows.items()
+                if name.startswith(prefix)
+            ),
+            None,
+        )
+        if rows_name is None:
+            data = dataset[()]
+        else:
+            data = read_rows(dataset, indices_to_ranges(np.where(keep[rows_name])[0]))
+        geography.create_dataset(name, data=data, dtype=dataset.dtype)
+
+
+def _truncate_geography(sub_world):
+    """
+    Removes the links of the kept super areas and areas to hospitals, cities,
+    stations and social venues that are not in the sub-world. Super areas
+    whose closest hospitals are all outside get the closest one inside.
+    """
+    geography = sub_world["geography"]
+    super_area_coordinates = geography["super_area_coordinates"][:]
+    if "hospitals" in sub_world:
+        hospitals = sub_world["hospitals"]
+        hospital_ids = hospitals["id"][:]
+        hospital_super_areas = hospitals["super_area"][:]
+        hospital_coordinates = hospitals["coordinates"][:]
+        ids_lists = list(geography["closest_hospitals_ids"][:])
+        super_areas_lists = list(geography["closest_hospitals_super_areas"][:])
+        masks = _keep_masks(ids_lists, hospital_ids)
+        for k, mask in enumerate(masks):
+            if mask.any():
+                ids_lists[k] = ids_lists[k][mask]
+                super_areas_lists[k] = super_areas_lists[k][mask]
+            elif len(hospital_ids) == 0 or np.all(ids_lists[k] == nan_integer):
+                ids_lists[k] = super_areas_lists[k] = [nan_integer]
+            else:
+                distances = np.sum(
+                    (hospital_coordinates - super_area_coordinates[k]) ** 2, axis=1
+                )
+                closest = np.argmin(distances)
+                ids_lists[k] = [hospital_ids[closest]]
+                super_areas_lists[k] = [hospital_super_areas[closest]]
+        _write_lists(geography, "closest_hospitals_ids", ids_lists)
+        _write_lists(geography, "closest_hospitals_super_areas", super_areas_lists)
+    city_ids = sub_world["cities"]["id"][:] if "cities" in sub_world else []
+    super_area_cities = geography["super_area_city"][:]
+    super_area_cities[~np.isin(super_area_cities, city_ids)] = nan_integer
+    geography["super_area_city"][:] = super_area_cities
+    if "super_area_closest_stations_stations" in geography:
+        station_ids = sub_world["stations"]["id"][:] if "stations" in sub_world else []
+        stations_lists = list(geography["super_area_closest_stations_stations"][:])
+        cities_lists = list(geography["super_area_closest_stations_cities"][:])
+        masks = _keep_masks(stations_lists, station_ids)
+        _write_lists(
+            geography,
+            "super_area_closest_stations_stations",
+            [stations[mask] for stations, mask in zip(stations_lists, masks)],
+        )
+        _write_lists(
+            geography,
+            "super_area_closest_stations_cities",
+            [cities[mask] for cities, mask in zip(cities_lists, masks)],
+        )
+    if "social_venues_super_areas" in geography:
+        super_area_ids = geography["super_area_id"][:]
+        super_areas_lists = list(geography["social_venues_super_areas"][:])
+        masks = _keep_masks(super_areas_lists, super_area_ids)
+        for name in [
+            "social_venues_specs",
+            "social_venues_ids",
+            "social_venues_super_areas",
+        ]:
+            lists = list(geography[name][:])
+            _write_lists(
+                geography,
+                name,
+                [values[mask] for values, mask in zip(lists, masks)],
+                variable_length=True,
+            )
+
+
+def _truncate_residences(sub_world):
+    """
+    Households only visit the households and care homes of the sub-world.
+    """
+    households = sub_world["households"]
+    for name, group_path in [
+        ("households_to_visit", "households"),
+        ("care_homes_to_visit", "care_homes"),
+    ]:
+        if name not in households:
+            continue
+        kept_ids = sub_world[group_path]["id"][:] if group_path in sub_world else []
+        lists = list(households[name][:])
+        masks = _keep_masks(lists, kept_ids)
+        lists = [
+            values[mask] if mask.any() else [nan_integer]
+            for values, mask in zip(lists, masks)
+        ]
+        _write_lists(households, name, lists, variable_length=True)
+
+
+def _truncate_commute(sub_world):
+    """
+    Cities and stations only keep their super areas, commuters and stations
+    in the sub-world.
+    """
+    people_ids = sub_world["population"]["id"][:]
+    station_ids = sub_world["stations"]["id"][:] if "stations" in sub_world else []
+    if "cities" in sub_world:
+        cities = sub_world["cities"]
+        super_area_names = sub_world["geography"]["super_area_name"][:]
+        for name, keep_values in [
+            ("super_areas", super_area_names),
+            ("internal_commuters", people_ids),
+            ("city_station_id", station_ids),
+            ("inter_city_station_id", station_ids),
+        ]:
+            lists = list(cities[name][:])
+            masks = _keep_masks(lists, keep_values)
+            _write_lists(
+                cities, name, [values[mask] for values, mask in zip(lists, masks)]
+            )
+    if "stations" in sub_world:
+        stations = sub_world["stations"]
+        lists = list(stations["commuters"][:])
+        masks = _keep_masks(lists, people_ids)
+        _write_lists(
+            stations,
+            "commuters",
+            [values[mask] for values, mask in zip(lists, masks)],
+            variable_length=True,
+        )
+
+
+def _truncate_population(sub_world, super_area_ids, chunk_size):
+    """
+    People lose their subgroups (workplaces, schools, ...) and work super
+    area outside the sub-world, so they stay at home instead. The number of
+    workers of every super area is updated.
+    """
+    population = sub_world["population"]
+    city_ids = sub_world["cities"]["id"][:] if "cities" in sub_world else []
+    n_people = population["id"].shape[0]
+    workers = []
+    for idx1 in range(0, n_people, chunk_size):
+        idx2 = min(idx1 + chunk_size, n_people)
+        group_super_areas = population["group_super_areas"][idx1:idx2]
+        outside = (group_super_areas != nan_integer) & ~np.isin(
+            group_super_areas, super_area_ids
+        )
+        for name in ["group_ids", "subgroup_types", "group_super_areas"]:
+            values = population[name][idx1:idx2]
+            values[outside] = nan_integer
+            population[name][idx1:idx2] = values
+        work_super_areas = population["work_super_area"][idx1:idx2]
+        outside = (work_super_areas != nan_integer) & ~np.isin(
+            work_super_areas, super_area_ids
+        )
+        work_super_areas[outside] = nan_integer
+        population["work_super_area"][idx1:idx2] = work_super_areas
+        coordinates = population["work_super_area_coords"][idx1:idx2]
+        coordinates[outside] = np.nan
+        population["work_super_area_coords"][idx1:idx2] = coordinates
+        cities = population["work_super_area_city"][idx1:idx2]
+        cities[outside | ~np.isin(cities, city_ids)] = nan_integer
+        population["work_super_area_city"][idx1:idx2] = cities
+        workers.append(work_super_areas[work_super_areas != nan_integer])
+    geography = sub_world["geography"]
+    worker_super_areas, n_workers = np.unique(
+        np.concatenate(workers) if workers else [], return_counts=True
+    )
+    super_area_n_workers = np.zeros(geography.attrs["n_super_areas"], dtype=np.int64)
+    positions = np.searchsorted(geography["super_area_id"][:], worker_super_areas)
+    super_area_n_workers[positions] = n_workers
+    geography["super_area_n_workers"][:] = super_area_n_workers
+
+
+def write_sub_world(world_path, sub_world_path, super_area_ids, chunk_size=100000):
+    """
+    Writes a world file with only the super areas ``super_area_ids`` of the
+    world, and everything in them. The links that cross the boundary
+    (people working or studying outside, commuters to stations outside,
+    households visiting households outside, ...) are removed, so the
+    sub-world loads and runs on its own.
+    """
+    super_area_ids = np.sort(np.asarray(super_area_ids, dtype=np.int64))
+    rows = get_rows_per_domain(
+        world_path, {int(super_area_id): 0 for super_area_id in super_area_ids}
+    )[0]
+    with h5py.File(world_path, "r") as world_file:
+        rows.update(_get_whole_group_rows(world_file, super_area_ids))
+        write_world_subset(world_file, sub_world_path, rows=rows)
+        with h5py.File(sub_world_path, "a") as sub_world:
+            _subset_geography(world_file["geography"], sub_world, super_area_ids)
+    with h5py.File(sub_world_path, "a") as sub_world:
+        _truncate_geography(sub_world)
+        if "households" in sub_world:
+            _truncate_residences(sub_world)
+        _truncate_commute(sub_world)
+        _truncate_population(sub_world, super_area_ids, chunk_size=chunk_size)
+    return Path(sub_world_path)
+
+
+def get_sub_world(world_path, regions=None, super_areas=None, cache_path=None):
+    """
+    Path to the sub-world of ``world_path`` with the super areas in
+    ``regions`` or ``super_areas`` (see ``get_super_areas_to_keep``).
+    Sub-worlds are cached in ``cache_path``, by default ``sub_worlds`` next to
+    the world, under a hash of the world file and of the super areas kept, so
+    every run set with the same filters reuses the same file.
+    """
+    world_path = Path(world_path).resolve()
+    if cache_path is None:
+        cache_path = world_path.parent / "sub_worlds"
+    cache_path = Path(cache_path)
+    cache_path.mkdir(exist_ok=True, parents=True)
+    super_area_ids = get_super_areas_to_keep(
+        world_path, regions=regions, super_areas=super_areas
+    )
+    world_stat = world_path.stat()
+    key = get_cache_key(
+        {
+            "world": [str(world_path), world_stat.st_size, world_stat.st_mtime],
+            "super_areas": super_area_ids.tolist(),
+        }
+    )
+    sub_world_path = cache_path / f"{world_path.stem}_{key}.hdf5"
+    with open(sub_world_path.with_name(sub_world_path.name + ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if not sub_world_path.exists():
+                temporary_path = sub_world_path.with_name(sub_world_path.name + ".tmp")
+                write_sub_world(world_path, temporary_path, super_area_ids)
+                os.replace(temporary_path, sub_world_path)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return sub_world_path
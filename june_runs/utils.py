@@ -1,5 +1,6 @@
 import sys
 import psutil
+import resource
 import shutil
 import os
 import subprocess
@@ -98,6 +99,9 @@ def parse_paths(paths_configuration):
     ret["results_path"] = ret["save_path"] / "results"
     ret["results_path"].mkdir(exist_ok=True, parents=True)
 
+    ret["cache_path"] = ret["save_path"] / "cache"
+    ret["static_records_path"] = ret["save_path"] / "static_records"
+
     ret["runs_path"] = ret["save_path"] / "runs"
     ret["runs_path"].mkdir(exist_ok=True, parents=True)
     return ret
@@ -117,6 +121,13 @@ def memory_status(when="now"):
     return f"memory {when}: \n    {tot}, {used}, {perc}, {avail}"
 
 
+def peak_memory():
+    """
+    Peak resident memory of this process in GB.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 ** 2
+
+
 def config_checks(
     paths_configuration=None, parameter_configuration=None, system_configuration=None
 ):
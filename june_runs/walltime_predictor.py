@@ -0,0 +1,166 @@
+import os
+import json
+import warnings
+import numpy as np
+from pathlib import Path
+
+run_statistics_filename = "run_statistics.json"
+
+
+def parse_walltime(walltime: str):
+    """
+    Converts a scheduler walltime ("HH:MM:SS" or "HH:MM") into seconds.
+    """
+    fields = [int(field) for field in str(walltime).split(":")]
+    if len(fields) == 3:
+        hours, minutes, seconds = fields
+    elif len(fields) == 2:
+        hours, minutes = fields
+        seconds = 0
+    else:
+        raise ValueError(f"Walltime {walltime} not understood.")
+    return 3600 * hours + 60 * minutes + seconds
+
+
+def format_walltime(seconds: float, scheduler: str):
+    """
+    Converts seconds into the walltime format expected by the scheduler.
+    LSF takes "HH:MM", Slurm and PBS take "HH:MM:SS".
+    """
+    seconds = int(np.ceil(seconds))
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    if scheduler == "lsf":
+        if seconds > 0:
+            minutes += 1
+        if minutes == 60:
+            hours += 1
+            minutes = 0
+        return f"{hours:02d}:{minutes:02d}"
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+
+def get_run_features(parameters: dict, n_days: int, world_path: str, n_ranks: int):
+    """
+    Gathers the quantities that drive the run time of a simulation.
+    The world size is measured as the size of the world file in GB.
+    """
+    interaction_parameters = parameters.get("interaction", {})
+    infection_parameters = parameters.get("infection", {})
+    betas = interaction_parameters.get("betas", None) or {}
+    seed_strength = infection_parameters.get("seed_strength", None)
+    if seed_strength is None:
+        seed_strength = 1.0
+    return {
+        "world_size": os.path.getsize(world_path) / 1024 ** 3,
+        "n_ranks": int(n_ranks),
+        "n_days": int(n_days),
+        "betas": float(sum(betas.values())),
+        "seed_strength": float(seed_strength),
+    }
+
+
+class WalltimePredictor:
+    """
+    Predicts the wall time of a run from the run statistics of previous runs.
+    The wall time is modelled as a world loading cost plus a daily cost,
+
+        t = c0 + c1 * w / r + n_days * (c2 + c3 * w / r + c4 * w * b * s / r),
+
+    where w is the world size, r the number of ranks, b the sum of the betas
+    and s the seed strength. The coefficients are fitted by least squares.
+    If the recorded runs don't determine all of them (too few runs, or runs that
+    don't vary enough), only a daily cost per world size per rank is fitted.
+    """
+
+    def __init__(self, coefficients, safety_margin=1.5, minimum_time=600):
+        self.coefficients = np.array(coefficients, dtype=float)
+        self.safety_margin = safety_margin
+        self.minimum_time = minimum_time
+
+    @classmethod
+    def from_run_statistics(
+        cls, run_statistics: list, safety_margin=1.5, minimum_time=600
+    ):
+        if not run_statistics:
+            raise ValueError("Need at least one recorded run to predict walltimes.")
+        design_matrix = cls._get_design_matrix(run_statistics)
+        wall_times = np.array([stats["wall_time"] for stats in run_statistics])
+        n_runs, n_coefficients = design_matrix.shape
+        if (
+            n_runs > n_coefficients
+            and np.linalg.matrix_rank(design_matrix) == n_coefficients
+        ):
+            coefficients = np.linalg.lstsq(design_matrix, wall_times, rcond=None)[0]
+        else:
+            warnings.warn(
+                f"{n_runs} recorded runs can't determine the {n_coefficients} "
+                "walltime coefficients, falling back to a daily rate model."
+            )
+            # n_days * world_per_rank column
+            daily_load = design_matrix[:, 3]
+            coefficients = np.zeros(n_coefficients)
+            coefficients[3] = np.max(wall_times / daily_load)
+        return cls(
+            coefficients=coefficients,
+            safety_margin=safety_margin,
+            minimum_time=minimum_time,
+        )
+
+    @classmethod
+    def from_directories(cls, directories: list, safety_margin=1.5, minimum_time=600):
+        """
+        Reads all the run statistics files found under the given directories,
+        typically the results folders of previous run sets.
+        """
+        run_statistics = []
+        for directory in directories:
+            for statistics_path in Path(directory).glob(
+                f"**/{run_statistics_filename}"
+            ):
+                with open(statistics_path, "r") as f:
+                    run_statistics.append(json.load(f))
+        return cls.from_run_statistics(
+            run_statistics=run_statistics,
+            safety_margin=safety_margin,
+            minimum_time=minimum_time,
+        )
+
+    @staticmethod
+    def _get_design_matrix(features_list):
+        rows = []
+        for features in features_list:
+            world_per_rank = features["world_size"] / features["n_ranks"]
+            n_days = features["n_days"]
+            infection_load = (
+                world_per_rank * features["betas"] * features["seed_strength"]
+            )
+            rows.append(
+                [
+                    1.0,
+                    world_per_rank,
+                    n_days,
+                    n_days * world_per_rank,
+                    n_days * infection_load,
+                ]
+            )
+        return np.array(rows, dtype=float)
+
+    def predict_duration(self, features: dict):
+        """
+        Expected wall time of a run in seconds.
+        """
+        design_matrix = self._get_design_matrix([features])
+        return max(float(design_matrix[0] @ self.coefficients), 0.0)
+
+    def predict_walltime(self, features: dict, max_time=None):
+        """
+        Walltime to request for a run in seconds, including the safety margin.
+        Capped at ``max_time`` (in seconds) if given.
+        """
+        walltime = max(
+            self.safety_margin * self.predict_duration(features), self.minimum_time
+        )
+        if max_time is not None:
+            walltime = min(walltime, max_time)
+        return walltime
@@ -0,0 +1,281 @@
+import json
+import h5py
+import numpy as np
+from pathlib import Path
+
+# groups that JUNE needs in full in every domain (it builds external
+# references from them), so they are never subset.
+whole_groups = ("geography", "hospitals", "cities", "stations")
+
+
+def indices_to_ranges(indices):
+    """
+    Converts a sorted array of row indices into an (n, 2) array of
+    [start, stop) ranges of contiguous rows.
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    if len(indices) == 0:
+        return np.empty((0, 2), dtype=np.int64)
+    breaks = np.where(np.diff(indices) != 1)[0] + 1
+    starts = indices[np.concatenate([[0], breaks])]
+    stops = indices[np.concatenate([breaks - 1, [len(indices) - 1]])] + 1
+    return np.stack([starts, stops], axis=1)
+
+
+def read_rows(dataset, ranges, collective=False):
+    """
+    Reads the rows of ``dataset`` in ``ranges`` with a single read call, selecting
+    the union of the hyperslabs. If ``collective`` is True the read is done with
+    collective MPI-IO, so every rank has to call this for the same dataset, even
+    with no rows to read.
+    """
+    n_rows = int(sum(stop - start for start, stop in ranges))
+    if h5py.check_vlen_dtype(dataset.dtype) is not None:
+        # parallel HDF5 cannot read variable length data collectively
+        if n_rows == 0:
+            return np.empty((0,) + dataset.shape[1:], dtype=dataset.dtype)
+        indices = np.concatenate([np.arange(start, stop) for start, stop in ranges])
+        return dataset[indices]
+    out = np.empty((max(n_rows, 1),) + dataset.shape[1:], dtype=dataset.dtype)
+    file_space = dataset.id.get_space()
+    file_space.select_none()
+    for start, stop in ranges:
+        file_space.select_hyperslab(
+            (start,) + (0,) * (len(dataset.shape) - 1),
+            (stop - start,) + dataset.shape[1:],
+            op=h5py.h5s.SELECT_OR,
+        )
+    memory_space = h5py.h5s.create_simple(out.shape)
+    if n_rows == 0:
+        memory_space.select_none()
+    if collective:
+        dxpl = h5py.h5p.create(h5py.h5p.DATASET_XFER)
+        dxpl.set_dxpl_mpio(h5py.h5fd.MPIO_COLLECTIVE)
+    else:
+        dxpl = None
+    dataset.id.read(memory_space, file_space, out, dxpl=dxpl)
+    return out[:n_rows]
+
+
+def get_row_groups(hdf5_file):
+    """
+    Paths of the groups in the world file that hold one row per object (people,
+    households, social venues, ...) and can be subset.
+    """
+    row_groups = []
+
+    def visit(name, obj):
+        if (
+            isinstance(obj, h5py.Group)
+            and "id" in obj
+            and name.split("/")[0] not in whole_groups
+        ):
+            row_groups.append(name)
+
+    hdf5_file.visititems(visit)
+    return row_groups
+
+
+def get_super_area_per_row(group, area_ids, area_super_areas):
+    """
+    Super area of every row of ``group``, read from its ``super_area`` dataset
+    or, failing that, from its ``area`` dataset. None if the group has neither.
+    """
+    if "super_area" in group:
+        return group["super_area"][:]
+    if "area" in group:
+        areas = group["area"][:]
+        sorter = np.argsort(area_ids)
+        positions = sorter[np.searchsorted(area_ids, areas, sorter=sorter)]
+        return area_super_areas[positions]
+    return None
+
+
+def get_number_of_domains(super_areas_to_domain_dict: dict, number_of_domains=None):
+    """
+    Domains are numbered from 0, some of them can have no super areas.
+    """
+    max_domain_id = max(super_areas_to_domain_dict.values())
+    if number_of_domains is None:
+        return int(max_domain_id) + 1
+    if number_of_domains <= max_domain_id:
+        raise ValueError(
+            f"Partition has domain {max_domain_id} "
+            f"but only {number_of_domains} domains."
+        )
+    return int(number_of_domains)
+
+
+def get_rows_per_domain(
+    world_path, super_areas_to_domain_dict: dict, number_of_domains=None
+):
+    """
+    For every domain, the row ranges of every row group that belong to the domain.
+    Returns {domain_id: {group_path: ranges}}, rows of groups that cannot be
+    located are kept in every domain.
+    """
+    super_area_keys = np.array(sorted(super_areas_to_domain_dict.keys()))
+    super_area_domains = np.array(
+        [super_areas_to_domain_dict[key] for key in super_area_keys]
+    )
+    domain_ids = list(
+        range(get_number_of_domains(super_areas_to_domain_dict, number_of_domains))
+    )
+    rows_per_domain = {domain_id: {} for domain_id in domain_ids}
+    with h5py.File(world_path, "r") as f:
+        area_ids = f["geography"]["area_id"][:]
+        area_super_areas = f["geography"]["area_super_area"][:]
+        for group_path in get_row_groups(f):
+            group = f[group_path]
+            row_super_areas = get_super_area_per_row(group, area_ids, area_super_areas)
+            if row_super_areas is None:
+                all_rows = np.array([[0, group["id"].shape[0]]], dtype=np.int64)
+                for domain_id in domain_ids:
+                    rows_per_domain[domain_id][group_path] = all_rows
+                continue
+            positions = np.searchsorted(super_area_keys, row_super_areas)
+            positions = np.clip(positions, 0, len(super_area_keys) - 1)
+            located = super_area_keys[positions] == row_super_areas
+            row_domains = np.where(located, super_area_domains[positions], -1)
+            for domain_id in domain_ids:
+                rows_per_domain[domain_id][group_path] = indices_to_ranges(
+                    np.where(row_domains == domain_id)[0]
+                )
+    return rows_per_domain
+
+
+def _copy_attributes(source, destination, n_rows=None, n_rows_subset=None):
+    for key, value in source.attrs.items():
+        # counters of rows (n_people, n_households, ...) refer to the subset
+        if (
+            n_rows is not None
+            and np.ndim(value) == 0
+            and np.issubdtype(np.asarray(value).dtype, np.integer)
+            and value == n_rows
+        ):
+            value = n_rows_subset
+        destination.attrs[key] = value
+
+
+def _write_group(source, destination, rows, collective):
+    n_rows = n_rows_subset = ranges = None
+    if source.name.lstrip("/") in rows:
+        ranges = rows[source.name.lstrip("/")]
+        n_rows = source["id"].shape[0]
+        n_rows_subset = int(sum(stop - start for start, stop in ranges))
+    _copy_attributes(source, destination, n_rows, n_rows_subset)
+    for name, item in source.items():
+        if isinstance(item, h5py.Group):
+            _write_group(item, destination.create_group(name), rows, collective)
+            continue
+        if len(item.shape) == 0:
+            destination.create_dataset(name, data=item[()])
+            continue
+        if ranges is not None and item.shape[0] == n_rows:
+            item_ranges = ranges
+        else:
+            item_ranges = [(0, item.shape[0])]
+        data = read_rows(item, item_ranges, collective=collective)
+        if len(item.shape) > 1:
+            maxshape = (None,) + item.shape[1:]
+        else:
+            maxshape = (None,)
+        dataset = destination.create_dataset(
+            name, data=data, dtype=item.dtype, maxshape=maxshape
+        )
+        _copy_attributes(item, dataset)
+
+
+def write_world_subset(world_file, subset_path, rows: dict, collective=False):
+    """
+    Writes a world file with only the given rows of the row groups (see
+    ``get_rows_per_domain``). Every other group is copied in full.
+    ``world_file`` is an open h5py file, which can be opened with the mpio
+    driver, in which case ``collective`` reads are used.
+    """
+    subset_path = Path(subset_path)
+    subset_path.parent.mkdir(exist_ok=True, parents=True)
+    with h5py.File(subset_path, "w") as f:
+        _write_group(world_file, f, rows, collective=collective)
+    return subset_path
+
+
+def write_domain_partition(
+    hdf5_file, domain_id, super_areas_to_domain_dict: dict, number_of_domains=None
+):
+    """
+    Stores the domain id, the number of domains and the full super area -> domain
+    partition in a domain file, so that the references to people and groups in
+    other domains can be resolved without the original world file.
+    """
+    super_area_ids = np.array(sorted(super_areas_to_domain_dict.keys()), dtype=np.int64)
+    super_area_domains = np.array(
+        [super_areas_to_domain_dict[key] for key in super_area_ids], dtype=np.int64
+    )
+    group = hdf5_file.create_group("domain")
+    group.attrs["domain_id"] = domain_id
+    group.attrs["number_of_domains"] = get_number_of_domains(
+        super_areas_to_domain_dict, number_of_domains
+    )
+    group.create_dataset("super_area_ids", data=super_area_ids)
+    group.create_dataset("super_area_domains", data=super_area_domains)
+
+
+def read_domain_partition(domain_world_path):
+    """
+    Reads the domain id, number of domains and super area -> domain partition
+    stored by ``write_domain_partition``.
+    """
+    with h5py.File(domain_world_path, "r") as f:
+        group = f["domain"]
+        domain_id = int(group.attrs["domain_id"])
+        number_of_domains = int(group.attrs["number_of_domains"])
+        super_areas_to_domain_dict = {
+            int(key): int(value)
+            for key, value in zip(
+                group["super_area_ids"][:], group["super_area_domains"][:]
+            )
+        }
+    return domain_id, number_of_domains, super_areas_to_domain_dict
+
+
+def get_domain_file_path(split_world_path, domain_id):
+    return Path(split_world_path) / f"domain_{domain_id:04d}.hdf5"
+
+
+def split_world(
+    world_path,
+    split_world_path,
+    super_areas_to_domain_dict: dict,
+    number_of_domains=None,
+):
+    """
+    Writes one compact world file per domain to ``split_world_path``, each with
+    only the rows of the domain, the geography, and the partition. Runs on the
+    same world and number of ranks can then load their domain file directly.
+    Domains without super areas get a file too, so that every rank finds one.
+    """
+    split_world_path = Path(split_world_path)
+    split_world_path.mkdir(exist_ok=True, parents=True)
+    number_of_domains = get_number_of_domains(
+        super_areas_to_domain_dict, number_of_domains
+    )
+    rows_per_domain = get_rows_per_domain(
+        world_path, super_areas_to_domain_dict, number_of_domains=number_of_domains
+    )
+    domain_paths = []
+    with h5py.File(world_path, "r") as world_file:
+        for domain_id, rows in rows_per_domain.items():
+            domain_path = get_domain_file_path(split_world_path, domain_id)
+            write_world_subset(world_file, domain_path, rows=rows)
+            with h5py.File(domain_path, "a") as f:
+                write_domain_partition(
+                    f,
+                    domain_id,
+                    super_areas_to_domain_dict,
+                    number_of_domains=number_of_domains,
+                )
+            domain_paths.append(domain_path)
+    with open(split_world_path / "super_area_ids_to_domain.json", "w") as f:
+        json.dump({int(k): int(v) for k, v in super_areas_to_domain_dict.items()}, f)
+    return domain_paths
@@ -0,0 +1,48 @@
+import argparse
+from pathlib import Path
+
+from june_runs.sub_world import get_super_areas_to_keep, get_sub_world, write_sub_world
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Extract the regions or super areas of a world to a sub-world."
+    )
+    parser.add_argument("-w", "--world", help="Path to the world file.", required=True)
+    parser.add_argument(
+        "-r", "--regions", help="Names of the regions to keep.", nargs="+", default=None
+    )
+    parser.add_argument(
+        "-s",
+        "--super-areas",
+        help="Names or ids of the super areas to keep.",
+        nargs="+",
+        default=None,
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="Path to write the sub-world to, instead of the sub-world cache.",
+        default=None,
+    )
+    parser.add_argument(
+        "-c",
+        "--cache",
+        help="Sub-world cache directory, sub_worlds next to the world by default.",
+        default=None,
+    )
+    args = parser.parse_args()
+
+    if args.output is not None:
+        super_area_ids = get_super_areas_to_keep(
+            args.world, regions=args.regions, super_areas=args.super_areas
+        )
+        sub_world_path = write_sub_world(args.world, args.output, super_area_ids)
+    else:
+        sub_world_path = get_sub_world(
+            args.world,
+            regions=args.regions,
+            super_areas=args.super_areas,
+            cache_path=args.cache,
+        )
+    print(f"sub-world written to {Path(sub_world_path)}")
@@ -0,0 +1,63 @@
+import argparse
+import json
+from pathlib import Path
+
+from june_runs.scaling_advisor import ScalingBenchmark, ScalingAdvisor
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark a world at several rank counts and recommend cpus_per_job."
+    )
+    parser.add_argument("-w", "--world", help="Path to the world file.", required=True)
+    parser.add_argument(
+        "-s", "--system", help="System to store the recommendation for.", required=True
+    )
+    parser.add_argument(
+        "-o", "--output", help="Where to run the benchmark.", default="scaling_benchmark"
+    )
+    parser.add_argument(
+        "-n",
+        "--ranks",
+        help="Rank counts to benchmark.",
+        nargs="+",
+        type=int,
+        default=[1, 2, 4, 8, 16, 32],
+    )
+    parser.add_argument(
+        "--benchmark-days", help="Days to simulate per benchmark.", type=int, default=3
+    )
+    parser.add_argument(
+        "--n-days", help="Length of the production runs.", type=int, default=90
+    )
+    parser.add_argument(
+        "-p", "--parameters", help="Optional json file with run parameters.", default=None
+    )
+    parser.add_argument(
+        "--analyse-only",
+        help="Skip the runs and analyse an existing benchmark.",
+        default=False,
+        action="store_true",
+    )
+    args = parser.parse_args()
+
+    if args.analyse_only:
+        advisor = ScalingAdvisor.from_directory(args.output)
+    else:
+        parameters = None
+        if args.parameters is not None:
+            with open(args.parameters, "r") as f:
+                parameters = json.load(f)
+        benchmark = ScalingBenchmark(
+            world_path=args.world,
+            save_path=args.output,
+            system=args.system,
+            rank_counts=args.ranks,
+            n_days=args.benchmark_days,
+            parameters=parameters,
+        )
+        advisor = benchmark.run()
+    recommendation = advisor.save_recommendation(
+        system=args.system, world_name=Path(args.world).stem, n_days=args.n_days
+    )
+    print(f"recommended layout for {Path(args.world).stem}: {recommendation}")
@@ -0,0 +1,50 @@
+import argparse
+import json
+from pathlib import Path
+
+from june_runs.runner import get_domain_partition, keys_to_int
+from june_runs.world_subsetter import split_world
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Split a world into one file per domain for a given number of ranks."
+    )
+    parser.add_argument("-w", "--world", help="Path to the world file.", required=True)
+    parser.add_argument(
+        "-o", "--output", help="Directory to store the domain files.", required=True
+    )
+    parser.add_argument(
+        "-n", "--number-of-domains", help="Number of MPI ranks.", type=int, default=None
+    )
+    parser.add_argument(
+        "-p",
+        "--partition",
+        help="Existing super_area_ids_to_domain.json to split with.",
+        default=None,
+    )
+    parser.add_argument(
+        "--partitioner",
+        help="spatial or graph (cutting as few commute and leisure links as possible).",
+        default="spatial",
+    )
+    args = parser.parse_args()
+
+    if args.partition is not None:
+        with open(args.partition, "r") as f:
+            super_area_ids_to_domain_dict = json.load(f, object_hook=keys_to_int)
+    elif args.number_of_domains is not None:
+        super_area_ids_to_domain_dict, _ = get_domain_partition(
+            args.world,
+            number_of_domains=args.number_of_domains,
+            partitioner=args.partitioner,
+        )
+    else:
+        raise ValueError("Either the number of domains or a partition is needed.")
+    domain_paths = split_world(
+        world_path=args.world,
+        split_world_path=args.output,
+        super_areas_to_domain_dict=super_area_ids_to_domain_dict,
+        number_of_domains=args.number_of_domains,
+    )
+    print(f"wrote {len(domain_paths)} domain files to {Path(args.output)}")
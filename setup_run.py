@@ -8,8 +8,17 @@ import subprocess
 from copy import deepcopy
 from pathlib import Path
 
+import june
+import june_runs
+from june import paths as june_paths
 from june_runs.utils import parse_paths, config_checks, git_checks, copy_input_data
-from june_runs import ParameterGenerator, ScriptMaker
+from june_runs.staging import pack_environment
+from june_runs import ParameterGenerator, ScriptMaker, WalltimePredictor
+from june_runs.script_maker import load_system_configuration
+from june_runs.walltime_predictor import get_run_features
+from june_runs.common_random_numbers import get_run_seed
+from june_runs.screening import get_scale_factor, screening_filename
+from june_runs.sub_world import get_sub_world
 
 
 class RunSetup:
@@ -20,16 +29,60 @@ class RunSetup:
     def __init__(self, run_configuration):
         self.run_configuration = run_configuration
         self.paths = parse_paths(run_configuration["paths_configuration"])
+        world_filter = run_configuration.get("world_filter", None)
+        if world_filter is not None:
+            self.paths["world_path"] = self.get_sub_world_path(
+                self.paths["world_path"], world_filter, paths=self.paths
+            )
         self.parameters = run_configuration["parameter_configuration"]
         self.parameter_generator = self.init_parameter_generator(
             self.parameters, paths=self.paths
         )
-        system_configuration = run_configuration["system_configuration"]
+        system_configuration = self.resolve_job_layout(
+            run_configuration["system_configuration"], paths=self.paths
+        )
+        random_seed = self.run_configuration.get("random_seed", "random")
+        if random_seed == "random":
+            self.run_set_seed = random.randint(0, 1_000_000_000)
+        else:
+            self.run_set_seed = None
+        self.screening_configuration = run_configuration.get(
+            "screening_configuration", None
+        )
+        walltimes, expected_durations = self.predict_walltimes(system_configuration)
+        environment_archive = self.init_environment_archive(system_configuration)
         self.script_maker = self.init_script_maker(
             system_configuration,
             self.paths,
             number_of_jobs=len(self.parameter_generator),
+            walltimes=walltimes,
+            expected_durations=expected_durations,
+            environment_archive=environment_archive,
+            # promoted runs are submitted one by one
+            runs_per_job=1 if self.screening_configuration is not None else None,
         )
+        if self.screening_configuration is not None:
+            self.screening_paths = self.get_screening_paths(
+                self.paths, self.screening_configuration
+            )
+            screening_system_configuration = self.get_screening_system_configuration(
+                run_configuration["system_configuration"],
+                self.screening_configuration,
+                paths=self.screening_paths,
+            )
+            walltimes, expected_durations = self.predict_walltimes(
+                screening_system_configuration,
+                world_path=self.screening_paths["world_path"],
+                n_days=self.screening_n_days,
+            )
+            self.screening_script_maker = self.init_script_maker(
+                screening_system_configuration,
+                self.screening_paths,
+                number_of_jobs=len(self.parameter_generator),
+                walltimes=walltimes,
+                expected_durations=expected_durations,
+                environment_archive=environment_archive,
+            )
         git_checks()
         config_checks(
             paths_configuration=self.paths,
@@ -72,8 +125,116 @@ class RunSetup:
             raise NotImplementedError
         return parameter_generator
 
+    @staticmethod
+    def resolve_job_layout(system_configuration, paths):
+        """
+        Replaces ``cpus_per_job: auto`` and ``memory_per_job: auto`` with the
+        layout recommended by the scaling benchmark for this world.
+        """
+        system_configuration = deepcopy(system_configuration)
+        to_resolve = [
+            key
+            for key in ["cpus_per_job", "memory_per_job"]
+            if system_configuration.get(key) == "auto"
+        ]
+        if not to_resolve:
+            return system_configuration
+        world_name = Path(paths["world_path"]).stem
+        layouts = load_system_configuration(
+            system_configuration["system_to_use"]
+        ).get("recommended_layouts", {})
+        if world_name not in layouts:
+            raise ValueError(
+                f"No recommended layout for world {world_name}, run scripts/scaling_benchmark.py first."
+            )
+        for key in to_resolve:
+            system_configuration[key] = layouts[world_name][key]
+        return system_configuration
+
+    def predict_walltimes(self, system_configuration, world_path=None, n_days=None):
+        """
+        If ``walltime_prediction`` is given in the system configuration, predicts
+        the walltime and expected duration of every run from the run statistics
+        of previous run sets. Otherwise every job requests the system max_time.
+        """
+        world_path = world_path or self.paths["world_path"]
+        n_days = n_days or self.parameters["n_days"]
+        walltime_configuration = system_configuration.get("walltime_prediction", None)
+        if walltime_configuration is None:
+            return None, None
+        directories = self._process_placeholders_in_lines(
+            lines=walltime_configuration["run_statistics_paths"], paths=self.paths
+        )
+        predictor = WalltimePredictor.from_directories(
+            directories=directories,
+            safety_margin=walltime_configuration.get("safety_margin", 1.5),
+            minimum_time=walltime_configuration.get("minimum_time", 600),
+        )
+        # replicates run in the same job count as extra simulated days
+        n_replicates = (
+            self.run_configuration.get("runner_configuration", None) or {}
+        ).get("replicates", 1)
+        walltimes = []
+        expected_durations = []
+        for parameters in self.parameter_generator:
+            features = get_run_features(
+                parameters=parameters,
+                n_days=n_days * n_replicates,
+                world_path=world_path,
+                n_ranks=system_configuration["cpus_per_job"],
+            )
+            walltimes.append(predictor.predict_walltime(features))
+            expected_durations.append(predictor.predict_duration(features))
+        return walltimes, expected_durations
+
+    def init_environment_archive(self, system_configuration):
+        """
+        If ``stage_environment`` is given in the system configuration, packs the
+        virtual environment, JUNE and june_runs into a single archive that the jobs
+        unpack on local disk. The JUNE data and configs stay where they are.
+        An existing archive is reused unless ``repack`` is True.
+        """
+        staging_configuration = system_configuration.get("stage_environment", None)
+        if staging_configuration is None:
+            return None
+        archive_path = self._process_placeholders_in_lines(
+            lines=[staging_configuration["archive_path"]], paths=self.paths
+        )[0]
+        if Path(archive_path).exists() and not staging_configuration.get(
+            "repack", False
+        ):
+            return archive_path
+        june_package_path = Path(june.__path__[0]).resolve()
+        symlinks = {}
+        for name, path in [
+            ("data", june_paths.data_path),
+            ("configs", june_paths.configs_path),
+        ]:
+            path = Path(path).resolve()
+            # only what lives outside the package needs linking
+            if path.parent != june_package_path:
+                symlinks[name] = path
+        print(f"packing the environment into {archive_path}")
+        pack_environment(
+            archive_path=archive_path,
+            virtual_env_path=self.paths["virtual_env_path"],
+            package_paths=[june_package_path, Path(june_runs.__path__[0])],
+            symlinks=symlinks,
+            archive_format=staging_configuration.get("format", "tar"),
+        )
+        return archive_path
+
     @classmethod
-    def init_script_maker(cls, system_configuration, paths, number_of_jobs):
+    def init_script_maker(
+        cls,
+        system_configuration,
+        paths,
+        number_of_jobs,
+        walltimes=None,
+        expected_durations=None,
+        environment_archive=None,
+        runs_per_job=None,
+    ):
         extra_header_lines = cls._process_placeholders_in_lines(
             lines=system_configuration.get("extra_header_lines", []), paths=paths
         )
@@ -93,6 +254,17 @@ class RunSetup:
             extra_header_lines=extra_header_lines,
             extra_module_lines=extra_module_lines,
             extra_command_lines=extra_command_lines,
+            walltimes=walltimes,
+            expected_durations=expected_durations,
+            threads_per_rank=system_configuration.get("threads_per_rank", None),
+            ranks_per_node=system_configuration.get("ranks_per_node", None),
+            world_path=paths["world_path"],
+            stage_world=system_configuration.get("stage_world", False),
+            environment_archive=environment_archive,
+            environment_format=system_configuration.get("stage_environment", {}).get(
+                "format", "tar"
+            ),
+            runs_per_job=runs_per_job or system_configuration.get("runs_per_job", 1),
         )
 
     @classmethod
@@ -110,37 +282,117 @@ class RunSetup:
             ret.append(line2)
         return ret
 
-    def save_run_parameters(self):
+    @property
+    def screening_n_days(self):
+        return self.screening_configuration.get("n_days", self.parameters["n_days"])
+
+    def get_sub_world_path(self, world_path, world_filter, paths):
+        """
+        Extracts (or reuses from the cache) the sub-world of ``world_path``
+        with the ``regions`` and ``super_areas`` of ``world_filter``.
+        """
+        cache_path = world_filter.get("cache_path", None)
+        if cache_path is not None:
+            cache_path = self._process_placeholders_in_lines(
+                lines=[cache_path], paths=paths
+            )[0]
+        sub_world_path = get_sub_world(
+            world_path,
+            regions=world_filter.get("regions", None),
+            super_areas=world_filter.get("super_areas", None),
+            cache_path=cache_path,
+        )
+        print(f"running on the sub-world {sub_world_path}")
+        return sub_world_path
+
+    def get_screening_paths(self, paths, screening_configuration):
+        """
+        The screening runs use the reduced world and are stored in ``screening``
+        inside the runs and results directories.
+        """
+        screening_paths = dict(paths)
+        if "world_path" in screening_configuration:
+            screening_paths["world_path"] = Path(
+                self._process_placeholders_in_lines(
+                    lines=[screening_configuration["world_path"]], paths=paths
+                )[0]
+            )
+        else:
+            screening_paths["world_path"] = self.get_sub_world_path(
+                paths["world_path"], screening_configuration, paths=paths
+            )
+        for name in ["runs_path", "results_path"]:
+            screening_paths[name] = paths[name] / "screening"
+            screening_paths[name].mkdir(exist_ok=True, parents=True)
+        return screening_paths
+
+    def get_screening_system_configuration(
+        self, system_configuration, screening_configuration, paths
+    ):
+        """
+        The reduced world needs fewer cores and less memory than the full one.
+        ``cpus_per_job`` and ``memory_per_job`` can be given in the screening
+        configuration, otherwise ``auto`` is resolved for the reduced world.
+        """
+        system_configuration = deepcopy(system_configuration)
+        for key in ["cpus_per_job", "memory_per_job"]:
+            if key in screening_configuration:
+                system_configuration[key] = screening_configuration[key]
+        return self.resolve_job_layout(system_configuration, paths=paths)
+
+    def save_run_parameters(self, paths=None, script_maker=None, n_days=None):
+        """
+        Writes the parameters of every run. With a random seed, the seed of each
+        run is derived from a run set seed and the run number, so all the
+        policy variants of a run share their random streams. They also
+        reseed them per rank and subsystem (``common_random_numbers``) unless
+        the runner configuration says otherwise.
+        """
+        paths = paths or self.paths
+        script_maker = script_maker or self.script_maker
+        random_seed = self.run_configuration.get("random_seed", "random")
+        run_set_seed = self.run_set_seed
+        runner_configuration = dict(
+            self.run_configuration.get("runner_configuration", None) or {}
+        )
+        if type(self.paths["baseline_policy_path"]) == list:
+            runner_configuration.setdefault("common_random_numbers", True)
         for i, parameter in enumerate(self.parameter_generator):
             ret = {}
-            random_seed = self.run_configuration.get("random_seed", "random")
-            if random_seed == "random":
-                random_seed = random.randint(0, 1_000_000_000)
             ret["run_number"] = i
             ret["purpose_of_the_run"] = self.run_configuration.get(
                 "purpose_of_the_run", "no comment"
             )
-            ret["random_seed"] = random_seed
+            if run_set_seed is None:
+                ret["random_seed"] = random_seed
+            else:
+                ret["run_set_seed"] = run_set_seed
+                ret["random_seed"] = get_run_seed(run_set_seed, i)
             ret["parameters"] = parameter
-            ret["n_days"] = self.parameters["n_days"]
+            ret["n_days"] = n_days or self.parameters["n_days"]
+            ret["threads_per_rank"] = script_maker.threads_per_rank
+            ret["runner_configuration"] = runner_configuration
             ret["paths"] = {
                 "june_runs_path": self.paths["june_runs_path"],
-                "world_path": self.paths["world_path"],
+                "world_path": paths["world_path"],
                 "baseline_interaction_path": self.paths["baseline_interaction_path"],
                 "simulation_config_path": self.paths["simulation_config_path"],
+                "world_staging_path": script_maker.world_staging_path,
+                "cache_path": self.paths["cache_path"],
+                "static_records_path": self.paths["static_records_path"],
             }
             if type(self.paths["baseline_policy_path"]) == list:
                 directories_to_run = []
                 for policy_file in self.paths["baseline_policy_path"]:
                     name = policy_file.stem
-                    results_base = self.paths["results_path"] / f"{name}"
+                    results_base = paths["results_path"] / f"{name}"
                     directories_to_run.append(results_base)
                     ret["paths"]["results_path"] = (
                         results_base / f"run_{i:03d}"
                     )
                     ret["paths"]["baseline_policy_path"] = policy_file
                     ret["paths"]["save_path"] = (
-                        self.paths["runs_path"] / f"{name}/run_{i:03d}"
+                        paths["runs_path"] / f"{name}/run_{i:03d}"
                     )
                     ret["paths"]["results_path"].mkdir(exist_ok=True, parents=True)
                     ret["paths"]["save_path"].mkdir(exist_ok=True, parents=True)
@@ -155,10 +407,8 @@ class RunSetup:
                 ret["paths"]["baseline_policy_path"] = self.paths[
                     "baseline_policy_path"
                 ]
-                ret["paths"]["results_path"] = (
-                    self.paths["results_path"] / f"run_{i:03d}"
-                )
-                ret["paths"]["save_path"] = self.paths["runs_path"] / f"run_{i:03d}"
+                ret["paths"]["results_path"] = paths["results_path"] / f"run_{i:03d}"
+                ret["paths"]["save_path"] = paths["runs_path"] / f"run_{i:03d}"
                 ret["paths"]["results_path"].mkdir(exist_ok=True, parents=True)
                 ret["paths"]["save_path"].mkdir(exist_ok=True, parents=True)
                 with open(ret["paths"]["save_path"] / "parameters.json", "w") as f:
@@ -167,6 +417,57 @@ class RunSetup:
                     json.dump(ret, f, indent=4, default=str)
         return directories_to_run
 
+    def save_screening(self, directories_to_run):
+        """
+        Writes the parameters and scripts of the screening runs on the reduced
+        world, and ``screening.json`` with what ``python -m june_runs.screening``
+        needs to score them and promote the best to full fidelity.
+        """
+        screening_directories = self.save_run_parameters(
+            paths=self.screening_paths,
+            script_maker=self.screening_script_maker,
+            n_days=self.screening_n_days,
+        )
+        self.screening_script_maker.write_scripts(screening_directories)
+        scale = self.screening_configuration.get("scale", "auto")
+        if scale == "auto":
+            scale = get_scale_factor(
+                self.paths["world_path"], self.screening_paths["world_path"]
+            )
+        score_configuration = dict(self.screening_configuration["score"])
+        score_configuration["data_path"] = self._process_placeholders_in_lines(
+            lines=[score_configuration["data_path"]], paths=self.paths
+        )[0]
+        runs = []
+        for i in range(len(self.parameter_generator)):
+            for directory, screening_directory in zip(
+                directories_to_run or [None], screening_directories or [None]
+            ):
+                if screening_directory is None:
+                    screening_results_path = (
+                        self.screening_paths["results_path"] / f"run_{i:03d}"
+                    )
+                else:
+                    screening_results_path = screening_directory / f"run_{i:03d}"
+                output_dir = self.script_maker.get_output_dir(i, directory)
+                runs.append(
+                    {
+                        "screening_results_path": screening_results_path,
+                        "script_path": output_dir / "submit.sh",
+                    }
+                )
+        screening = {
+            "world_path": self.screening_paths["world_path"],
+            "n_days": self.screening_n_days,
+            "scale": scale,
+            "score": score_configuration,
+            "threshold": self.screening_configuration.get("threshold", None),
+            "keep_best": self.screening_configuration.get("keep_best", None),
+            "submission_command": self.script_maker.get_submission_command(),
+            "runs": runs,
+        }
+        with open(self.paths["save_path"] / screening_filename, "w") as f:
+            json.dump(screening, f, indent=4, default=str)
 
 
 if __name__ == "__main__":
@@ -202,4 +503,16 @@ if __name__ == "__main__":
     if args.copy_data:
         copy_input_data(run_setup.paths["data_path"])
     directories_to_run = run_setup.save_run_parameters()
-    run_setup.script_maker.write_scripts(directories_to_run)
+    if run_setup.screening_configuration is not None:
+        # only the screening runs are submitted first, the full runs that pass
+        # are submitted with submit_promoted.sh
+        run_setup.script_maker.write_scripts(
+            directories_to_run, write_submit_all=False
+        )
+        run_setup.save_screening(directories_to_run)
+        print(
+            "after the screening runs, promote the best ones to full fidelity with:\n"
+            f"    \033[035mpython -m june_runs.screening {run_setup.paths['save_path']}\033[0m"
+        )
+    else:
+        run_setup.script_maker.write_scripts(directories_to_run)
@@ -1,8 +1,10 @@
 import pytest
+import numpy as np
 
 from june.demography import Person, Population
 from june.interaction import Interaction
 from june_runs.setters import InteractionSetter
+from june_runs.setters.interaction_setter import get_susceptibilities_by_age
 
 @pytest.fixture(name='people')
 def make_pop():
@@ -25,6 +27,23 @@ def test__change_susceptibility(people):
             assert person.susceptibility == 1.0
 
 
+def test__susceptibility_lookup():
+    susceptibilities = {"13-20": 0.8, "0-5": 0.5, "50-100": 1.0}
+    ages = np.array([0, 4, 5, 13, 19, 20, 49, 50, 99, 105])
+    assert get_susceptibilities_by_age(ages, susceptibilities).tolist() == [
+        0.5,
+        0.5,
+        0.0,
+        0.8,
+        0.8,
+        0.0,
+        0.0,
+        1.0,
+        1.0,
+        1.0,
+    ]
+
+
 def test__change_betas(people):
     betas = {
         "care_home": 0.5,
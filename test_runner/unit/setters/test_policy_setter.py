@@ -122,3 +122,28 @@ class TestChangePoliciesParameters:
                             assert policy2.beta_factors[beta2] == 0.75
 
     # TODO: extend tests to all policy types.
+
+
+class TestPolicyTimeline:
+    @pytest.fixture(name="policies", scope="class")
+    def make_policies(self, policy_setter):
+        policies = policy_setter.make_policies()
+        timeline = policy_setter.make_policy_timeline(policies)
+        return policies, timeline
+
+    def test__active_policies_match(self, policies):
+        policies, timeline = policies
+        for date in ["2020-03-01", "2020-03-16", "2020-03-23", "2020-05-11", "2020-08-30"]:
+            date = datetime.strptime(date, "%Y-%m-%d")
+            expected = [policy for policy in policies if policy.is_active(date)]
+            assert timeline.get_active(date) == expected
+
+    def test__installed_collections(self, policies):
+        policies, timeline = policies
+        scanned = policies.leisure_policies.get_active
+        timeline.install(policies)
+        date = datetime.strptime("2020-06-20", "%Y-%m-%d")
+        assert policies.leisure_policies.get_active(date) == [
+            policy for policy in policies.leisure_policies if policy.is_active(date)
+        ]
+        assert policies.leisure_policies.get_active is not scanned
@@ -0,0 +1,124 @@
+import os
+import shutil
+import numpy as np
+
+from june_runs.cache import DiskCache, ObjectReferences, get_cache_key
+
+
+def test__cache_key_is_content_based():
+    assert get_cache_key({"a": 1, "b": 2}) == get_cache_key({"b": 2, "a": 1})
+    assert get_cache_key({"a": 1}) != get_cache_key({"a": 2})
+
+
+def test__get_or_compute(tmp_path):
+    cache = DiskCache(tmp_path / "cache")
+    calls = []
+
+    def compute(x):
+        calls.append(x)
+        return {"value": x}
+
+    assert cache.get_or_compute("table", {"x": 1}, compute, 1) == {"value": 1}
+    assert cache.get_or_compute("table", {"x": 1}, compute, 1) == {"value": 1}
+    assert calls == [1]
+    assert cache.get("table", {"x": 2}) is None
+
+
+def test__least_recently_used_is_evicted(tmp_path):
+    cache = DiskCache(tmp_path / "cache", max_entries=2)
+    cache.put("table", {"x": 1}, 1)
+    cache.put("table", {"x": 2}, 2)
+    # make the first entry the most recently used
+    os.utime(cache._entry_path("table", {"x": 2}), (0, 0))
+    assert cache.get("table", {"x": 1}) == 1
+    cache.put("table", {"x": 3}, 3)
+    assert len(cache.entries()) == 2
+    assert cache.get("table", {"x": 2}) is None
+    assert cache.get("table", {"x": 1}) == 1
+    assert cache.get("table", {"x": 3}) == 3
+
+
+def test__memory_mapped_arrays(tmp_path):
+    cache = DiskCache(tmp_path / "cache")
+    value = {"table": np.arange(10.0), "names": ["a", "b"]}
+    cache.put("table", {"x": 1}, value, memory_map=True)
+    cached = cache.get("table", {"x": 1})
+    assert isinstance(cached["table"], np.memmap)
+    assert not cached["table"].flags.writeable
+    assert np.array_equal(cached["table"], value["table"])
+    assert cached["names"] == ["a", "b"]
+    cache.get("table", {"x": 2})
+    statistics = cache.statistics()
+    assert statistics["table"]["hits"] == 1
+    assert statistics["table"]["misses"] == 1
+    assert statistics["table"]["hit_rate"] == 0.5
+
+
+class Venue:
+    def __init__(self, name):
+        self.name = name
+
+
+class World:
+    def __init__(self):
+        self.venues = [Venue("pub"), Venue("cinema")]
+        self.n_venues = 2
+
+
+class Distributor:
+    def __init__(self, venues, table):
+        self.venues = venues
+        self.table = table
+
+
+def test__references_are_not_copied(tmp_path):
+    cache = DiskCache(tmp_path / "cache")
+    world = World()
+    distributor = Distributor(venues=world.venues[::-1], table=np.arange(3))
+    cache.put("distributor", {"x": 1}, distributor, references=ObjectReferences(world))
+    cached = cache.get("distributor", {"x": 1}, references=ObjectReferences(world))
+    assert cached.venues[0] is world.venues[1]
+    assert cached.venues[1] is world.venues[0]
+    assert np.array_equal(cached.table, distributor.table)
+    # a fresh world built the same way
+    other_world = World()
+    cached = cache.get("distributor", {"x": 1}, references=ObjectReferences(other_world))
+    assert cached.venues[0] is other_world.venues[1]
+
+
+class SecondRankComm:
+    """
+    Rank 1 of two, another job evicts the entry while rank 0 waits at the barrier.
+    """
+
+    def __init__(self, cache, root_value):
+        self.cache = cache
+        self.root_value = root_value
+
+    def Get_rank(self):
+        return 1
+
+    def Get_size(self):
+        return 2
+
+    def Barrier(self):
+        for entry in self.cache.entries():
+            shutil.rmtree(entry)
+
+    def allreduce(self, value):
+        # rank 0 found it
+        return value + 1
+
+    def bcast(self, value, root=0):
+        return self.root_value
+
+
+def test__shared_entry_evicted_before_other_ranks_read_it(tmp_path):
+    cache = DiskCache(tmp_path / "cache")
+    # put by rank 0
+    cache.put("table", {"x": 1}, {"value": 1}, memory_map=True)
+    comm = SecondRankComm(cache, root_value={"value": 1})
+    value = cache.get_or_compute_shared(
+        "table", {"x": 1}, lambda: {"value": 2}, comm=comm, memory_map=True
+    )
+    assert value == {"value": 1}
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+
+from june.time import Timer
+from june_runs.common_random_numbers import (
+    RandomStreams,
+    get_run_seed,
+    get_stream_seed,
+    get_paired_differences,
+    summarise_paired_differences,
+)
+
+
+class MockActivityManager:
+    def do_timestep(self):
+        return np.random.random(3)
+
+
+class MockSimulator:
+    def __init__(self):
+        self.timer = Timer(initial_day="2020-03-01", total_days=2)
+        self.infection_seed = None
+        self.activity_manager = MockActivityManager()
+
+    def update_health_status(self, time, duration):
+        return np.random.random()
+
+
+def test__run_seeds():
+    assert get_run_seed(1234, 0) == get_run_seed(1234, 0)
+    assert get_run_seed(1234, 0) != get_run_seed(1234, 1)
+    assert get_stream_seed(1, rank=0, subsystem="activity", step=0) != get_stream_seed(
+        1, rank=1, subsystem="activity", step=0
+    )
+
+
+def test__streams_are_common():
+    draws = []
+    for policy_draws in [0, 5]:
+        simulator = MockSimulator()
+        RandomStreams(random_seed=1, rank=0, set_seed=np.random.seed).install(
+            simulator
+        )
+        next(simulator.timer)
+        # a policy that makes more draws in the activity manager
+        simulator.activity_manager.do_timestep()
+        np.random.random(policy_draws)
+        draws.append(simulator.update_health_status(time=0.5, duration=0.5))
+    assert draws[0] == draws[1]
+
+
+def test__paired_differences(tmp_path):
+    for policy, infected in [("baseline", [10, 20]), ("lockdown", [8, 12])]:
+        for run in range(2):
+            run_path = tmp_path / policy / f"run_{run:03d}"
+            run_path.mkdir(parents=True)
+            pd.DataFrame(
+                {
+                    "time_stamp": ["2020-03-01", "2020-03-01"],
+                    "region": ["London", "North East"],
+                    "daily_infected": [infected[run], 1],
+                }
+            ).to_csv(run_path / "summary.csv", index=False)
+    differences = get_paired_differences(tmp_path, baseline="baseline")
+    assert differences["policy"].unique().tolist() == ["lockdown"]
+    assert differences["daily_infected"].tolist() == [-2, -8]
+    summary = summarise_paired_differences(differences, "daily_infected")
+    assert summary.loc["lockdown", "mean"] == -5
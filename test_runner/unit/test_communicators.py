@@ -0,0 +1,27 @@
+import pytest
+from mpi4py import MPI
+
+import june.mpi_setup
+import june.simulator
+from june_runs.communicators import split_communicator, use_communicator
+
+
+def test__split_communicator():
+    comm, group, number_of_groups = split_communicator(1)
+    assert comm.Get_size() == 1
+    assert group == MPI.COMM_WORLD.Get_rank()
+    assert number_of_groups == MPI.COMM_WORLD.Get_size()
+    with pytest.raises(ValueError):
+        split_communicator(MPI.COMM_WORLD.Get_size() + 1)
+
+
+def test__june_uses_communicator():
+    world_comm = june.mpi_setup.mpi_comm
+    try:
+        use_communicator(MPI.COMM_SELF)
+        assert june.mpi_setup.mpi_comm is MPI.COMM_SELF
+        assert june.simulator.mpi_comm is MPI.COMM_SELF
+        assert june.simulator.mpi_size == 1
+    finally:
+        use_communicator(world_comm)
+    assert june.simulator.mpi_comm is world_comm
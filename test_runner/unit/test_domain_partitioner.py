@@ -0,0 +1,67 @@
+import h5py
+import numpy as np
+
+from june_runs.domain_partitioner import (
+    SuperAreaGraph,
+    partition_graph,
+    partition_hierarchy,
+)
+
+
+def make_grid_graph(n=20):
+    edges = []
+    for i in range(n):
+        for j in range(n):
+            if i + 1 < n:
+                edges.append((i * n + j, (i + 1) * n + j))
+            if j + 1 < n:
+                edges.append((i * n + j, i * n + j + 1))
+    weights = np.random.default_rng(0).integers(500, 1500, n * n)
+    return SuperAreaGraph(np.arange(n * n), weights, edges, np.full(len(edges), 10))
+
+
+def test__split_along_light_links():
+    # two groups of three super areas, linked by a single commuter
+    edges = [(0, 1), (1, 2), (0, 2), (3, 4), (4, 5), (3, 5), (2, 3)]
+    weights = [100, 100, 100, 100, 100, 100, 1]
+    graph = SuperAreaGraph(np.arange(6), np.ones(6), edges, weights)
+    membership = partition_graph(graph, 2)
+    assert len(set(membership[:3])) == 1
+    assert len(set(membership[3:])) == 1
+    assert graph.edge_cut(membership) == 1
+
+
+def test__balanced_hierarchy():
+    graph = make_grid_graph()
+    partitions = partition_hierarchy(graph, [8, 4, 2])
+    for number_of_parts, membership in partitions.items():
+        part_weights = np.bincount(membership, weights=graph.vertex_weights)
+        assert len(part_weights) == number_of_parts
+        assert part_weights.max() <= 1.03 * part_weights.mean()
+    random_membership = np.random.default_rng(0).integers(0, 8, graph.n_vertices)
+    assert graph.edge_cut(partitions[8]) < graph.edge_cut(random_membership) / 4
+    # domains of smaller runs are made of whole domains of larger ones
+    for part in range(8):
+        assert len(set(partitions[4][partitions[8] == part])) == 1
+
+
+def test__graph_from_world(tmp_path):
+    world_path = tmp_path / "world.hdf5"
+    with h5py.File(world_path, "w") as f:
+        geography = f.create_group("geography")
+        geography.create_dataset("area_id", data=np.arange(3))
+        geography.create_dataset("area_super_area", data=np.array([10, 11, 12]))
+        geography.create_dataset("super_area_id", data=np.array([10, 11, 12]))
+        population = f.create_group("population")
+        population.create_dataset("id", data=np.arange(3))
+        population.create_dataset("area", data=np.array([0, 0, 1]))
+        population.create_dataset("super_area", data=np.array([10, 10, 11]))
+        # person 0 works in super area 11, person 2 in 12
+        population.create_dataset(
+            "group_super_areas", data=np.array([[10, 11], [10, -999], [11, 12]])
+        )
+    graph = SuperAreaGraph.from_hdf5(world_path)
+    assert graph.vertex_weights.tolist() == [2, 1, 0]
+    neighbours, weights = graph.neighbours(1)
+    assert neighbours.tolist() == [0, 2]
+    assert weights.tolist() == [1, 1]
@@ -0,0 +1,188 @@
+import h5py
+import numpy as np
+import pandas as pd
+import tables
+from datetime import datetime
+
+from june.records import Record
+from june_runs.records import (
+    AggregateRecord,
+    AsyncRecordWriter,
+    SharedFileRecord,
+    combine_records,
+    combine_replicate_summaries,
+    get_replicate_path,
+    compress_record,
+    read_record_table,
+    write_static_reference,
+    _get_chunk_rows,
+)
+
+
+def write_table(path, table_name, data):
+    with tables.open_file(path, "w") as f:
+        f.create_table(f.root, table_name, obj=data)
+
+
+def test__static_tables_are_referenced(tmp_path):
+    static_path = tmp_path / "static_records" / "abc"
+    static_path.mkdir(parents=True)
+    people = np.array([(0, 10), (1, 20)], dtype=[("id", "<i4"), ("age", "<i4")])
+    write_table(static_path / "june_record.h5", "people", people)
+    run_path = tmp_path / "run_000"
+    run_path.mkdir()
+    infections = np.array([(0, 1)], dtype=[("infected_ids", "<i4"), ("location_ids", "<i4")])
+    write_table(run_path / "june_record.0.h5", "infections", infections)
+    with open(run_path / "summary.0.csv", "w") as f:
+        f.write("time_stamp,region,current_infected\n2020-03-01,London,1\n")
+    write_static_reference(run_path, static_path / "june_record.h5", key="abc")
+    results_path = tmp_path / "results"
+    results_path.mkdir()
+    combine_records(run_path, save_dir=results_path)
+    assert read_record_table(results_path, "people")["age"].tolist() == [10, 20]
+    assert read_record_table(results_path, "infections")["infected_ids"].tolist() == [0]
+
+
+def test__daily_aggregates(tmp_path):
+    record = AggregateRecord(tmp_path, recording_level="daily_aggregates", n_days=3)
+    for day, n_infections in [(1, 2), (1, 1), (2, 4)]:
+        record.accumulate(
+            "infections",
+            location_spec="household",
+            location_id=0,
+            region_name="London",
+            infector_ids=list(range(n_infections)),
+            infected_ids=list(range(n_infections)),
+        )
+        record.time_step(datetime(2020, 3, day, 8))
+    record.finalise()
+    with tables.open_file(tmp_path / "june_record.h5", "r") as f:
+        daily_events = f.root.daily_events.read()
+        assert len(f.root.infections) == 0
+    assert daily_events["infections"].tolist() == [3, 4, 0, 0]
+
+
+def test__daily_aggregates_are_summed_over_ranks(tmp_path):
+    for mpi_rank, n_infections in [(0, 2), (1, 3)]:
+        record = AggregateRecord(
+            tmp_path, recording_level="daily_aggregates", n_days=1, mpi_rank=mpi_rank
+        )
+        record.accumulate(
+            "infections",
+            location_spec="household",
+            location_id=0,
+            region_name="London",
+            infector_ids=list(range(n_infections)),
+            infected_ids=list(range(n_infections)),
+        )
+        record.time_step(datetime(2020, 3, 1, 8))
+        record.finalise()
+    combine_records(tmp_path)
+    with tables.open_file(tmp_path / "june_record.h5", "r") as f:
+        daily_events = f.root.daily_events.read()
+        assert len(f.root.daily_events_by_age) == 4 * 6 * 2
+    assert daily_events["timestamp"].tolist() == [b"2020-03-01", b"2020-03-02"]
+    assert daily_events["infections"].tolist() == [5, 0]
+
+
+def test__async_record_writer(tmp_path):
+    record = AsyncRecordWriter(Record(tmp_path), max_queued_steps=1)
+    for day in [1, 2, 3]:
+        record.accumulate(
+            "infections",
+            location_spec="household",
+            location_id=0,
+            region_name="London",
+            infector_ids=[0, 1],
+            infected_ids=[2, 3],
+        )
+        record.time_step(datetime(2020, 3, day))
+        assert record.events["infections"].number_of_events == 0
+    record.finalise()
+    with tables.open_file(tmp_path / "june_record.h5", "r") as f:
+        infections = f.root.infections.read()
+    assert infections["infected_ids"].tolist() == [2, 3, 2, 3, 2, 3]
+    assert record.write_time > 0
+
+
+class SingleRankComm:
+    def Get_size(self):
+        return 1
+
+    def exscan(self, value):
+        return None
+
+    def allreduce(self, value):
+        return value
+
+
+def test__shared_file_record(tmp_path):
+    record = SharedFileRecord(
+        tmp_path, shared_file_path=tmp_path / "shared.h5", comm=SingleRankComm(), chunk_size=2
+    )
+    for day in [1, 2]:
+        record.accumulate(
+            "infections",
+            location_spec="household",
+            location_id=0,
+            region_name="London",
+            infector_ids=[0, 1, 2],
+            infected_ids=[3, 4, 5],
+        )
+        record.time_step(datetime(2020, 3, day))
+    record.finalise()
+    with h5py.File(tmp_path / "shared.h5", "r") as f:
+        infections = f["infections"][:]
+        assert f["deaths"].shape == (0,)
+    assert infections["infected_ids"].tolist() == [3, 4, 5, 3, 4, 5]
+    assert infections["timestamp"][-1] == b"2020-03-02"
+
+
+def test__compress_record(tmp_path):
+    infections = np.rec.fromarrays(
+        [
+            np.repeat(np.array(["2020-03-01", "2020-03-02"], dtype="S10"), 500),
+            np.arange(1000, dtype=np.int64),
+        ],
+        names=["timestamp", "infected_ids"],
+    )
+    write_table(tmp_path / "june_record.h5", "infections", infections)
+    report = compress_record(
+        tmp_path / "june_record.h5", {"compression": "gzip", "days_per_chunk": 1}
+    )
+    assert report["bytes_saved"] > 0
+    with tables.open_file(tmp_path / "june_record.h5", "r") as f:
+        table = f.root.infections
+        assert table.chunkshape == (500,)
+        assert table.filters.complib == "zlib"
+        assert table.coldtypes["infected_ids"] == np.dtype(np.uint16)
+        assert table.read()["infected_ids"].tolist() == list(range(1000))
+
+
+def test__chunks_are_capped_in_bytes():
+    population = np.rec.fromarrays(
+        [np.arange(10 ** 6, dtype=np.int64)], names=["id"]
+    )
+    assert _get_chunk_rows(population, days_per_chunk=7) == 2 ** 17
+    assert _get_chunk_rows(population[:10], days_per_chunk=7) == 10
+    infections = np.rec.fromarrays(
+        [
+            np.repeat(np.array(["2020-03-01", "2020-03-02"], dtype="S10"), 500),
+            np.arange(1000, dtype=np.int64),
+        ],
+        names=["timestamp", "infected_ids"],
+    )
+    assert _get_chunk_rows(infections, days_per_chunk=1) == 500
+    assert _get_chunk_rows(infections, days_per_chunk=1, chunk_bytes=1800) == 100
+
+
+def test__combine_replicate_summaries(tmp_path):
+    for replicate in range(2):
+        replicate_path = get_replicate_path(tmp_path, replicate)
+        replicate_path.mkdir()
+        with open(replicate_path / "summary.csv", "w") as f:
+            f.write(f"region,time_stamp,current_infected\nLondon,2020-03-01,{replicate + 1}\n")
+    combine_replicate_summaries(tmp_path, 2)
+    summary = pd.read_csv(tmp_path / "summary.csv")
+    assert summary["replicate"].tolist() == [0, 1]
+    assert summary["current_infected"].tolist() == [1, 2]
@@ -0,0 +1,84 @@
+import shutil
+import yaml
+
+from june_runs import scaling_advisor, script_maker
+from june_runs.scaling_advisor import ScalingAdvisor, ScalingBenchmark
+
+
+def make_run_statistics():
+    # the world loads in parallel, the days scale best up to 4 ranks, 4 GB per rank
+    return [
+        {
+            "n_ranks": n_ranks,
+            "setup_time": 240 / n_ranks,
+            "time_per_day": time_per_day,
+            "max_memory_per_rank": 4,
+        }
+        for n_ranks, time_per_day in [(1, 400), (2, 200), (4, 95), (8, 90)]
+    ]
+
+
+def use_configuration_path(monkeypatch, tmp_path):
+    configuration_path = tmp_path / "configuration"
+    (configuration_path / "system").mkdir(parents=True)
+    shutil.copy(
+        script_maker.configuration_path / "system/cosma8.yaml",
+        configuration_path / "system/cosma8.yaml",
+    )
+    monkeypatch.setattr(scaling_advisor, "configuration_path", configuration_path)
+    monkeypatch.setattr(script_maker, "configuration_path", configuration_path)
+    return configuration_path
+
+
+def test__recommend_most_runs_per_core_hour():
+    advisor = ScalingAdvisor(make_run_statistics())
+    table = advisor.get_scaling_table(
+        n_days=10, cores_per_node=64, memory_per_node=1000
+    )
+    assert [row["parallel_efficiency"] for row in table][:2] == [1, 1]
+    recommendation = advisor.recommend(
+        n_days=10, cores_per_node=64, memory_per_node=1000, memory_margin=1.0
+    )
+    # 8 ranks are faster, but use more core hours
+    assert recommendation == {"cpus_per_job": 4, "memory_per_job": 16}
+
+
+def test__memory_hungry_jobs_are_charged_for_idle_cores():
+    advisor = ScalingAdvisor(make_run_statistics())
+    # 1 GB per core, so a rank of 4 GB leaves 3 cores unusable
+    table = advisor.get_scaling_table(n_days=10, cores_per_node=64, memory_per_node=64)
+    assert table[0]["runs_per_core_hour"] == 3600 / (4 * (240 + 10 * 400))
+    # only a single rank fits in a node with 6 GB
+    recommendation = advisor.recommend(
+        n_days=10, cores_per_node=4, memory_per_node=6, memory_margin=1.0
+    )
+    assert recommendation["cpus_per_job"] == 1
+
+
+def test__recommendation_feeds_back_into_layouts(monkeypatch, tmp_path):
+    configuration_path = use_configuration_path(monkeypatch, tmp_path)
+    advisor = ScalingAdvisor(make_run_statistics())
+    recommendation = advisor.save_recommendation(
+        system="cosma8", world_name="england", n_days=10, memory_margin=1.0
+    )
+    with open(configuration_path / "system/layouts/cosma8.yaml") as f:
+        assert yaml.load(f, Loader=yaml.FullLoader) == {"england": recommendation}
+    system_configuration = script_maker.load_system_configuration("cosma8")
+    assert system_configuration["recommended_layouts"]["england"] == recommendation
+
+
+def test__benchmark_runs_like_production_jobs(monkeypatch, tmp_path):
+    configuration_path = use_configuration_path(monkeypatch, tmp_path)
+    with open(configuration_path / "system/cosma8.yaml", "a") as f:
+        f.write("threads_per_rank: 4\n")
+    benchmark = ScalingBenchmark(
+        world_path=tmp_path / "world.hdf5",
+        save_path=tmp_path / "benchmark",
+        system="cosma8",
+    )
+    script_path = benchmark.write_run(2)
+    with open(script_path) as f:
+        running_script = f.read()
+    assert "os.environ['OMP_NUM_THREADS'] = '4'" in running_script
+    assert "os.environ['NUMBA_NUM_THREADS'] = '4'" in running_script
+    assert (script_path.parent / "parameters.json").is_file()
@@ -0,0 +1,65 @@
+import json
+import numpy as np
+import pandas as pd
+
+from june_runs.screening import (
+    promote,
+    score_run,
+    select_runs,
+    read_daily_totals,
+    screening_filename,
+)
+
+
+def write_summary(results_path, deaths):
+    results_path.mkdir(parents=True)
+    pd.DataFrame(
+        {
+            "time_stamp": ["2020-03-01", "2020-03-01", "2020-03-02", "2020-03-02"],
+            "region": ["London", "North East"] * 2,
+            "daily_deaths": deaths,
+        }
+    ).to_csv(results_path / "summary.csv", index=False)
+
+
+def test__score_and_select():
+    observed = pd.Series([10, 20], index=pd.to_datetime(["2020-03-01", "2020-03-02"]))
+    simulated = pd.Series([1, 2], index=pd.to_datetime(["2020-03-01", "2020-03-02"]))
+    assert score_run(simulated, observed, scale=10) == 0
+    assert score_run(simulated, observed, scale=1) > 0
+    assert score_run(simulated[:0], observed) == np.inf
+    scores = {"a": 0.5, "b": 0.1, "c": 2.0}
+    assert select_runs(scores, threshold=1.0) == ["b", "a"]
+    assert select_runs(scores, keep_best=1) == ["b"]
+
+
+def test__promote(tmp_path):
+    write_summary(tmp_path / "screening" / "run_000", [1, 0, 1, 1])
+    write_summary(tmp_path / "screening" / "run_001", [5, 5, 5, 5])
+    assert read_daily_totals(tmp_path / "screening" / "run_000", "daily_deaths").tolist() == [1, 2]
+    pd.DataFrame({"date": ["2020-03-01", "2020-03-02"], "deaths": [10, 20]}).to_csv(
+        tmp_path / "deaths.csv", index=False
+    )
+    screening = {
+        "scale": 10,
+        "score": {
+            "column": "daily_deaths",
+            "data_column": "deaths",
+            "data_path": str(tmp_path / "deaths.csv"),
+        },
+        "threshold": 0.5,
+        "submission_command": "sbatch",
+        "runs": [
+            {
+                "screening_results_path": str(tmp_path / "screening" / f"run_{i:03d}"),
+                "script_path": f"runs/run_{i:03d}/submit.sh",
+            }
+            for i in range(3)
+        ],
+    }
+    with open(tmp_path / screening_filename, "w") as f:
+        json.dump(screening, f)
+    promoted = promote(tmp_path)
+    assert promoted == [str(tmp_path / "screening" / "run_000")]
+    with open(tmp_path / "submit_promoted.sh") as f:
+        assert "sbatch runs/run_000/submit.sh" in f.read()
@@ -0,0 +1,89 @@
+from june_runs.script_maker import ScriptMaker
+
+
+def make_script_maker(tmp_path, system="cosma8", **kwargs):
+    return ScriptMaker(
+        system=system,
+        run_directory=tmp_path / "runs",
+        cpus_per_job=32,
+        number_of_jobs=1,
+        **kwargs,
+    )
+
+
+def test__launch_flags(tmp_path):
+    script_maker = make_script_maker(tmp_path, threads_per_rank=4)
+    # 64 cores per node
+    assert script_maker.ranks_per_node == 16
+    assert (
+        script_maker.make_launch_flags() == " --map-by ppr:16:node:PE=4 --bind-to core"
+    )
+    # one thread per rank keeps the plain launch
+    assert make_script_maker(tmp_path).make_launch_flags() == ""
+    # systems without launch flags too
+    script_maker = make_script_maker(tmp_path, system="jasmin", threads_per_rank=4)
+    assert script_maker.make_launch_flags() == ""
+
+
+def test__hybrid_layout_script(tmp_path):
+    script_maker = make_script_maker(tmp_path, threads_per_rank=4)
+    output_dir = script_maker.get_output_dir(0)
+    header = script_maker.make_script_header(0, stdout_name="run_000")
+    assert "#SBATCH --ntasks 32" in header
+    assert "#SBATCH --ntasks-per-node 16" in header
+    assert "#SBATCH --cpus-per-task 4" in header
+    running_script = script_maker.make_running_script(output_dir)
+    assert "os.environ['OMP_NUM_THREADS'] = '4'" in running_script
+    assert "os.environ['NUMBA_NUM_THREADS'] = '4'" in running_script
+    command = script_maker.make_python_command(0, output_dir)
+    assert command[-1].startswith(
+        "mpirun -np 32 --map-by ppr:16:node:PE=4 --bind-to core python3 -u"
+    )
+    # one thread per rank leaves the placement to the scheduler
+    header = make_script_maker(tmp_path).make_script_header(0, stdout_name="run_000")
+    assert not any("--cpus-per-task" in line for line in header)
+
+
+def test__world_staging_command(tmp_path):
+    script_maker = make_script_maker(
+        tmp_path, world_path=tmp_path / "world.hdf5", stage_world=True
+    )
+    staging_command = script_maker.make_staging_command()
+    assert len(staging_command) == 1
+    assert staging_command[0].startswith(
+        "srun --ntasks=$SLURM_JOB_NUM_NODES --ntasks-per-node=1 python3 "
+    )
+    assert staging_command[0].endswith(
+        f"june_runs/staging.py {tmp_path / 'world.hdf5'} /tmp/june_worlds"
+    )
+    # other schedulers start one process per node with mpirun
+    script_maker = make_script_maker(
+        tmp_path, system="hartree", world_path=tmp_path / "world.hdf5", stage_world=True
+    )
+    assert script_maker.make_staging_command()[0].startswith(
+        "mpirun --map-by ppr:1:node python3 "
+    )
+    assert make_script_maker(tmp_path).make_staging_command() == []
+
+
+def test__environment_staging_command(tmp_path):
+    archive_path = tmp_path / "june_env.tar"
+    archive_path.write_text("archive")
+    script_maker = make_script_maker(tmp_path, environment_archive=archive_path)
+    local_path = script_maker.local_environment_path
+    assert script_maker.python_executable == f"{local_path}/venv/bin/python3"
+    unpack, python_path = script_maker.make_environment_staging_command()
+    assert unpack.startswith(
+        "srun --ntasks=$SLURM_JOB_NUM_NODES --ntasks-per-node=1 "
+        f"flock {local_path}.lock bash -c"
+    )
+    assert f"tar -xf {archive_path} -C {local_path}" in unpack
+    # later jobs on the node skip unpacked environments
+    assert f"[ -f {local_path}/.complete ] ||" in unpack
+    assert python_path == f"export PYTHONPATH={local_path}/packages:$PYTHONPATH"
+    script_maker = make_script_maker(
+        tmp_path, environment_archive=archive_path, environment_format="squashfs"
+    )
+    mount, _ = script_maker.make_environment_staging_command()
+    assert f"(mountpoint -q {local_path} || squashfuse {archive_path}" in mount
+    assert make_script_maker(tmp_path).make_environment_staging_command() == []
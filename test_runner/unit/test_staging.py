@@ -0,0 +1,67 @@
+import os
+import json
+import tarfile
+
+from june_runs.staging import stage_file, file_checksum, pack_environment
+
+
+def write_world(path, content=b"world"):
+    with open(path, "wb") as f:
+        f.write(content * 1000)
+
+
+def test__stage_file(tmp_path):
+    source_path = tmp_path / "world.hdf5"
+    write_world(source_path)
+    staged_path = stage_file(source_path, tmp_path / "scratch")
+    assert staged_path.parent == tmp_path / "scratch"
+    assert staged_path.read_bytes() == source_path.read_bytes()
+    with open(staged_path.with_name(staged_path.name + ".json")) as f:
+        manifest = json.load(f)
+    assert manifest["source_path"] == str(source_path.resolve())
+    assert manifest["source_size"] == source_path.stat().st_size
+    assert manifest["staged_mtime"] == staged_path.stat().st_mtime
+    assert manifest["checksum"] == file_checksum(source_path)
+
+
+def test__staged_file_is_reused_until_the_source_changes(tmp_path):
+    source_path = tmp_path / "world.hdf5"
+    write_world(source_path)
+    staged_path = stage_file(source_path, tmp_path / "scratch")
+    # mark the copy, keeping its size and modification time
+    staged_stat = staged_path.stat()
+    write_world(staged_path, b"stale")
+    os.utime(staged_path, ns=(staged_stat.st_atime_ns, staged_stat.st_mtime_ns))
+    assert stage_file(source_path, tmp_path / "scratch") == staged_path
+    assert staged_path.read_bytes() == b"stale" * 1000
+    # the copy is checksummed again on request
+    stage_file(source_path, tmp_path / "scratch", verify=True)
+    assert staged_path.read_bytes() == b"world" * 1000
+    # a new version of the world
+    write_world(source_path, b"newer")
+    os.utime(source_path, (0, 0))
+    stage_file(source_path, tmp_path / "scratch")
+    assert staged_path.read_bytes() == b"newer" * 1000
+
+
+def test__pack_environment(tmp_path):
+    virtual_env_path = tmp_path / "venv"
+    (virtual_env_path / "bin").mkdir(parents=True)
+    (virtual_env_path / "bin/python3").write_text("python")
+    package_path = tmp_path / "src/june"
+    (package_path / "__pycache__").mkdir(parents=True)
+    (package_path / "__init__.py").write_text("")
+    (package_path / "__pycache__/__init__.pyc").write_text("")
+    archive_path = pack_environment(
+        tmp_path / "archives/june_env.tar",
+        virtual_env_path=virtual_env_path,
+        package_paths=[package_path],
+        symlinks={"data": tmp_path / "data"},
+    )
+    with tarfile.open(archive_path) as archive:
+        members = {member.name: member for member in archive.getmembers()}
+    assert "venv/bin/python3" in members
+    assert "packages/june/__init__.py" in members
+    assert "packages/june/__pycache__" not in members
+    assert members["packages/data"].issym()
+    assert members["packages/data"].linkname == str(tmp_path / "data")
@@ -0,0 +1,136 @@
+import h5py
+import numpy as np
+
+from june_runs.sub_world import (
+    nan_integer,
+    get_super_areas_to_keep,
+    get_sub_world,
+)
+
+int_vlen_type = h5py.vlen_dtype(np.dtype("int64"))
+
+
+def make_world(path):
+    """
+    Super areas 0 and 1 in the North West, 2 in the North East. Person 0 lives
+    in super area 0 and works in 2, person 2 lives and works in super area 1.
+    """
+    with h5py.File(path, "w") as f:
+        geography = f.create_group("geography")
+        geography.attrs.update({"n_areas": 4, "n_super_areas": 3, "n_regions": 2})
+        geography.create_dataset("area_id", data=np.arange(4))
+        geography.create_dataset("area_super_area", data=np.array([0, 0, 1, 2]))
+        geography.create_dataset("super_area_id", data=np.arange(3))
+        geography.create_dataset(
+            "super_area_name", data=np.array([b"E0", b"E1", b"E2"])
+        )
+        geography.create_dataset("super_area_region", data=np.array([0, 0, 1]))
+        geography.create_dataset("super_area_city", data=np.array([0, 0, 1]))
+        geography.create_dataset("super_area_n_workers", data=np.array([0, 1, 1]))
+        geography.create_dataset(
+            "super_area_coordinates", data=np.array([[0.0, 0], [1, 1], [10, 10]])
+        )
+        geography.create_dataset(
+            "closest_hospitals_ids", data=np.array([[0, 0], [1, 0], [0, 1]])
+        )
+        geography.create_dataset(
+            "closest_hospitals_super_areas", data=np.array([[2, 2], [1, 2], [2, 1]])
+        )
+        geography.create_dataset("region_id", data=np.arange(2))
+        geography.create_dataset(
+            "region_name", data=np.array([b"North West", b"North East"])
+        )
+        population = f.create_group("population")
+        population.attrs["n_people"] = 3
+        population.create_dataset("id", data=np.arange(3))
+        population.create_dataset("super_area", data=np.array([0, 2, 1]))
+        population.create_dataset(
+            "group_ids", data=np.array([[0, 0], [1, -999], [2, 1]])
+        )
+        population.create_dataset(
+            "group_specs", data=np.array([[b"household", b"company"]] * 3)
+        )
+        population.create_dataset(
+            "subgroup_types", data=np.array([[0, 0], [0, -999], [0, 0]])
+        )
+        population.create_dataset(
+            "group_super_areas", data=np.array([[0, 2], [2, -999], [1, 1]])
+        )
+        population.create_dataset("work_super_area", data=np.array([2, -999, 1]))
+        population.create_dataset("work_super_area_city", data=np.array([1, -999, 0]))
+        population.create_dataset("work_super_area_coords", data=np.ones((3, 2)))
+        households = f.create_group("households")
+        households.attrs["n_households"] = 3
+        households.create_dataset("id", data=np.arange(3))
+        households.create_dataset("super_area", data=np.array([0, 2, 1]))
+        households_to_visit = np.empty(3, dtype=object)
+        households_to_visit[:] = [np.array([1, 2]), np.array([0]), np.array([1])]
+        households.create_dataset(
+            "households_to_visit", data=households_to_visit, dtype=int_vlen_type
+        )
+        companies = f.create_group("companies")
+        companies.attrs["n_companies"] = 2
+        companies.create_dataset("id", data=np.arange(2))
+        companies.create_dataset("super_area", data=np.array([2, 1]))
+        hospitals = f.create_group("hospitals")
+        hospitals.attrs["n_hospitals"] = 2
+        hospitals.create_dataset("id", data=np.arange(2))
+        hospitals.create_dataset("super_area", data=np.array([2, 1]))
+        hospitals.create_dataset("coordinates", data=np.array([[10.0, 10], [1, 1]]))
+        cities = f.create_group("cities")
+        cities.attrs["n_cities"] = 2
+        cities.create_dataset("id", data=np.arange(2))
+        cities.create_dataset("name", data=np.array([b"Manchester", b"Newcastle"]))
+        cities.create_dataset(
+            "super_areas", data=np.array([[b"E0", b"E2"], [b"E2", b"E1"]])
+        )
+        cities.create_dataset("city_super_area", data=np.array([0, 2]))
+        cities.create_dataset("internal_commuters", data=np.array([[0, 1], [1, 2]]))
+        cities.create_dataset("city_station_id", data=np.array([[0], [1]]))
+        cities.create_dataset("inter_city_station_id", data=np.array([[1], [0]]))
+        stations = f.create_group("stations")
+        stations.attrs["n_stations"] = 2
+        stations.create_dataset("id", data=np.arange(2))
+        stations.create_dataset("super_area", data=np.array([0, 2]))
+        stations.create_dataset(
+            "station_cities", data=np.array([b"Manchester", b"Newcastle"])
+        )
+        commuters = np.empty(2, dtype=object)
+        commuters[:] = [np.array([0, 1]), np.array([1])]
+        stations.create_dataset("commuters", data=commuters, dtype=int_vlen_type)
+
+
+def test__super_areas_to_keep(tmp_path):
+    world_path = tmp_path / "world.hdf5"
+    make_world(world_path)
+    super_areas = get_super_areas_to_keep(world_path, regions=["North West"])
+    assert super_areas.tolist() == [0, 1]
+    super_areas = get_super_areas_to_keep(world_path, super_areas=["E2", 0])
+    assert super_areas.tolist() == [0, 2]
+
+
+def test__sub_world(tmp_path):
+    world_path = tmp_path / "world.hdf5"
+    make_world(world_path)
+    sub_world_path = get_sub_world(world_path, regions=["North West"])
+    with h5py.File(sub_world_path, "r") as f:
+        geography = f["geography"]
+        assert geography.attrs["n_super_areas"] == 2
+        assert geography["region_name"][:].tolist() == [b"North West"]
+        assert geography["closest_hospitals_ids"][:].tolist() == [[1], [1]]
+        assert geography["super_area_n_workers"][:].tolist() == [0, 1]
+        population = f["population"]
+        assert population["id"][:].tolist() == [0, 2]
+        assert population["group_ids"][:].tolist() == [[0, nan_integer], [2, 1]]
+        assert population["work_super_area"][:].tolist() == [nan_integer, 1]
+        assert f["households"]["id"][:].tolist() == [0, 2]
+        visits = f["households"]["households_to_visit"][:]
+        visits = [values.tolist() for values in visits]
+        assert visits == [[2], [nan_integer]]
+        assert f["companies"]["id"][:].tolist() == [1]
+        assert f["cities"]["super_areas"][:].tolist() == [[b"E0"]]
+        assert f["cities"]["internal_commuters"][:].tolist() == [[0]]
+        assert f["cities"]["inter_city_station_id"].shape == (1,)
+        assert f["stations"]["commuters"][0].tolist() == [0]
+    # the same super areas, selected by name, reuse the cached sub-world
+    assert get_sub_world(world_path, super_areas=["E0", "E1"]) == sub_world_path
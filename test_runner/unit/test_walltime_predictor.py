@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from june_runs.walltime_predictor import (
+    WalltimePredictor,
+    parse_walltime,
+    format_walltime,
+)
+
+
+def test__walltime_conversions():
+    assert parse_walltime("72:00:00") == 72 * 3600
+    assert parse_walltime("48:00") == 48 * 3600
+    assert format_walltime(3661, scheduler="slurm") == "01:01:01"
+    assert format_walltime(3661, scheduler="lsf") == "01:02"
+
+
+def test__predictor_recovers_linear_model():
+    run_statistics = []
+    for world_size in [1, 5, 10]:
+        for n_ranks in [2, 8]:
+            for n_days, betas in [(10, 2.0), (50, 3.0), (50, 2.0)]:
+                features = {
+                    "world_size": world_size,
+                    "n_ranks": n_ranks,
+                    "n_days": n_days,
+                    "betas": betas,
+                    "seed_strength": 1.0,
+                }
+                features["wall_time"] = (
+                    100 + 20 * world_size / n_ranks + n_days * 60 * world_size / n_ranks
+                )
+                run_statistics.append(features)
+    predictor = WalltimePredictor.from_run_statistics(
+        run_statistics, safety_margin=1.5, minimum_time=0
+    )
+    features = {
+        "world_size": 4,
+        "n_ranks": 4,
+        "n_days": 30,
+        "betas": 2.0,
+        "seed_strength": 1.0,
+    }
+    expected = 100 + 20 + 30 * 60
+    assert np.isclose(predictor.predict_duration(features), expected)
+    assert np.isclose(predictor.predict_walltime(features), 1.5 * expected)
+    assert predictor.predict_walltime(features, max_time=1000) == 1000
+
+
+def test__predictor_falls_back_to_daily_rate():
+    # a single run set with the same betas can't separate the coefficients
+    run_statistics = [
+        {
+            "world_size": 10,
+            "n_ranks": 5,
+            "n_days": n_days,
+            "betas": 2.0,
+            "seed_strength": 1.0,
+            "wall_time": 100 * n_days,
+        }
+        for n_days in [10, 20]
+    ]
+    with pytest.warns(UserWarning):
+        predictor = WalltimePredictor.from_run_statistics(
+            run_statistics, safety_margin=1.0, minimum_time=0
+        )
+    features = dict(run_statistics[0], n_days=40, n_ranks=10)
+    assert np.isclose(predictor.predict_duration(features), 40 * 50)
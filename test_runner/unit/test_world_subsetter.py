@@ -0,0 +1,75 @@
+import h5py
+import numpy as np
+
+from june_runs.world_subsetter import (
+    indices_to_ranges,
+    get_rows_per_domain,
+    write_world_subset,
+    split_world,
+    read_domain_partition,
+)
+
+
+def make_world(path):
+    with h5py.File(path, "w") as f:
+        geography = f.create_group("geography")
+        geography.create_dataset("area_id", data=np.arange(4))
+        geography.create_dataset("area_super_area", data=np.array([0, 0, 1, 1]))
+        population = f.create_group("population")
+        population.attrs["n_people"] = 8
+        population.create_dataset("id", data=np.arange(8))
+        population.create_dataset("area", data=np.array([0, 1, 2, 3, 0, 1, 2, 3]))
+        households = f.create_group("households")
+        households.attrs["n_households"] = 4
+        households.create_dataset("id", data=np.arange(4))
+        households.create_dataset("area", data=np.array([0, 2, 1, 3]))
+
+
+def test__indices_to_ranges():
+    ranges = indices_to_ranges([0, 1, 2, 5, 7, 8])
+    assert ranges.tolist() == [[0, 3], [5, 6], [7, 9]]
+    assert indices_to_ranges([]).shape == (0, 2)
+
+
+def test__world_subset(tmp_path):
+    world_path = tmp_path / "world.hdf5"
+    make_world(world_path)
+    rows_per_domain = get_rows_per_domain(world_path, {0: 0, 1: 1})
+    assert rows_per_domain[0]["population"].tolist() == [[0, 2], [4, 6]]
+    assert rows_per_domain[1]["households"].tolist() == [[1, 2], [3, 4]]
+    subset_path = tmp_path / "domain_1.hdf5"
+    with h5py.File(world_path, "r") as f:
+        write_world_subset(f, subset_path, rows=rows_per_domain[1])
+    with h5py.File(subset_path, "r") as f:
+        assert f["population"]["id"][:].tolist() == [2, 3, 6, 7]
+        assert f["population"].attrs["n_people"] == 4
+        assert f["households"]["id"][:].tolist() == [1, 3]
+        assert f["geography"]["area_id"][:].tolist() == [0, 1, 2, 3]
+
+
+def test__split_world(tmp_path):
+    world_path = tmp_path / "world.hdf5"
+    make_world(world_path)
+    domain_paths = split_world(world_path, tmp_path / "split", {0: 0, 1: 1})
+    assert len(domain_paths) == 2
+    domain_id, number_of_domains, partition = read_domain_partition(domain_paths[0])
+    assert domain_id == 0
+    assert number_of_domains == 2
+    assert partition == {0: 0, 1: 1}
+    with h5py.File(domain_paths[0], "r") as f:
+        assert f["population"]["id"][:].tolist() == [0, 1, 4, 5]
+
+
+def test__split_world_with_empty_domains(tmp_path):
+    world_path = tmp_path / "world.hdf5"
+    make_world(world_path)
+    domain_paths = split_world(
+        world_path, tmp_path / "split", {0: 0, 1: 2}, number_of_domains=4
+    )
+    assert len(domain_paths) == 4
+    for domain_path in domain_paths:
+        _, number_of_domains, _ = read_domain_partition(domain_path)
+        assert number_of_domains == 4
+    with h5py.File(domain_paths[3], "r") as f:
+        assert f["population"]["id"].shape == (0,)
+        assert f["population"].attrs["n_people"] == 0